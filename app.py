@@ -1,38 +1,21 @@
 import time
 
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 import matplotlib.pyplot as plt
-import sqlite3
 from datetime import datetime, timedelta
-import google.generativeai as genai
-import os
-from tessa import Symbol
+from db import ALL_STOCK_DB, get_connection, run_migrations
+from refresher import start_refresher
+from price_store import ensure_bars, period_returns, track_network_calls
+from fetcher import get_fetch_executor
 
 st.set_page_config(layout="wide")
 
 
 soxx_stocks = ['AVGO', 'NVDA', 'AMD', 'AMAT', 'QCOM', 'LRCX', 'TSM', 'KLAC', 'INTC', 'MRVL', 'MU', 'MPWR', 'TXN', 'ASML', 'NXPI', 'ADI', 'MCHP', 'ON', 'TER', 'ENTG', 'SWKS', 'QRVO', 'STM', 'MKSI', 'ASX', 'LSCC', 'RMBS', 'UMC', 'ACLS', 'WOLF', '7203.T']
 
-conn = sqlite3.connect('all_stock_data.db')
-c = conn.cursor()
-
-c.execute('''
-    CREATE TABLE IF NOT EXISTS stocks (
-        company TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        percent_change REAL
-    )
-''')
-# Create table for storing custom stock lists if it doesn't exist
-c.execute('''
-    CREATE TABLE IF NOT EXISTS stock_lists (
-        list_name TEXT,
-        tickers TEXT
-    )
-''')
+st.cache_resource(run_migrations)()
+st.cache_resource(start_refresher)()
 
 
 if 'combined_quarterly' not in st.session_state:
@@ -42,44 +25,41 @@ def get_stock_data(tickers, start_date, end_date, source="yfinance"):
     data = {}
 
     if source == "yfinance":
-        for ticker in tickers:
-            stock = yf.Ticker(ticker)
-            hist = stock.history(start=start_date, end=end_date)
-            if not hist.empty:
-                start_price = hist['Close'][0]
-                end_price = hist['Close'][-1]
-                percent_change = ((end_price - start_price) / start_price) * 100
-                data[ticker] = percent_change
-        return data
+        ensure_bars(tickers, start_date, end_date)
+        return period_returns(tickers, start_date, end_date)
 
     elif source == "tessa":
-        for ticker in tickers:
-            try:
-                stock = Symbol(ticker)
-                start_date_str = start_date
-                end_date_str = end_date
+        # tessa pulls in several market-data SDKs; only this branch needs it
+        from tessa import Symbol
 
-                start_price = stock.price_point(start_date_str).price
-                end_price = stock.price_point(end_date_str).price
+        def tessa_percent_change(ticker):
+            stock = Symbol(ticker)
+            start_price = stock.price_point(start_date).price
+            end_price = stock.price_point(end_date).price
 
-                print(f"Ticker: {ticker}, Start Price: {start_price}, End Price: {end_price}")
+            print(f"Ticker: {ticker}, Start Price: {start_price}, End Price: {end_price}")
 
-                if start_price and end_price:
-                    percent_change = ((end_price - start_price) / start_price) * 100
-                    data[ticker] = percent_change
-            except Exception as e:
-                print(f"Error fetching data for {ticker}: {e}")
-        return data
+            if start_price and end_price:
+                return ((end_price - start_price) / start_price) * 100
+            return None
+
+        data = get_fetch_executor().map("tessa", tessa_percent_change, tickers)
+        return {ticker: percent_change for ticker, percent_change in data.items() if percent_change is not None}
 
 def store_stock_data(data, start_date, end_date):
+    conn = get_connection(ALL_STOCK_DB)
+    c = conn.cursor()
     for company, percent_change in data.items():
         if percent_change != 0:  # Skip storing if the percent change is 0
             c.execute('''
                 INSERT INTO stocks (company, start_date, end_date, percent_change) VALUES (?, ?, ?, ?)
+                ON CONFLICT (start_date, end_date, company) DO UPDATE SET percent_change = excluded.percent_change
             ''', (company, start_date, end_date, percent_change))
     conn.commit()
 
 def fetch_stock_data(tickers, start_date, end_date):
+    conn = get_connection(ALL_STOCK_DB)
+    c = conn.cursor()
     placeholders = ','.join(['?'] * len(tickers))
     query = f'''
         SELECT company, percent_change FROM stocks 
@@ -132,19 +112,26 @@ def get_last_n_years(n):
 
 # Function to save custom stock list
 def save_stock_list(name, tickers):
+    conn = get_connection(ALL_STOCK_DB)
+    c = conn.cursor()
     tickers_str = ",".join(tickers)
     c.execute('''
         INSERT INTO stock_lists (list_name, tickers) VALUES (?, ?)
+        ON CONFLICT (list_name) DO UPDATE SET tickers = excluded.tickers
     ''', (name, tickers_str))
     conn.commit()
 # Function to delete custom stock list
 def delete_stock_list(name):
+    conn = get_connection(ALL_STOCK_DB)
+    c = conn.cursor()
     c.execute('''
         DELETE FROM stock_lists WHERE list_name = ?
     ''', (name,))
     conn.commit()
 # Function to load custom stock lists
 def load_stock_lists():
+    conn = get_connection(ALL_STOCK_DB)
+    c = conn.cursor()
     c.execute('''
         SELECT list_name, tickers FROM stock_lists
     ''')
@@ -153,6 +140,7 @@ def load_stock_lists():
 
 # Function to query the LLM (e.g., Gemini)
 def query_llm(prompt):
+    import google.generativeai as genai
     api_key = st.secrets["GEMINI_API_KEY"]
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel('gemini-1.5-flash')
@@ -259,11 +247,19 @@ if compare_option == "Quarters":
         fig, axs = plt.subplots(num_quarters, 1, figsize=(15, 9 * num_quarters))
         axs = axs.flatten()
 
+        network_calls = track_network_calls()
+        periods = [get_date_range(year, quarter) for quarter, year in selected_quarters]
+        cached_data = [fetch_stock_data(selected_tickers, start_date, end_date) for start_date, end_date in periods]
+
+        # Backfill daily bars once for the union of all periods that still need a return
+        uncached_tickers = [ticker for ticker in selected_tickers if any(ticker not in stock_data for stock_data in cached_data)]
+        if uncached_tickers:
+            ensure_bars(uncached_tickers, min(start for start, _ in periods), max(end for _, end in periods))
+
         for i, (quarter, year) in enumerate(selected_quarters):
-            start_date, end_date = get_date_range(year, quarter)
+            start_date, end_date = periods[i]
 
-            stock_data = fetch_stock_data(selected_tickers, start_date,
-                                          end_date)
+            stock_data = cached_data[i]
 
             missing_tickers = [ticker for ticker in selected_tickers if ticker not in stock_data]
             if missing_tickers:
@@ -306,6 +302,7 @@ if compare_option == "Quarters":
         with st.container(border=True):
             st.write("### Combined Percentage Change Table")
             st.dataframe(combined_df.sort_values("Company"), use_container_width=True, hide_index=True)
+            st.caption(f"Network calls this render: {network_calls.count}")
 elif compare_option == "Calendar Year":
 
     num_years = st.slider("Select the number of years to compare:", min_value=2, max_value=10, value=4, step=1)
@@ -334,12 +331,19 @@ elif compare_option == "Calendar Year":
 
     if selected_tickers:
         data = []
+        network_calls = track_network_calls()
+        periods = [(f"{year}-01-01", f"{year}-12-31") for year in selected_years]
+        cached_data = [fetch_stock_data(selected_tickers, start_date, end_date) for start_date, end_date in periods]
+
+        # Backfill daily bars once for the union of all periods that still need a return
+        uncached_tickers = [ticker for ticker in selected_tickers if any(ticker not in stock_data for stock_data in cached_data)]
+        if uncached_tickers:
+            ensure_bars(uncached_tickers, min(start for start, _ in periods), max(end for _, end in periods))
+
         for i, year in enumerate(selected_years):
-            start_date = f"{year}-01-01"
-            end_date = f"{year}-12-31"
+            start_date, end_date = periods[i]
 
-            stock_data = fetch_stock_data(selected_tickers, start_date,
-                                          end_date)
+            stock_data = cached_data[i]
 
             missing_tickers = [ticker for ticker in selected_tickers if ticker not in stock_data]
             if missing_tickers:
@@ -373,5 +377,5 @@ elif compare_option == "Calendar Year":
         with st.container(border=True):
             st.write("### Combined Percentage Change Table")
             st.dataframe(combined_df.sort_values("Company"), use_container_width=True, hide_index=True)
+            st.caption(f"Network calls this render: {network_calls.count}")
 
-conn.close()
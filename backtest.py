@@ -0,0 +1,225 @@
+# Walk-forward backtests of the forecasters over many tickers, e.g.
+#   python backtest.py --model ridge --folds 20 --test-days 21            (SOXX, stock lists and portfolios)
+#   python backtest.py AAPL MSFT --model gru --mode rolling --train-days 750 --incremental
+import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+from db import TRAINING_DB, get_connection, transaction, run_migrations
+from forecasting import LOOKBACK, make_windows
+from forecasters import FORECASTERS, KerasForecaster
+from price_store import ensure_bars, load_closes
+from training_queue import create_training_pool
+
+BACKTEST_WORKERS = int(os.environ.get('BACKTEST_WORKERS', os.cpu_count() or 1))
+FOLD_MODES = ['expanding', 'rolling']
+# Trading days a rolling fold trains on unless told otherwise, about three years
+ROLLING_TRAIN_DAYS = 750
+
+
+def _check_mode(mode):
+    if mode not in FOLD_MODES:
+        raise ValueError(f"Unknown fold mode {mode!r}, expected one of {', '.join(FOLD_MODES)}")
+
+
+def walk_forward_folds(n, folds, test_days, lookback=LOOKBACK, mode='expanding', train_days=None):
+    """(train_start, test_start, test_end) positions for folds consecutive test blocks ending at n.
+
+    Expanding folds train on everything before the test block; rolling folds on the train_days before it
+    (ROLLING_TRAIN_DAYS by default).
+    """
+    _check_mode(mode)
+    if mode == 'rolling':
+        train_days = ROLLING_TRAIN_DAYS if train_days is None else train_days
+        if train_days <= lookback:
+            raise ValueError(f"Rolling folds need more than {lookback} training days, got {train_days}")
+    bounds = []
+    for fold in range(folds):
+        test_start = n - (folds - fold) * test_days
+        train_start = 0 if mode == 'expanding' else max(0, test_start - train_days)
+        if test_start - train_start <= lookback:
+            raise ValueError(f"Fold {fold} has {test_start - train_start} training days, need more than {lookback}")
+        bounds.append((train_start, test_start, test_start + test_days))
+    return bounds
+
+
+def fold_key(ticker, model, params, lookback, mode, incremental, fold, bounds, closes):
+    # Everything the fold's predictions depend on, including all prices up to the end of its test block
+    train_start, test_start, test_end = bounds[fold]
+    spec = json.dumps([ticker, model, sorted(params.items()), lookback, mode, incremental, fold, bounds[:fold + 1]])
+    digest = hashlib.sha256(spec.encode())
+    digest.update(np.ascontiguousarray(closes[:test_end], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def run_folds(dates, closes, model, params, bounds, fold_numbers, lookback=LOOKBACK, incremental=False):
+    """Fit and predict the given folds of one ticker and return {fold: (dates, actual, predicted)}.
+
+    In incremental mode the model is fitted once on the first fold and then only updated with the bars each
+    later fold adds; the scaler stays the one fitted on the first training window.
+    """
+    forecaster = FORECASTERS[model](**params)
+    incremental = incremental and forecaster.supports_update
+    series = closes.reshape(-1, 1)
+    results = {}
+    scaled = scaler = None
+    for position, fold in enumerate(fold_numbers):
+        train_start, test_start, test_end = bounds[fold]
+        if scaler is None or not incremental:
+            scaler = MinMaxScaler(feature_range=(0, 1)).fit(series[train_start:test_start])
+            scaled = scaler.transform(series).astype(np.float32).ravel()
+        if position == 0 or not incremental:
+            forecaster.fit(*make_windows(scaled[train_start:test_start], lookback))
+        else:
+            previous_test_start = bounds[fold_numbers[position - 1]][1]
+            forecaster.update(*make_windows(scaled[previous_test_start - lookback:test_start], lookback))
+        x_test, _ = make_windows(scaled[test_start - lookback:test_end], lookback)
+        predicted = scaler.inverse_transform(forecaster.predict(x_test).reshape(-1, 1)).ravel()
+        results[fold] = (list(dates[test_start:test_end]), closes[test_start:test_end], predicted)
+    return results
+
+
+def _load_cached(keys):
+    placeholders = ','.join(['?'] * len(keys))
+    rows = get_connection(TRAINING_DB).execute(f'''
+        SELECT cache_key, dates, actual, predicted FROM backtest_folds WHERE cache_key IN ({placeholders})
+    ''', keys).fetchall()
+    return {key: (json.loads(dates), np.frombuffer(actual, dtype=np.float32), np.frombuffer(predicted, dtype=np.float32))
+            for key, dates, actual, predicted in rows}
+
+
+def _store_folds(rows):
+    with transaction(TRAINING_DB) as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO backtest_folds
+                (cache_key, ticker, model, fold, train_start, test_start, test_end, dates, actual, predicted)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def _create_pool(model, workers):
+    if issubclass(FORECASTERS[model], KerasForecaster):
+        return create_training_pool(workers)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def backtest(prices, model, params=None, folds=20, test_days=21, lookback=LOOKBACK, mode='expanding',
+             train_days=None, incremental=False, workers=BACKTEST_WORKERS):
+    """Walk-forward backtest of one forecaster over every column of prices (dates x tickers).
+
+    Returns a long frame of (ticker, fold, date, actual, predicted) and the number of folds served from cache.
+    Independent folds run in parallel processes; incremental runs parallelize across tickers.
+    """
+    params = params or {}
+    _check_mode(mode)
+    fold_frames, pending, cached_folds = {}, {}, 0
+    for ticker in prices.columns:
+        series = prices[ticker].dropna()
+        dates, closes = series.index.strftime('%Y-%m-%d').to_numpy(), series.to_numpy(dtype=np.float64)
+        try:
+            bounds = walk_forward_folds(len(closes), folds, test_days, lookback, mode, train_days)
+        except ValueError as e:
+            print(f"Skipping {ticker}: {e}")
+            continue
+        keys = [fold_key(ticker, model, params, lookback, mode, incremental, fold, bounds, closes)
+                for fold in range(folds)]
+        cached = _load_cached(keys)
+        missing = [fold for fold, key in enumerate(keys) if key not in cached]
+        if incremental and missing:
+            # Later folds depend on the weights of earlier ones, so the chain is re-run from the start
+            missing = list(range(folds))
+        for fold, key in enumerate(keys):
+            if fold not in missing:
+                fold_frames[(ticker, fold)] = cached[key]
+                cached_folds += 1
+        if missing:
+            pending[ticker] = (dates, closes, bounds, keys, missing)
+
+    tasks = []
+    for ticker, (dates, closes, bounds, keys, missing) in pending.items():
+        chunks = [missing] if incremental else [[fold] for fold in missing]
+        tasks.extend((ticker, chunk) for chunk in chunks)
+
+    if tasks:
+        with _create_pool(model, workers) as pool:
+            futures = {}
+            for ticker, chunk in tasks:
+                dates, closes, bounds, _, _ = pending[ticker]
+                futures[pool.submit(run_folds, dates, closes, model, params, bounds, chunk, lookback,
+                                    incremental)] = ticker
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Error backtesting {ticker}: {e}")
+                    continue
+                _, _, bounds, keys, _ = pending[ticker]
+                rows = []
+                for fold, (dates, actual, predicted) in results.items():
+                    fold_frames[(ticker, fold)] = (dates, actual, predicted)
+                    train_start, test_start, test_end = bounds[fold]
+                    rows.append((keys[fold], ticker, model, fold, str(train_start), dates[0], dates[-1],
+                                 json.dumps(dates), np.asarray(actual, dtype=np.float32).tobytes(),
+                                 np.asarray(predicted, dtype=np.float32).tobytes()))
+                _store_folds(rows)
+
+    frames = [pd.DataFrame({'ticker': ticker, 'fold': fold, 'date': dates, 'actual': actual, 'predicted': predicted})
+              for (ticker, fold), (dates, actual, predicted) in fold_frames.items()]
+    if not frames:
+        return pd.DataFrame(columns=['ticker', 'fold', 'date', 'actual', 'predicted']), cached_folds
+    return pd.concat(frames, ignore_index=True), cached_folds
+
+
+def summarize_backtest(predictions, by=('ticker',)):
+    """MAE (price units) and MAPE (%) per group, computed in one vectorized pass over all fold predictions."""
+    errors = predictions.assign(abs_error=(predictions['predicted'] - predictions['actual']).abs())
+    errors['ape'] = errors['abs_error'] / errors['actual'].abs() * 100
+    return errors.groupby(list(by)).agg(mae=('abs_error', 'mean'), mape=('ape', 'mean'), days=('ape', 'size'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of a forecaster over many tickers.')
+    parser.add_argument('tickers', nargs='*', help='tickers to test (default: SOXX, stock lists and portfolios)')
+    parser.add_argument('--model', choices=sorted(FORECASTERS), default='ridge')
+    parser.add_argument('--epochs', type=int, default=5, help='training epochs for the Keras models')
+    parser.add_argument('--years', type=int, default=10, help='years of history to load, ending today')
+    parser.add_argument('--folds', type=int, default=20)
+    parser.add_argument('--test-days', type=int, default=21, help='trading days predicted per fold')
+    parser.add_argument('--mode', choices=FOLD_MODES, default='expanding')
+    parser.add_argument('--train-days', type=int, default=ROLLING_TRAIN_DAYS, help='training window of rolling folds')
+    parser.add_argument('--incremental', action='store_true',
+                        help='update the previous fold\'s model on new bars instead of refitting (Keras models)')
+    parser.add_argument('--workers', type=int, default=BACKTEST_WORKERS)
+    args = parser.parse_args()
+
+    from refresher import refresh_universe
+
+    run_migrations()
+    tickers = args.tickers or refresh_universe()
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=args.years * 365)
+    ensure_bars(tickers, start_date, end_date)
+    prices = load_closes(tickers, start_date, end_date, column='close')
+    params = {'epochs': args.epochs} if issubclass(FORECASTERS[args.model], KerasForecaster) else {}
+
+    started = time.perf_counter()
+    predictions, cached_folds = backtest(prices, args.model, params, args.folds, args.test_days, mode=args.mode,
+                                         train_days=args.train_days, incremental=args.incremental,
+                                         workers=args.workers)
+    elapsed = time.perf_counter() - started
+    if predictions.empty:
+        print("No ticker had enough history.")
+    else:
+        print(summarize_backtest(predictions).to_string(float_format='{:.2f}'.format))
+        overall = summarize_backtest(predictions.assign(all='all'), by=('all',)).iloc[0]
+        total_folds = predictions.groupby(['ticker', 'fold']).ngroups
+        print(f"\n{args.model}: MAE ${overall['mae']:.2f}, MAPE {overall['mape']:.2f}% over {total_folds} folds "
+              f"({cached_folds} from cache) in {elapsed:.1f}s")
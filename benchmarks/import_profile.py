@@ -0,0 +1,143 @@
+# Cold import cost of every page: the third-party modules it pulls in at load, directly or through the
+# repo's own modules, imported in a fresh interpreter under -X importtime.
+#   python benchmarks/import_profile.py                  # report per page, slowest modules first
+#   python benchmarks/import_profile.py --update-budget  # record the current totals as the budget
+#   python benchmarks/import_profile.py --check          # exit 1 if a page exceeds its budget (CI)
+import os
+import ast
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(ROOT, 'benchmarks', 'import_budget.json')
+LOCAL_MODULES = {name[:-3] for name in os.listdir(ROOT) if name.endswith('.py')}
+
+# Fraction over its recorded budget a page may load in before --check fails: back-to-back runs differ by up to
+# ~30%, while the regressions worth catching (TensorFlow, yfinance at module level) add far more
+TOLERANCE = 0.5
+
+# Plain __import__ and print, so the measuring script imports nothing of its own
+MEASURE = '''
+import sys
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except ImportError as e:
+        print(f"{name} ({e})")
+'''
+
+
+def page_paths():
+    pages = sorted(os.path.join('pages', name) for name in os.listdir(os.path.join(ROOT, 'pages'))
+                   if name.endswith('.py'))
+    return ['main.py', 'app.py'] + pages
+
+
+def top_level_imports(path):
+    """Modules imported by a file's module-level statements; imports inside functions are deferred."""
+    with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names.append(node.module)
+    return names
+
+
+def external_imports(path, seen=None):
+    """Third-party modules a file loads at import time, following the repo's own modules."""
+    seen = set() if seen is None else seen
+    modules = []
+    for name in top_level_imports(path):
+        root = name.split('.')[0]
+        if root in LOCAL_MODULES:
+            if root not in seen:
+                seen.add(root)
+                modules.extend(external_imports(root + '.py', seen))
+        elif name not in modules:
+            modules.append(name)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(stderr):
+    """Cumulative microseconds of every top-level import in -X importtime output."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(' '):
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def profile_page(path, repeat):
+    """(total ms, {module: cumulative ms}, missing modules) of a page's cold imports, best of repeat runs."""
+    modules = external_imports(path)
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', MEASURE, *modules],
+                                cwd=ROOT, capture_output=True, text=True, check=True)
+        # Interpreter startup imports (site, encodings, ...) are reported too and left out
+        roots = {name.split('.')[0] for name in modules}
+        timings = {name: us / 1000 for name, us in parse_importtime(result.stderr).items()
+                   if name.split('.')[0] in roots}
+        total = sum(timings.values())
+        if best is None or total < best[0]:
+            best = (total, timings, result.stdout.splitlines())
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the cold import time of every page.")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per page; the fastest is kept")
+    parser.add_argument('--top', type=int, default=5, help="slowest modules listed per page")
+    parser.add_argument('--update-budget', action='store_true', help="write the measured totals as the budget")
+    parser.add_argument('--check', action='store_true', help="fail if a page exceeds its budget")
+    args = parser.parse_args()
+
+    budget = {}
+    if os.path.exists(BUDGET_PATH):
+        with open(BUDGET_PATH) as f:
+            budget = json.load(f)
+
+    # Pages with a dependency missing from this environment are neither checked nor re-recorded: an import
+    # that fails early looks cheap, so their totals say nothing about the budget
+    measured, failures, unchecked = dict(budget), [], []
+    for path in page_paths():
+        total, timings, missing = profile_page(path, args.repeat)
+        limit = budget.get(path)
+        print(f"{path}: {total:.0f} ms" + (f" (budget {limit:.0f} ms)" if limit is not None else ""))
+        for name, ms in sorted(timings.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {ms:8.1f} ms  {name}")
+        for name in missing:
+            print(f"    not installed: {name}")
+
+        if missing:
+            unchecked.append(f"{path}: {len(missing)} module(s) not installed")
+            continue
+        measured[path] = round(total, 1)
+        if limit is None:
+            failures.append(f"{path}: no budget recorded")
+        elif total > limit * (1 + TOLERANCE):
+            failures.append(f"{path}: {total:.0f} ms exceeds its budget of {limit:.0f} ms")
+
+    if args.update_budget:
+        with open(BUDGET_PATH, 'w') as f:
+            json.dump(measured, f, indent=2)
+            f.write('\n')
+        print(f"Budget written to {BUDGET_PATH}")
+    if unchecked:
+        print('\n'.join(['Not checked, dependencies missing:'] + unchecked))
+    if args.check and failures:
+        print('\n'.join(['Import budget check failed:'] + failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Cold load time, single-window prediction latency and peak RSS of a registered model, for the Keras
+# artifact and every TFLite export. Each runtime is measured in a fresh interpreter so imports count.
+#   python benchmarks/inference_benchmark.py AAPL
+import os
+import sys
+import json
+import subprocess
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PREDICTIONS = 200
+
+MEASURE = '''
+import json, resource, sys, time
+import numpy as np
+started = time.perf_counter()
+if sys.argv[1] == 'keras':
+    from keras import models
+    model = models.load_model(sys.argv[2])
+    predict = lambda x: model.predict(x, verbose=0)
+else:
+    from model_export import LiteModel
+    model = LiteModel(sys.argv[2])
+    predict = model.predict
+load_seconds = time.perf_counter() - started
+window = np.random.default_rng(0).random((1, int(sys.argv[3]), 1), dtype=np.float32)
+predict(window)
+latencies = []
+for _ in range(int(sys.argv[4])):
+    started = time.perf_counter()
+    predict(window)
+    latencies.append(time.perf_counter() - started)
+print(json.dumps({'load_s': load_seconds, 'predict_ms': float(np.median(latencies)) * 1000,
+                  'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def measure(runtime, path, lookback):
+    output = subprocess.run([sys.executable, '-c', MEASURE, runtime, path, str(lookback), str(PREDICTIONS)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(ticker):
+    from model_registry import load_metadata, artifact_path, export_path
+
+    metadata = load_metadata(ticker)
+    if metadata is None:
+        sys.exit(f"No registered model for {ticker}")
+    runs = [('keras', artifact_path(ticker, metadata['version']))]
+    for quantization, export in metadata.get('exports', {}).items():
+        runs.append((f'tflite {quantization}', export_path(ticker, metadata['version'], quantization)))
+
+    rows = []
+    for name, path in runs:
+        result = measure('keras' if name == 'keras' else 'tflite', path, metadata['lookback'])
+        export = metadata.get('exports', {}).get(name.replace('tflite ', ''), {})
+        rows.append({'runtime': name, 'size KiB': os.path.getsize(path) / 1024, **result,
+                     'max abs error': export.get('max_abs_error', 0.0)})
+    print(f"{ticker} v{metadata['version']}, median of {PREDICTIONS} single-window predictions")
+    print(pd.DataFrame(rows).to_string(index=False, float_format='{:.3g}'.format))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'AAPL')
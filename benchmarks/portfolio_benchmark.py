@@ -0,0 +1,75 @@
+# Valuation time of 50 to 5000 lots with prices already cached: the previous per-lot loop against the
+# column-wise join in portfolio_engine.
+#   python benchmarks/portfolio_benchmark.py
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from portfolio_engine import value_lots, portfolio_totals
+
+REPEATS = 5
+
+
+def loop_valuation(lots, prices):
+    # The previous implementation, kept for comparison
+    portfolio_value = 0
+    total_cost = 0
+    performance_data = []
+    for _, stock in lots.iterrows():
+        shares = stock['shares']
+        purchase_price = stock['purchase_price']
+        total_cost += shares * purchase_price
+        current_price = prices.get(stock['ticker'])
+        if current_price:
+            current_value = current_price * shares
+            portfolio_value += current_value
+            performance_data.append({
+                'Ticker': stock['ticker'],
+                'Shares': shares,
+                'Purchase Price': purchase_price,
+                'Current Price': current_price,
+                'Current Value': current_value,
+                'Gain/Loss': (current_price - purchase_price) * shares,
+                'Percent Change': (current_price - purchase_price) / purchase_price * 100,
+            })
+    return pd.DataFrame(performance_data), portfolio_value, total_cost
+
+
+def engine_valuation(lots, prices):
+    valuation = value_lots(lots, prices)
+    return valuation, portfolio_totals(valuation)
+
+
+def synthetic_lots(count, tickers=60):
+    rng = np.random.default_rng(count)
+    return pd.DataFrame({
+        'id': np.arange(1, count + 1),
+        'ticker': [f'T{i:03d}' for i in rng.integers(tickers, size=count)],
+        'shares': rng.integers(1, 500, count),
+        'purchase_date': '2020-01-02',
+        'purchase_price': rng.uniform(10, 500, count).round(2),
+    }), pd.Series(rng.uniform(10, 500, tickers), index=[f'T{i:03d}' for i in range(tickers)])
+
+
+def measure(valuation, lots, prices):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        valuation(lots, prices)
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    print(f"{'lots':>6} {'loop ms':>10} {'engine ms':>10}")
+    for count in (50, 500, 5000):
+        lots, prices = synthetic_lots(count)
+        print(f"{count:>6} {measure(loop_valuation, lots, prices):>10.2f} "
+              f"{measure(engine_valuation, lots, prices):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Time and peak memory of LSTM data preparation for 5, 10 and 20 years of daily closes.
+#   python benchmarks/prepare_data_benchmark.py
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from forecasting import prepare_data
+
+TRADING_DAYS = 252
+REPEATS = 5
+
+
+def loop_prepare_data(df):
+    # The previous implementation, kept for comparison
+    data_training = pd.DataFrame(df['Close'][0:int(len(df) * 0.70)])
+    data_testing = pd.DataFrame(df['Close'][int(len(df) * 0.70): int(len(df))])
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    data_training_array = scaler.fit_transform(data_training)
+    x_train, y_train = [], []
+    for i in range(100, data_training_array.shape[0]):
+        x_train.append(data_training_array[i - 100:i])
+        y_train.append(data_training_array[i, 0])
+    x_train, y_train = np.array(x_train), np.array(y_train)
+    past_100_days = data_training.tail(100)
+    final_df = pd.concat([past_100_days, data_testing], ignore_index=True)
+    input_data = scaler.transform(final_df)
+    x_test, y_test = [], []
+    for i in range(100, input_data.shape[0]):
+        x_test.append(input_data[i - 100:i])
+        y_test.append(input_data[i, 0])
+    x_test, y_test = np.array(x_test), np.array(y_test)
+    return x_train, y_train, x_test, y_test, scaler
+
+
+def synthetic_closes(years):
+    rng = np.random.default_rng(years)
+    days = years * TRADING_DAYS
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    return pd.DataFrame({'Date': pd.bdate_range('2000-01-03', periods=days), 'Close': close})
+
+
+def measure(prepare, df):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        prepare(df)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    result = prepare(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return min(timings) * 1000, peak / 2 ** 20
+
+
+def main():
+    rows = []
+    for years in (5, 10, 20):
+        df = synthetic_closes(years)
+        for name, prepare in (('loop', loop_prepare_data), ('vectorized', prepare_data)):
+            milliseconds, peak_mib = measure(prepare, df)
+            rows.append({'years': years, 'implementation': name, 'ms': milliseconds, 'peak MiB': peak_mib})
+    print(pd.DataFrame(rows).to_string(index=False, float_format='{:.2f}'.format))
+
+
+if __name__ == '__main__':
+    main()
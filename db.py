@@ -0,0 +1,428 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+import streamlit as st
+from instrumentation import span
+
+ALL_STOCK_DB = 'all_stock_data.db'
+STOCK_PRICE_DB = 'stock_price_data.db'
+FINANCIAL_STATEMENTS_DB = 'financial_statements.db'
+PORTFOLIO_DB = 'portfolio.db'
+TRAINING_DB = 'training_jobs.db'
+
+STATEMENT_TABLES = ['annual_income_statement', 'quarterly_income_statement', 'annual_balance_sheet',
+                    'quarterly_balance_sheet', 'annual_cashflow', 'quarterly_cashflow']
+
+
+def _rebuild_table(conn, table, create_sql, columns, key_columns):
+    # Copy the newest row (highest rowid) of every key into a constrained table, then swap it in
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+    conn.execute(create_sql.format(table=f'{table}_new'))
+    conn.execute(f'''
+        INSERT INTO {table}_new ({column_list})
+        SELECT {column_list} FROM {table}
+        WHERE rowid IN (SELECT MAX(rowid) FROM {table} GROUP BY {key_list})
+    ''')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+def _all_stock_v1(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stocks (
+            company TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            percent_change REAL
+        )
+    ''')
+    # Period-first key so the period matrix lookup is a clustered index seek
+    _rebuild_table(conn, 'stocks', '''
+        CREATE TABLE {table} (
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            company TEXT NOT NULL,
+            percent_change REAL,
+            PRIMARY KEY (start_date, end_date, company)
+        ) WITHOUT ROWID
+    ''', ['company', 'start_date', 'end_date', 'percent_change'], ['company', 'start_date', 'end_date'])
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_lists (
+            list_name TEXT,
+            tickers TEXT
+        )
+    ''')
+    _rebuild_table(conn, 'stock_lists', '''
+        CREATE TABLE {table} (
+            list_name TEXT PRIMARY KEY,
+            tickers TEXT
+        )
+    ''', ['list_name', 'tickers'], ['list_name'])
+
+    # One row per (ticker, trading day); the primary key doubles as the clustered index
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_bars (
+            ticker TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            adj_close REAL,
+            volume INTEGER,
+            PRIMARY KEY (ticker, date)
+        ) WITHOUT ROWID
+    ''')
+    # Covering index for cross-sectional (all tickers on a date) reads
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_bars_date_close
+        ON daily_bars (date, ticker, adj_close, close)
+    ''')
+    # Half-open [first_date, last_date) window already downloaded for each ticker
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bar_coverage (
+            ticker TEXT PRIMARY KEY,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL
+        )
+    ''')
+
+
+def _all_stock_v2(conn):
+    # One row per ticker and market session the background refresher has warmed
+    conn.execute('''
+        CREATE TABLE refresh_log (
+            session_date TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            status TEXT NOT NULL,
+            bars_seconds REAL,
+            info_seconds REAL,
+            statements_seconds REAL,
+            error TEXT,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_date, ticker)
+        )
+    ''')
+
+
+STOCK_INFO_COLUMNS = ['ticker', 'name', 'country', 'sector', 'industry', 'market_cap', 'enterprise_value',
+                      'employees', 'current_price', 'prev_close', 'day_high', 'day_low', 'ft_week_high',
+                      'ft_week_low', 'forward_eps', 'forward_pe', 'peg_ratio', 'dividend_rate', 'dividend_yield',
+                      'recommendation', 'date']
+
+STOCK_INFO_SQL = '''
+    CREATE TABLE {table} (
+        ticker TEXT PRIMARY KEY,
+        name TEXT,
+        country TEXT,
+        sector TEXT,
+        industry TEXT,
+        market_cap REAL,
+        enterprise_value REAL,
+        employees INTEGER,
+        current_price REAL,
+        prev_close REAL,
+        day_high REAL,
+        day_low REAL,
+        ft_week_high REAL,
+        ft_week_low REAL,
+        forward_eps REAL,
+        forward_pe REAL,
+        peg_ratio REAL,
+        dividend_rate REAL,
+        dividend_yield REAL,
+        recommendation TEXT,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _stock_price_v1(conn):
+    conn.execute(STOCK_INFO_SQL.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS').format(table='stock_info'))
+    _rebuild_table(conn, 'stock_info', STOCK_INFO_SQL, STOCK_INFO_COLUMNS, ['ticker'])
+
+
+def _financial_statements_v1(conn):
+    for table in STATEMENT_TABLES:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                ticker TEXT,
+                date TIMESTAMP,
+                data TEXT
+            )
+        ''')
+        # Only the latest statement per ticker is ever read
+        _rebuild_table(conn, table, '''
+            CREATE TABLE {table} (
+                ticker TEXT PRIMARY KEY,
+                date TIMESTAMP,
+                data TEXT
+            )
+        ''', ['ticker', 'date', 'data'], ['ticker'])
+
+
+def _financial_statements_v2(conn):
+    # Statements move from one JSON blob per (table, ticker) to one row per line item and period
+    import pandas as pd
+    from io import StringIO
+    from datetime import datetime, timezone
+
+    def fetched_at_utc(value):
+        # The blobs were stamped with a naive local datetime.now(); statement_fetches holds naive UTC.
+        # A value that cannot be read is left NULL, so the statement counts as stale and is revalidated.
+        try:
+            local = datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+        return local.astimezone(timezone.utc).replace(tzinfo=None).isoformat(sep=' ')
+
+    conn.execute('''
+        CREATE TABLE statement_items (
+            ticker TEXT NOT NULL,
+            statement TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            line_item TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            value REAL,
+            position INTEGER,
+            PRIMARY KEY (ticker, statement, frequency, line_item, period_end)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE statement_fetches (
+            ticker TEXT NOT NULL,
+            statement TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            fetched_at TIMESTAMP,
+            PRIMARY KEY (ticker, statement, frequency)
+        )
+    ''')
+    for table in STATEMENT_TABLES:
+        frequency, statement = table.split('_', 1)
+        statement = {'income_statement': 'income'}.get(statement, statement)
+        for ticker, fetched_at, data in conn.execute(f'SELECT ticker, date, data FROM {table}').fetchall():
+            # Blobs were stored transposed (period ends x line items)
+            df = pd.read_json(StringIO(data)).transpose()
+            # Conversion kept inline so this step does not change with statements.py
+            rows = [(ticker, statement, frequency, str(line_item), pd.Timestamp(period_end).strftime('%Y-%m-%d'),
+                     float(value), position)
+                    for position, (line_item, values) in enumerate(df.iterrows())
+                    for period_end, value in values.items() if pd.notna(value)]
+            conn.executemany('''
+                INSERT OR REPLACE INTO statement_items
+                    (ticker, statement, frequency, line_item, period_end, value, position)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.execute('''
+                INSERT OR REPLACE INTO statement_fetches (ticker, statement, frequency, fetched_at)
+                VALUES (?, ?, ?, ?)
+            ''', (ticker, statement, frequency, fetched_at_utc(fetched_at)))
+        conn.execute(f'DROP TABLE {table}')
+
+
+def _portfolio_v1(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolios
+            (id INTEGER PRIMARY KEY, name TEXT UNIQUE)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stocks
+            (id INTEGER PRIMARY KEY, portfolio_id INTEGER,
+             ticker TEXT, shares INTEGER, purchase_date TEXT,
+             purchase_price REAL,
+             FOREIGN KEY (portfolio_id) REFERENCES portfolios (id))
+    ''')
+    # Lots left behind by deleted portfolios
+    conn.execute('DELETE FROM stocks WHERE portfolio_id IS NULL OR portfolio_id NOT IN (SELECT id FROM portfolios)')
+    # Duplicate lots of a ticker bought on the same day are merged, keeping total shares and cost basis
+    conn.execute('''
+        CREATE TABLE stocks_new
+            (id INTEGER PRIMARY KEY, portfolio_id INTEGER NOT NULL,
+             ticker TEXT NOT NULL, shares INTEGER, purchase_date TEXT NOT NULL,
+             purchase_price REAL,
+             FOREIGN KEY (portfolio_id) REFERENCES portfolios (id),
+             UNIQUE (portfolio_id, ticker, purchase_date))
+    ''')
+    conn.execute('''
+        INSERT INTO stocks_new (id, portfolio_id, ticker, shares, purchase_date, purchase_price)
+        SELECT MIN(id), portfolio_id, ticker, SUM(shares), purchase_date,
+               SUM(shares * purchase_price) / NULLIF(SUM(shares), 0)
+        FROM stocks
+        GROUP BY portfolio_id, ticker, purchase_date
+    ''')
+    conn.execute('DROP TABLE stocks')
+    conn.execute('ALTER TABLE stocks_new RENAME TO stocks')
+
+
+def _portfolio_v2(conn):
+    # Daily equity curve of a portfolio through the last closed session, extended as new bars arrive.
+    # Rows are only valid for the lots whose fingerprint they carry; a lot edit invalidates them.
+    conn.execute('''
+        CREATE TABLE equity_curve (
+            portfolio_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            holdings_hash TEXT NOT NULL,
+            equity REAL NOT NULL,
+            cost_basis REAL NOT NULL,
+            cash_flow REAL NOT NULL,
+            twr_index REAL NOT NULL,
+            peak REAL NOT NULL,
+            PRIMARY KEY (portfolio_id, date)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _training_v1(conn):
+    conn.execute('''
+        CREATE TABLE training_jobs (
+            id INTEGER PRIMARY KEY,
+            ticker TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            epochs INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            version INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    # At most one queued or running job per ticker
+    conn.execute('''
+        CREATE UNIQUE INDEX idx_training_jobs_active ON training_jobs (ticker)
+        WHERE status IN ('queued', 'running')
+    ''')
+    conn.execute('''
+        CREATE TABLE training_epochs (
+            job_id INTEGER NOT NULL,
+            epoch INTEGER NOT NULL,
+            loss REAL,
+            PRIMARY KEY (job_id, epoch)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _training_v2(conn):
+    # Per-fold walk-forward predictions, reused while the inputs of a fold are unchanged
+    conn.execute('''
+        CREATE TABLE backtest_folds (
+            cache_key TEXT PRIMARY KEY,
+            ticker TEXT NOT NULL,
+            model TEXT NOT NULL,
+            fold INTEGER NOT NULL,
+            train_start TEXT,
+            test_start TEXT,
+            test_end TEXT,
+            dates TEXT,
+            actual BLOB,
+            predicted BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _training_v3(conn):
+    # 'train' builds a model from scratch, 'fine_tune' continues the latest one on newly arrived bars
+    conn.execute("ALTER TABLE training_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'train'")
+
+
+def _training_v4(conn):
+    # Process that queued a job and runs its pool, so a restart only fails jobs whose owner is gone
+    conn.execute('ALTER TABLE training_jobs ADD COLUMN owner_pid INTEGER')
+    conn.execute('ALTER TABLE training_jobs ADD COLUMN owner_host TEXT')
+
+
+# Ordered schema migrations per database; version N is stored in PRAGMA user_version once
+# MIGRATIONS[db][N - 1] has been applied. Append new steps, never edit applied ones.
+MIGRATIONS = {
+    ALL_STOCK_DB: [_all_stock_v1, _all_stock_v2],
+    STOCK_PRICE_DB: [_stock_price_v1],
+    FINANCIAL_STATEMENTS_DB: [_financial_statements_v1, _financial_statements_v2],
+    PORTFOLIO_DB: [_portfolio_v1, _portfolio_v2],
+    TRAINING_DB: [_training_v1, _training_v2, _training_v3, _training_v4],
+}
+
+
+def migrate(path, migrations):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            # Each step and its version bump commit together, so a failed step can simply be re-run
+            conn.execute('BEGIN')
+            try:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.close()
+
+
+def run_migrations():
+    for path, migrations in MIGRATIONS.items():
+        migrate(path, migrations)
+
+
+BUSY_TIMEOUT_MS = 5000
+
+
+class ConnectionPool:
+    """Hands out one connection per (thread, database file), kept for as long as the thread runs.
+
+    Streamlit runs every script rerun on a new thread, so a connection serves one rerun. Connections of
+    threads that have exited are closed on the next checkout of a new connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def connection(self, path):
+        key = (threading.current_thread(), path)
+        with self.lock:
+            conn = self.connections.get(key)
+        if conn is None:
+            self.close_finished()
+            # Used only by its own thread; another thread closes it only once that thread has exited
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=256,
+                                   check_same_thread=False)
+            # WAL lets readers proceed while another session writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+            with self.lock:
+                self.connections[key] = conn
+        return conn
+
+    def close_finished(self):
+        """Close the connections of threads that have exited, and return how many were closed."""
+        with self.lock:
+            finished = [key for key in self.connections if not key[0].is_alive()]
+            closing = [self.connections.pop(key) for key in finished]
+        for conn in closing:
+            conn.close()
+        return len(closing)
+
+
+@st.cache_resource
+def get_pool():
+    return ConnectionPool()
+
+
+def get_connection(path):
+    """Return this thread's pooled connection to path. Do not close it."""
+    return get_pool().connection(path)
+
+
+@contextmanager
+def transaction(path):
+    """Yield the pooled connection, committing on success and rolling back on error."""
+    conn = get_connection(path)
+    with span('db.transaction', db=path), conn:
+        yield conn
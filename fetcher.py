@@ -0,0 +1,94 @@
+import os
+import time
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MAX_WORKERS = int(os.environ.get('FETCH_MAX_WORKERS', 8))
+
+# Token bucket settings per provider: (requests per second, burst size)
+PROVIDER_LIMITS = {
+    'yfinance': (4.0, 8),
+    'tessa': (2.0, 4),
+    'newsapi': (1.0, 2),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchExecutor:
+    """Bounded thread pool for per-ticker network calls, rate limited per provider."""
+
+    def __init__(self, max_workers=MAX_WORKERS, limits=PROVIDER_LIMITS, retries=3, backoff=0.5):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self.buckets = {provider: TokenBucket(rate, capacity) for provider, (rate, capacity) in limits.items()}
+        self.retries = retries
+        self.backoff = backoff
+
+    def _call(self, provider, fn, args, kwargs):
+        bucket = self.buckets.get(provider)
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                # Full jitter keeps retries from concurrent workers from lining up
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def submit(self, provider, fn, *args, **kwargs):
+        # Run in a copy of the caller's context so per-render counters keep working
+        ctx = contextvars.copy_context()
+        return self.pool.submit(ctx.run, self._call, provider, fn, args, kwargs)
+
+    def as_completed(self, provider, fn, items):
+        """Yield (item, result, error) for fn(item) over all items, in completion order."""
+        futures = {self.submit(provider, fn, item): item for item in items}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+
+    def map(self, provider, fn, items):
+        """Return {item: result} for fn(item), logging and skipping items that failed."""
+        results = {}
+        for item, result, error in self.as_completed(provider, fn, items):
+            if error is not None:
+                print(f"Error fetching {provider} data for {item}: {error}")
+            else:
+                results[item] = result
+        return results
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_fetch_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = FetchExecutor()
+        return _executor
@@ -0,0 +1,162 @@
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+from forecasting import create_model, score_predictions
+
+
+class Forecaster(ABC):
+    """One-step-ahead model over (windows, lookback, 1) inputs scaled to [0, 1]."""
+
+    name = None
+    # Whether the forecaster has update() (see IncrementalForecaster) to continue training on new windows
+    # instead of refitting from scratch
+    supports_update = False
+
+    @abstractmethod
+    def fit(self, x_train, y_train):
+        """Fit on training windows and return self."""
+
+    @abstractmethod
+    def predict(self, x):
+        """Return one scaled prediction per window as a 1-D array."""
+
+
+class IncrementalForecaster(Forecaster):
+    """Forecaster that can continue from its fitted state on newly arrived windows."""
+
+    supports_update = True
+
+    @abstractmethod
+    def update(self, x_new, y_new):
+        """Continue training on new windows only and return self."""
+
+
+class KerasForecaster(IncrementalForecaster):
+    def __init__(self, model=None, epochs=5, batch_size=32, update_epochs=2):
+        self.model = model
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.update_epochs = update_epochs
+
+    @abstractmethod
+    def build(self, input_shape):
+        """Return a compiled Keras model for windows of input_shape."""
+
+    def fit(self, x_train, y_train):
+        self.model = self.build((x_train.shape[1], 1))
+        self.model.fit(x_train, y_train, epochs=self.epochs, batch_size=self.batch_size, verbose=0)
+        return self
+
+    def update(self, x_new, y_new):
+        # Continue from the current weights on the new windows only
+        self.model.fit(x_new, y_new, epochs=self.update_epochs, batch_size=self.batch_size, verbose=0)
+        return self
+
+    def predict(self, x):
+        return self.model.predict(x, verbose=0).ravel()
+
+
+class LSTMForecaster(KerasForecaster):
+    name = 'LSTM (4 layers)'
+
+    def build(self, input_shape):
+        return create_model(input_shape)
+
+
+class GRUForecaster(KerasForecaster):
+    name = 'GRU (32 units)'
+
+    def build(self, input_shape):
+        from keras import Sequential
+        from keras import layers
+
+        model = Sequential()
+        model.add(layers.GRU(units=32, input_shape=input_shape))
+        model.add(layers.Dense(units=1))
+        model.compile(optimizer='adam', loss='mean_squared_error')
+        return model
+
+
+class RidgeForecaster(Forecaster):
+    """Linear autoregression on the same lookback windows."""
+
+    name = 'Ridge AR'
+
+    def __init__(self, alpha=1e-3):
+        from sklearn.linear_model import Ridge
+        self.model = Ridge(alpha=alpha)
+
+    def fit(self, x_train, y_train):
+        self.model.fit(x_train[:, :, 0], y_train)
+        return self
+
+    def predict(self, x):
+        return self.model.predict(x[:, :, 0])
+
+
+class ExponentialSmoothingForecaster(Forecaster):
+    """Holt's linear trend smoothing over each window, with alpha and beta grid-searched on training windows."""
+
+    name = 'Exponential smoothing'
+    GRID = np.linspace(0.05, 0.95, 10)
+
+    def __init__(self, alpha=None, beta=None):
+        self.alpha = alpha
+        self.beta = beta
+
+    @staticmethod
+    def _forecast(x, alpha, beta):
+        # Runs the recursion for every window at once, one time step per iteration
+        x = x[:, :, 0]
+        level, trend = x[:, 0], x[:, 1] - x[:, 0]
+        for t in range(1, x.shape[1]):
+            previous = level
+            level = alpha * x[:, t] + (1 - alpha) * (level + trend)
+            trend = beta * (level - previous) + (1 - beta) * trend
+        return level + trend
+
+    def fit(self, x_train, y_train):
+        # Every 5th training window is enough to pick the smoothing constants
+        x_sample, y_sample = x_train[::5], y_train[::5]
+        errors = {(alpha, beta): np.mean((self._forecast(x_sample, alpha, beta) - y_sample) ** 2)
+                  for alpha in self.GRID for beta in self.GRID}
+        self.alpha, self.beta = min(errors, key=errors.get)
+        return self
+
+    def predict(self, x):
+        return self._forecast(x, self.alpha, self.beta)
+
+
+# Forecasters by the short name used on the command line and in backtest caches
+FORECASTERS = {
+    'lstm': LSTMForecaster,
+    'gru': GRUForecaster,
+    'ridge': RidgeForecaster,
+    'holt': ExponentialSmoothingForecaster,
+}
+
+
+def default_forecasters(epochs=5):
+    return [RidgeForecaster(), ExponentialSmoothingForecaster(), GRUForecaster(epochs=epochs)]
+
+
+def compare_forecasters(forecasters, x_train, y_train, x_test, y_test, scaler, trained=None):
+    """Fit and score every forecaster on the same split and return a side-by-side table.
+
+    trained maps already fitted forecasters (e.g. the registered LSTM) to their recorded training seconds.
+    """
+    rows = []
+    fitted = [(forecaster, None) for forecaster in forecasters] + list((trained or {}).items())
+    for forecaster, train_seconds in fitted:
+        if train_seconds is None:
+            started = time.perf_counter()
+            forecaster.fit(x_train, y_train)
+            train_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        y_predicted = forecaster.predict(x_test)
+        predict_ms = (time.perf_counter() - started) * 1000
+        _, _, metrics = score_predictions(y_predicted, y_test, scaler)
+        rows.append({'Model': forecaster.name, 'MAE': metrics['mae'], 'MAPE': metrics['mape'],
+                     'Train s': train_seconds, 'Predict ms': predict_ms})
+    return pd.DataFrame(rows).sort_values('MAE').reset_index(drop=True)
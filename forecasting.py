@@ -0,0 +1,154 @@
+import weakref
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sklearn.preprocessing import MinMaxScaler
+from price_store import ensure_bars, load_bars
+
+# Days of history fed to the model and days predicted per window
+LOOKBACK = 100
+HORIZON = 1
+TRAIN_FRACTION = 0.70
+
+
+def load_price_frame(ticker, start_date, end_date):
+    """Daily bars in [start_date, end_date) from the local bar store, with Date as a column of 'YYYY-MM-DD'."""
+    ensure_bars([ticker], start_date, end_date)
+    data = load_bars(ticker, start_date, end_date).reset_index()
+    data['Date'] = data['Date'].dt.strftime('%Y-%m-%d')
+    return data
+
+
+def make_windows(values, lookback=LOOKBACK, horizon=HORIZON):
+    """Split a 1-D series into (x, y) windows as strided views of values, without copying.
+
+    x has shape (windows, lookback, 1); y holds the next value, or the next horizon values if horizon > 1.
+    """
+    windows = sliding_window_view(values, lookback + horizon)
+    x = windows[:, :lookback, np.newaxis]
+    y = windows[:, lookback] if horizon == 1 else windows[:, lookback:]
+    return x, y
+
+
+def scaler_from_params(scaler_min, scaler_scale):
+    """Rebuild a fitted MinMaxScaler from its stored min_ and scale_."""
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaler.min_ = np.array([scaler_min])
+    scaler.scale_ = np.array([scaler_scale])
+    scaler.data_min_ = -scaler.min_ / scaler.scale_
+    scaler.data_max_ = scaler.data_min_ + 1 / scaler.scale_
+    scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+    scaler.n_features_in_ = 1
+    scaler.n_samples_seen_ = 0
+    return scaler
+
+
+def prepare_data(df, lookback=LOOKBACK, horizon=HORIZON, train_fraction=TRAIN_FRACTION, scaler=None):
+    """Scale the Close series and return x_train, y_train, x_test, y_test and the scaler.
+
+    The scaler is fitted on the training split unless an already fitted one (a registered model's) is passed.
+    """
+    close = df['Close'].to_numpy(dtype=np.float64).reshape(-1, 1)
+    split = int(len(close) * train_fraction)
+    if split < lookback + horizon or len(close) - split < horizon:
+        raise ValueError(f"Need more than {lookback + horizon} training days for a lookback of {lookback}")
+
+    if scaler is None:
+        scaler = MinMaxScaler(feature_range=(0, 1))
+        scaler.fit(close[:split])
+    # One float32 buffer holds the whole scaled series; every window below is a view into it
+    scaled = scaler.transform(close).astype(np.float32).ravel()
+
+    x_train, y_train = make_windows(scaled[:split], lookback, horizon)
+    # Test windows start lookback days before the split so the first test day has a full history
+    x_test, y_test = make_windows(scaled[split - lookback:], lookback, horizon)
+    return x_train, y_train, x_test, y_test, scaler
+
+
+def create_model(input_shape):
+    from keras import Sequential
+    from keras import layers
+
+    model = Sequential()
+    model.add(layers.LSTM(units=50, activation='relu', return_sequences=True, input_shape=input_shape))
+    model.add(layers.Dropout(0.2))
+    model.add(layers.LSTM(units=60, activation='relu', return_sequences=True))
+    model.add(layers.Dropout(0.3))
+    model.add(layers.LSTM(units=80, activation='relu', return_sequences=True))
+    model.add(layers.Dropout(0.4))
+    model.add(layers.LSTM(units=120, activation='relu'))
+    model.add(layers.Dropout(0.5))
+    model.add(layers.Dense(units=1))
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+
+def score_predictions(y_predicted, y_test, scaler):
+    """Return (y_predicted, y_test) in price units with their MAE and MAPE."""
+    # Flattened so (n, 1) predictions are not broadcast against (n,) targets into an n x n matrix
+    y_predicted, y_test = np.ravel(y_predicted), np.ravel(y_test)
+
+    # Scale back to original price; inverse_transform also undoes the min_ offset, not just the scale
+    y_predicted = scaler.inverse_transform(y_predicted.reshape(-1, 1)).ravel()
+    y_test = scaler.inverse_transform(y_test.reshape(-1, 1)).ravel()
+
+    mae = float(np.mean(np.abs(y_predicted - y_test)))
+    mape = float(np.mean(np.abs((y_test - y_predicted) / y_test)) * 100)
+    return y_predicted, y_test, {'mae': mae, 'mape': mape}
+
+
+def evaluate_model(model, x_test, y_test, scaler):
+    """Predict the test windows and score them in price units."""
+    return score_predictions(model.predict(x_test, verbose=0), y_test, scaler)
+
+
+# Longest forecast offered; shorter horizons are slices of this path
+MAX_FORECAST_DAYS = 30
+
+
+# One compiled forecast loop per loaded model, dropped with the model when the registry evicts it
+_forecast_functions = weakref.WeakKeyDictionary()
+
+
+def _compiled_forecast(model):
+    import tensorflow as tf
+
+    function = _forecast_functions.get(model)
+    if function is not None:
+        return function
+    lookback = model.input_shape[1]
+    # A weak reference, so the cached function does not keep its own key alive
+    model_ref = weakref.ref(model)
+
+    @tf.function(input_signature=[tf.TensorSpec([lookback], tf.float32), tf.TensorSpec([], tf.int32)])
+    def forecast(ring, num_days):
+        positions = tf.range(lookback)
+        predictions = tf.TensorArray(tf.float32, size=num_days)
+        for step in tf.range(num_days):
+            # Oldest-to-newest view of the ring for this step
+            ordered = tf.gather(ring, (positions + step) % lookback)
+            next_value = model_ref()(ordered[tf.newaxis, :, tf.newaxis], training=False)[0, 0]
+            ring = tf.tensor_scatter_nd_update(ring, [[step % lookback]], [next_value])
+            predictions = predictions.write(step, next_value)
+        return predictions.stack()
+
+    _forecast_functions[model] = forecast
+    return forecast
+
+
+def forecast_path(model, last_window, num_days=MAX_FORECAST_DAYS):
+    """Autoregressively predict num_days scaled values after last_window in a single compiled call.
+
+    The window lives in a ring buffer: each prediction overwrites the oldest value instead of shifting
+    the whole window, and the loop runs inside one tf.function rather than one Keras predict per day.
+    The function is traced once per model; its input signature covers every window and horizon.
+    """
+    # Exported TFLite models run their own loop without TensorFlow
+    if hasattr(model, 'forecast'):
+        return model.forecast(last_window, num_days)
+
+    # TensorFlow is only needed once a forecast is actually computed
+    import tensorflow as tf
+
+    lookback = model.input_shape[1]
+    window = np.asarray(last_window, dtype=np.float32).ravel()[-lookback:]
+    return _compiled_forecast(model)(tf.constant(window), tf.constant(num_days, dtype=tf.int32)).numpy()
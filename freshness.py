@@ -0,0 +1,126 @@
+import threading
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import record_cache
+
+MARKET_TZ = ZoneInfo('America/New_York')
+# Daily bars are treated as final half an hour after the 16:00 close
+SESSION_CLOSE = time(16, 30)
+
+# How long each kind of cached item stays valid: None never expires, 'session' is valid until the
+# next market session closes, and a timedelta is a plain TTL.
+POLICIES = {
+    'closed_period': None,
+    'daily_bars': 'session',
+    'quote': timedelta(minutes=15),
+    'fundamentals': timedelta(days=7),
+}
+
+
+def _as_utc(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    # Naive timestamps (SQLite CURRENT_TIMESTAMP and our own writes) are UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def last_session_close(now=None):
+    """Most recent weekday market close at or before now (exchange holidays are not modelled)."""
+    now = (now or utc_now()).astimezone(MARKET_TZ)
+    close = datetime.combine(now.date(), SESSION_CLOSE, tzinfo=MARKET_TZ)
+    if now < close:
+        close -= timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= timedelta(days=1)
+    return close
+
+
+def next_session_close(now=None):
+    """First weekday market close strictly after now."""
+    close = last_session_close(now) + timedelta(days=1)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+    return close
+
+
+def last_closed_session_date(now=None):
+    return last_session_close(now).strftime('%Y-%m-%d')
+
+
+def period_is_closed(end_date, now=None):
+    """True once every session up to end_date has closed, so the period's return can never change."""
+    return str(end_date) <= last_closed_session_date(now)
+
+
+def is_fresh(kind, fetched_at, now=None):
+    if fetched_at is None:
+        return False
+    policy = POLICIES[kind]
+    if policy is None:
+        return True
+    now = now or utc_now()
+    fetched_at = _as_utc(fetched_at)
+    if policy == 'session':
+        return fetched_at >= last_session_close(now)
+    return now - fetched_at < policy
+
+
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='revalidate')
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def revalidate(key, refresh, *args, **kwargs):
+    """Run refresh in the background unless a refresh for the same key is already running."""
+    with _in_flight_lock:
+        if key in _in_flight:
+            return
+        _in_flight.add(key)
+
+    def run():
+        try:
+            refresh(*args, **kwargs)
+        except Exception as e:
+            print(f"Background refresh of {key} failed: {e}")
+        finally:
+            with _in_flight_lock:
+                _in_flight.discard(key)
+
+    _refresh_pool.submit(run)
+
+
+class FreshnessCache:
+    """In-process cache that serves stale values while reloading them in the background."""
+
+    def __init__(self, kind_for_key, name='freshness'):
+        self.kind_for_key = kind_for_key
+        self.name = name
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _store(self, key, load):
+        value = load()
+        # Failed lookups are not cached, so the next call retries
+        if value is not None:
+            with self.lock:
+                self.entries[key] = (value, utc_now())
+        return value
+
+    def get(self, key, load):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            record_cache(self.name, 'miss')
+            return self._store(key, load)
+        value, fetched_at = entry
+        if not is_fresh(self.kind_for_key(key), fetched_at):
+            record_cache(self.name, 'stale')
+            revalidate((id(self), key), self._store, key, load)
+        else:
+            record_cache(self.name, 'hit')
+        return value
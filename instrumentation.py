@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque, defaultdict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Samples kept per span name; older ones are dropped so memory stays bounded in a long-lived server
+MAX_SAMPLES = int(os.environ.get('INSTRUMENTATION_MAX_SAMPLES', 2000))
+# When set, every span is also appended to this file as one JSON line
+JSONL_PATH = os.environ.get('INSTRUMENTATION_JSONL')
+
+_spans = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_cache_counts = defaultdict(int)
+_lock = threading.Lock()
+
+
+def record_span(name, seconds, **labels):
+    sample = {'ts': time.time(), 'seconds': seconds, **labels}
+    with _lock:
+        _spans[name].append(sample)
+        if JSONL_PATH:
+            with open(JSONL_PATH, 'a') as f:
+                f.write(json.dumps({'span': name, **sample}, default=str) + '\n')
+
+
+@contextmanager
+def span(name, **labels):
+    """Time the enclosed block into the rolling store, also when it raises (e.g. st.stop or st.rerun)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of span."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_cache(name, result, n=1):
+    """Count n lookups of cache name ending in result: 'hit', 'miss' or 'stale' ('call' for any outcome)."""
+    with _lock:
+        _cache_counts[(name, result)] += n
+
+
+def instrument_cache(name, cache):
+    """Wrap a Streamlit cache decorator, e.g. st.cache_data(max_entries=32), counting hits and misses.
+
+    The cached body only runs on a miss, so misses are counted inside it and hits are the remaining calls.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def on_miss(*args, **kwargs):
+            record_cache(name, 'miss')
+            return func(*args, **kwargs)
+
+        cached = cache(on_miss)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                record_cache(name, 'call')
+                return cached(*args, **kwargs)
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorate
+
+
+def span_samples():
+    """All retained samples as a frame with a span column, oldest first within each span."""
+    with _lock:
+        rows = [{'span': name, **sample} for name, samples in _spans.items() for sample in samples]
+    return pd.DataFrame(rows, columns=None if rows else ['span', 'ts', 'seconds'])
+
+
+def span_summary():
+    """Count, p50, p95 and max milliseconds per span, slowest p95 first."""
+    samples = span_samples()
+    if samples.empty:
+        return pd.DataFrame(columns=['span', 'count', 'p50 ms', 'p95 ms', 'max ms'])
+    grouped = samples.groupby('span')['seconds']
+    summary = pd.DataFrame({
+        'count': grouped.size(),
+        'p50 ms': grouped.quantile(0.5) * 1000,
+        'p95 ms': grouped.quantile(0.95) * 1000,
+        'max ms': grouped.max() * 1000,
+    })
+    return summary.sort_values('p95 ms', ascending=False).reset_index()
+
+
+def slowest_labels(label='ticker', top=10):
+    """p95 milliseconds per (span, label value) for spans that carry label, slowest first."""
+    samples = span_samples()
+    if label not in samples.columns:
+        return pd.DataFrame(columns=['span', label, 'count', 'p95 ms'])
+    samples = samples.dropna(subset=[label])
+    grouped = samples.groupby(['span', label])['seconds']
+    result = pd.DataFrame({'count': grouped.size(), 'p95 ms': grouped.quantile(0.95) * 1000})
+    return result.sort_values('p95 ms', ascending=False).head(top).reset_index()
+
+
+def cache_summary():
+    """Calls, hits, misses, stale serves and hit rate per cache."""
+    with _lock:
+        counts = dict(_cache_counts)
+    caches = sorted({name for name, _ in counts})
+    rows = []
+    for name in caches:
+        misses = counts.get((name, 'miss'), 0)
+        stale = counts.get((name, 'stale'), 0)
+        # Streamlit caches count calls; the others count every outcome, so calls are their sum
+        calls = counts.get((name, 'call')) or counts.get((name, 'hit'), 0) + misses + stale
+        hits = calls - misses - stale
+        rows.append({'cache': name, 'calls': calls, 'hits': hits, 'misses': misses, 'stale': stale,
+                     'hit rate': hits / calls if calls else np.nan})
+    return pd.DataFrame(rows, columns=['cache', 'calls', 'hits', 'misses', 'stale', 'hit rate'])
+
+
+def export_jsonl():
+    """Retained samples as JSON lines."""
+    with _lock:
+        rows = [{'span': name, **sample} for name, samples in _spans.items() for sample in samples]
+    return ''.join(json.dumps(row, default=str) + '\n' for row in rows)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def export_prometheus():
+    """Span quantiles and cache counters in the Prometheus text exposition format."""
+    lines = ['# TYPE stocktikr_span_seconds summary']
+    samples = span_samples()
+    for name, seconds in (samples.groupby('span')['seconds'] if not samples.empty else []):
+        for quantile in (0.5, 0.95):
+            lines.append(f'stocktikr_span_seconds{{span="{_escape(name)}",quantile="{quantile}"}} '
+                         f'{seconds.quantile(quantile):.6f}')
+        lines.append(f'stocktikr_span_seconds_sum{{span="{_escape(name)}"}} {seconds.sum():.6f}')
+        lines.append(f'stocktikr_span_seconds_count{{span="{_escape(name)}"}} {len(seconds)}')
+    lines.append('# TYPE stocktikr_cache_lookups_total counter')
+    for row in cache_summary().to_dict('records'):
+        for result in ('hits', 'misses', 'stale'):
+            lines.append(f'stocktikr_cache_lookups_total{{cache="{_escape(row["cache"])}",result="{result}"}} '
+                         f'{row[result]}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _cache_counts.clear()
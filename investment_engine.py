@@ -0,0 +1,87 @@
+import warnings
+import numpy as np
+
+TRADING_DAYS_PER_MONTH = 21
+# Monthly returns a simulation needs to sample from; with fewer it falls back to closed-form compounding
+MIN_MONTHLY_RETURNS = 12
+PERCENTILES = [5, 25, 50, 75, 95]
+SIMULATION_METHODS = ['bootstrap', 'parametric']
+
+
+def compound_balance(principal, rate, years, contributions=0, frequency=12):
+    """Balance after years (a number or array) of compounding rate% per year frequency times a year.
+
+    Monthly contributions are paid in at the end of every period, matching the period-by-period loop
+    total = total * (1 + r) + contributions * 12 / frequency, in closed form.
+    """
+    periodic_rate = rate / (100 * frequency)
+    periods = np.asarray(years) * frequency
+    deposit = contributions * (12 / frequency)
+    growth = (1 + periodic_rate) ** periods
+    if periodic_rate == 0:
+        return principal + deposit * periods
+    return principal * growth + deposit * (growth - 1) / periodic_rate
+
+
+def monthly_log_returns(daily_returns):
+    """Overlapping 21-session log returns of a daily return series, the months a bootstrap samples from."""
+    log_returns = np.log1p(np.asarray(daily_returns, dtype=float))
+    cumulative = np.concatenate([[0.0], np.cumsum(log_returns)])
+    return cumulative[TRADING_DAYS_PER_MONTH:] - cumulative[:-TRADING_DAYS_PER_MONTH]
+
+
+def has_enough_history(daily_returns):
+    """True if the daily return history spans enough months for simulate_balances to sample from."""
+    return len(monthly_log_returns(daily_returns)) >= MIN_MONTHLY_RETURNS
+
+
+def mean_annual_return(daily_returns):
+    """Compounded mean yearly return of a daily return series in percent, 0 for an empty series."""
+    log_returns = np.log1p(np.asarray(daily_returns, dtype=float))
+    if log_returns.size == 0:
+        return 0.0
+    return float(np.expm1(log_returns.mean() * TRADING_DAYS_PER_MONTH * 12) * 100)
+
+
+def simulate_balances(daily_returns, principal, years, monthly_contribution=0, paths=20000, method='bootstrap',
+                      seed=None):
+    """Year-end balances (paths x years + 1) of investing in an asset with the given daily return history.
+
+    'bootstrap' draws each month's return from the asset's historical monthly returns; 'parametric' draws
+    monthly log returns from a normal with the history's mean and volatility. Contributions are paid in at
+    the end of every month. With fewer than MIN_MONTHLY_RETURNS months of history, every path is the
+    closed-form compound_balance at the history's mean return, and a RuntimeWarning is issued.
+    """
+    rng = np.random.default_rng(seed)
+    history = monthly_log_returns(daily_returns)
+    if len(history) < MIN_MONTHLY_RETURNS:
+        # Too short a history to sample (none at all under 21 sessions): every path compounds the
+        # history's mean return instead
+        warnings.warn(f"{len(history)} monthly returns is too few to simulate; compounding the mean return "
+                      f"instead", RuntimeWarning, stacklevel=2)
+        deterministic = compound_balance(principal, mean_annual_return(daily_returns), np.arange(years + 1),
+                                         monthly_contribution)
+        return np.tile(deterministic, (paths, 1))
+    if method == 'parametric':
+        daily_log = np.log1p(np.asarray(daily_returns, dtype=float))
+        mean = daily_log.mean() * TRADING_DAYS_PER_MONTH
+        volatility = daily_log.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_MONTH)
+
+    balances = np.empty((paths, years + 1))
+    balances[:, 0] = principal
+    balance = np.full(paths, float(principal))
+    # One year of draws at a time keeps memory at paths x 12 however long the horizon
+    for year in range(1, years + 1):
+        if method == 'parametric':
+            growth = np.exp(rng.normal(mean, volatility, (paths, 12)))
+        else:
+            growth = np.exp(rng.choice(history, (paths, 12)))
+        for month in range(12):
+            balance = balance * growth[:, month] + monthly_contribution
+        balances[:, year] = balance
+    return balances
+
+
+def percentile_bands(balances, percentiles=PERCENTILES):
+    """Percentiles of the simulated balances at every year, one row per percentile."""
+    return np.percentile(balances, percentiles, axis=0)
@@ -1,15 +1,10 @@
 import streamlit as st
-import yfinance as yf
-import pandas as pd
-import matplotlib.pyplot as plt
-import sqlite3
 from datetime import datetime, timedelta
-import google.generativeai as genai
 from supabase import create_client, Client
 from streamlit_cookies_controller import CookieController
 import time
-import os
-from tessa import Symbol
+from db import run_migrations
+from refresher import start_refresher
 
 st.set_page_config(layout="wide", page_icon="📈", page_title="Stock Tikr")
 
@@ -31,24 +26,13 @@ if 'supabase_client' not in st.session_state:
 
 @st.cache_resource
 def init_db():
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS stocks (
-        company TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        percent_change REAL
-    )
-    ''')
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS stock_lists (
-        list_name TEXT,
-        tickers TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
+    # Create or upgrade every SQLite cache schema once per process
+    run_migrations()
+
+@st.cache_resource
+def init_refresher():
+    # One background thread per server process keeps prices, info and statements warm after each close
+    return start_refresher()
 
 def sign_up(email, password):
     try:
@@ -139,6 +123,7 @@ if 'user' not in st.session_state:
 
 else:
     st.success(f"Welcome {st.session_state.user.email}!")
+    import google.generativeai as genai
     api_key = st.secrets["GEMINI_API_KEY"]
     genai.configure(api_key=api_key)
 
@@ -146,5 +131,6 @@ else:
         st.session_state.selected_tickers = ["AAPL", "GOOGL", "AMZN", "MSFT", "TSLA", "FB"]
 
     init_db()
+    init_refresher()
 
     st.switch_page("pages/Quarterly.py")
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Export registered Keras models to TFLite for TensorFlow-free inference, e.g.
+#   python model_export.py                          (every registered ticker, float16)
+#   python model_export.py AAPL --quantization int8
+import os
+import shutil
+import argparse
+import tempfile
+import threading
+import numpy as np
+
+# Largest absolute difference from the Keras predictions, in scaled [0, 1] units, for an export to be used
+PARITY_TOLERANCE = {'float32': 1e-4, 'float16': 1e-2, 'int8': 5e-2}
+
+
+def _interpreter_class():
+    # The standalone runtimes load in a fraction of TensorFlow's import time; TensorFlow is the fallback
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            # tf.lite is a lazily loaded attribute, not an importable submodule
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class LiteModel:
+    """TFLite model with the parts of the Keras model API the forecasting code uses.
+
+    Exports take one window per call (see export_model), so predict runs a batch window by window.
+    """
+
+    def __init__(self, path):
+        self.interpreter = _interpreter_class()(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None, *self.input['shape'][1:])
+        # One interpreter is shared by every session using the cached model
+        self.lock = threading.Lock()
+
+    def _run(self, window):
+        self.interpreter.set_tensor(self.input['index'], window)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index']).copy()
+
+    def predict(self, x, verbose=0):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        with self.lock:
+            return np.concatenate([self._run(x[i:i + 1]) for i in range(len(x))])
+
+    def forecast(self, last_window, num_days):
+        """Autoregressive forecast of num_days scaled values, with the window kept in a ring buffer."""
+        lookback = self.input_shape[1]
+        ring = np.asarray(last_window, dtype=np.float32).ravel()[-lookback:].copy()
+        positions = np.arange(lookback)
+        predictions = np.empty(num_days, dtype=np.float32)
+        with self.lock:
+            for step in range(num_days):
+                window = ring[(positions + step) % lookback].reshape(1, lookback, 1)
+                predictions[step] = self._run(window)[0, 0]
+                ring[step % lookback] = predictions[step]
+        return predictions
+
+
+def export_model(ticker, version=None, quantization='float16'):
+    """Convert a registered model to TFLite, check it against Keras and record the export in its metadata."""
+    import tensorflow as tf
+    from keras import models
+    from forecasting import load_price_frame, prepare_data, scaler_from_params
+    from model_registry import load_metadata, save_metadata, artifact_path, export_path
+
+    metadata = load_metadata(ticker, version)
+    model = models.load_model(artifact_path(ticker, metadata['version']))
+    scaler = scaler_from_params(metadata['scaler_min'], metadata['scaler_scale'])
+    df = load_price_frame(ticker, metadata['train_start'], metadata['train_end'])
+    _, _, x_test, _, _ = prepare_data(df, lookback=metadata['lookback'], scaler=scaler)
+
+    # Converted from a SavedModel with a fixed one-window input: the converter then lowers the LSTM loops to
+    # builtin ops and embeds the weights. A dynamic batch needs Select TF ops, which the TensorFlow-free
+    # runtimes cannot run.
+    saved_model_dir = tempfile.mkdtemp()
+    try:
+        model.export(saved_model_dir, input_signature=[tf.TensorSpec([1, metadata['lookback'], 1], tf.float32)],
+                     verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantization == 'float16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == 'int8':
+            # Dynamic-range quantization: int8 weights, float activations. Calibrated full-integer
+            # conversion of these LSTMs crashes the converter.
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converted = converter.convert()
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+    path = export_path(ticker, metadata['version'], quantization)
+    with open(path, 'wb') as f:
+        f.write(converted)
+
+    # Parity check on the held-out windows before the export may serve predictions
+    expected = model.predict(x_test, verbose=0).ravel()
+    actual = LiteModel(path).predict(x_test).ravel()
+    max_abs_error = float(np.max(np.abs(expected - actual)))
+    metadata.setdefault('exports', {})[quantization] = {
+        'file': os.path.basename(path),
+        'bytes': os.path.getsize(path),
+        'max_abs_error': max_abs_error,
+        'passed': max_abs_error <= PARITY_TOLERANCE[quantization],
+    }
+    save_metadata(ticker, metadata)
+    return metadata['exports'][quantization]
+
+
+if __name__ == '__main__':
+    from model_registry import MODEL_DIR, load_metadata
+
+    parser = argparse.ArgumentParser(description='Export registered models to TFLite.')
+    parser.add_argument('tickers', nargs='*', help='tickers to export (default: every registered model)')
+    parser.add_argument('--quantization', choices=sorted(PARITY_TOLERANCE), default='float16')
+    args = parser.parse_args()
+
+    tickers = args.tickers or sorted(os.listdir(MODEL_DIR))
+    for ticker in tickers:
+        if load_metadata(ticker) is None:
+            continue
+        try:
+            export = export_model(ticker, quantization=args.quantization)
+            status = 'ok' if export['passed'] else 'FAILED parity'
+            print(f"{ticker}: {export['file']} {export['bytes'] / 1024:.0f} KiB, "
+                  f"max abs error {export['max_abs_error']:.2e} ({status})")
+        except Exception as e:
+            print(f"Error exporting {ticker}: {e}")
@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+import numpy as np
+import streamlit as st
+from freshness import utc_now, last_closed_session_date
+
+MODEL_DIR = 'saved_models'
+# Loaded Keras models kept in memory; the least recently used is dropped beyond this
+MAX_LOADED_MODELS = 8
+# A model is reused for a requested date range whose ends are within this distance of its training window
+MAX_WINDOW_DRIFT = timedelta(days=30)
+# Longest stretch of new bars a model is fine-tuned on; a longer gap is retrained from scratch
+MAX_FINE_TUNE_GAP = timedelta(days=90)
+# Exported inference formats in order of preference when several passed their parity check
+PREFERRED_EXPORTS = ['float16', 'float32', 'int8']
+
+
+def data_hash(values):
+    """Short fingerprint of the price series a model was trained on."""
+    buffer = np.ascontiguousarray(np.asarray(values, dtype=np.float32).ravel())
+    return hashlib.sha256(buffer.tobytes()).hexdigest()[:16]
+
+
+def _ticker_dir(ticker):
+    return os.path.join(MODEL_DIR, ticker)
+
+
+def artifact_path(ticker, version):
+    return os.path.join(_ticker_dir(ticker), f'v{version}.h5')
+
+
+def metadata_path(ticker, version):
+    return os.path.join(_ticker_dir(ticker), f'v{version}.json')
+
+
+def export_path(ticker, version, quantization):
+    return os.path.join(_ticker_dir(ticker), f'v{version}-{quantization}.tflite')
+
+
+def list_versions(ticker):
+    """Registered versions of a ticker's model, oldest first."""
+    if not os.path.isdir(_ticker_dir(ticker)):
+        return []
+    return sorted(int(name[1:-5]) for name in os.listdir(_ticker_dir(ticker))
+                  if name.startswith('v') and name.endswith('.json'))
+
+
+def _read_metadata(ticker, version):
+    with open(metadata_path(ticker, version)) as f:
+        return json.load(f)
+
+
+def save_metadata(ticker, metadata):
+    # Written to a temporary file and renamed, so readers never see a partial file
+    temp_path = metadata_path(ticker, metadata['version']) + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(temp_path, metadata_path(ticker, metadata['version']))
+
+
+def load_metadata(ticker, version=None):
+    """Metadata of the given version, or of the latest one not rolled back; None if there is none."""
+    if version is not None:
+        return _read_metadata(ticker, version)
+    for version in reversed(list_versions(ticker)):
+        metadata = _read_metadata(ticker, version)
+        if not metadata.get('rolled_back'):
+            return metadata
+    return None
+
+
+def rollback(ticker):
+    """Retire the current version so the previous one serves again, and return the now current metadata.
+
+    Returns None, changing nothing, if there is no earlier version to fall back to.
+    """
+    current = load_metadata(ticker)
+    earlier = [version for version in list_versions(ticker)
+               if current and version < current['version'] and not _read_metadata(ticker, version).get('rolled_back')]
+    if not earlier:
+        return None
+    current['rolled_back'] = True
+    save_metadata(ticker, current)
+    return load_metadata(ticker)
+
+
+def register_model(ticker, model, scaler, start_date, end_date, lookback, closes, epochs, metrics, **extra):
+    """Save model as the ticker's next version with its training metadata, and return the metadata."""
+    os.makedirs(_ticker_dir(ticker), exist_ok=True)
+    versions = list_versions(ticker)
+    version = versions[-1] + 1 if versions else 1
+    metadata = {
+        'ticker': ticker,
+        'version': version,
+        'trained_at': utc_now().isoformat(),
+        'train_start': str(start_date),
+        'train_end': str(end_date),
+        'lookback': lookback,
+        'epochs': epochs,
+        'scaler_min': float(scaler.min_[0]),
+        'scaler_scale': float(scaler.scale_[0]),
+        'metrics': metrics,
+        'data_hash': data_hash(closes),
+        'artifact': os.path.basename(artifact_path(ticker, version)),
+        **extra,
+    }
+    model.save(artifact_path(ticker, version))
+    # Metadata is written last, so a version only becomes visible once its artifact is complete
+    save_metadata(ticker, metadata)
+    return metadata
+
+
+def stale_reason(metadata, start_date, end_date, lookback, closes):
+    """Why the registered model should not serve this request, or None if it can be reused."""
+    if metadata is None:
+        return "no registered model"
+    if metadata['lookback'] != lookback:
+        return f"trained with a lookback of {metadata['lookback']} days"
+    train_start = datetime.fromisoformat(metadata['train_start'])
+    train_end = datetime.fromisoformat(metadata['train_end'])
+    start_date, end_date = datetime.fromisoformat(str(start_date)), datetime.fromisoformat(str(end_date))
+    if abs(start_date - train_start) > MAX_WINDOW_DRIFT or abs(end_date - train_end) > MAX_WINDOW_DRIFT:
+        return f"trained on {metadata['train_start']} to {metadata['train_end']}"
+    if (start_date, end_date) == (train_start, train_end) and metadata['data_hash'] != data_hash(closes):
+        return "input data changed since training"
+    return None
+
+
+def can_fine_tune(metadata, start_date, end_date, lookback):
+    """True if sessions closed after the model's last_bar within the window, so fine-tuning can replace a retrain.
+
+    Independent of the MAX_WINDOW_DRIFT reuse tolerance: a window whose start slid forward qualifies, as long
+    as it does not reach back before the model's training data or leave more than MAX_FINE_TUNE_GAP of new bars.
+    """
+    if metadata is None or metadata['lookback'] != lookback or 'last_bar' not in metadata:
+        return False
+    last_bar = datetime.fromisoformat(metadata['last_bar'])
+    train_start = datetime.fromisoformat(metadata['train_start'])
+    start_date, end_date = datetime.fromisoformat(str(start_date)), datetime.fromisoformat(str(end_date))
+    newest_closed = min(end_date - timedelta(days=1), datetime.fromisoformat(last_closed_session_date()))
+    return (start_date >= train_start - MAX_WINDOW_DRIFT and last_bar < newest_closed
+            and newest_closed - last_bar <= MAX_FINE_TUNE_GAP)
+
+
+@st.cache_resource(max_entries=MAX_LOADED_MODELS)
+def _load_artifact(path):
+    from keras import models
+    return models.load_model(path)
+
+
+@st.cache_resource(max_entries=MAX_LOADED_MODELS)
+def _load_export(path):
+    from model_export import LiteModel
+    return LiteModel(path)
+
+
+def load_model(ticker, version=None, prefer_export=True):
+    """Load a registered model on first use; later calls are served from the in-memory LRU cache.
+
+    An exported TFLite model that passed its parity check is preferred, which avoids importing TensorFlow.
+    """
+    metadata = load_metadata(ticker, version)
+    if metadata is None:
+        return None, None
+    if prefer_export:
+        exports = metadata.get('exports', {})
+        for quantization in PREFERRED_EXPORTS:
+            if exports.get(quantization, {}).get('passed'):
+                return _load_export(export_path(ticker, metadata['version'], quantization)), metadata
+    return _load_artifact(artifact_path(ticker, metadata['version'])), metadata
+
+
+def model_version(metadata):
+    return f"{metadata['ticker']}@v{metadata['version']}"
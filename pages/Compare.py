@@ -1,12 +1,14 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 from utils import global_sidebar, stock_selector
+from instrumentation import span, timed
+from price_store import ensure_bars, load_closes
 
 st.set_page_config(layout="wide")
 
+@timed('page.Compare')
 def stock_comparison():
     st.title("Stock Comparison")
 
@@ -25,29 +27,31 @@ def stock_comparison():
     )
 
     if selected_stocks:
-        # Fetch data
-        df = yf.download(selected_stocks, start=start_date, end=end_date)['Adj Close']
+        # Fetch data (served from the local bar store, backfilling only uncovered dates)
+        ensure_bars(selected_stocks, start_date, end_date)
+        df = load_closes(selected_stocks, start_date, end_date)
 
         # Calculate percentage change
         df_pct = df.pct_change().cumsum()
 
         # Create line chart
-        fig = go.Figure()
-        for stock in selected_stocks:
-            fig.add_trace(go.Scatter(
-                x=df_pct.index,
-                y=df_pct[stock],
-                mode='lines',
-                name=stock
-            ))
-
-        fig.update_layout(
-            title="Cumulative Returns Comparison",
-            xaxis_title="Date",
-            yaxis_title="Cumulative Returns (%)",
-            legend_title="Stocks",
-            hovermode="x unified"
-        )
+        with span('chart.cumulative_returns'):
+            fig = go.Figure()
+            for stock in selected_stocks:
+                fig.add_trace(go.Scatter(
+                    x=df_pct.index,
+                    y=df_pct[stock],
+                    mode='lines',
+                    name=stock
+                ))
+
+            fig.update_layout(
+                title="Cumulative Returns Comparison",
+                xaxis_title="Date",
+                yaxis_title="Cumulative Returns (%)",
+                legend_title="Stocks",
+                hovermode="x unified"
+            )
 
         st.plotly_chart(fig, use_container_width=True)
 
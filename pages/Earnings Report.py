@@ -1,96 +1,23 @@
 import streamlit as st
-import yfinance as yf
-import pandas as pd
-import sqlite3
-from datetime import datetime
 from utils import global_sidebar, stock_selector
+from instrumentation import timed
+from statements import load_statement, fetch_statements, store_statement, revalidate_statements
 import plotly.graph_objects as go
 
 
-def init_db():
-    conn_fs = sqlite3.connect('financial_statements.db')
-    c_fs = conn_fs.cursor()
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS annual_income_statement (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS quarterly_income_statement (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS annual_balance_sheet (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS quarterly_balance_sheet (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS annual_cashflow (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    c_fs.execute('''
-    CREATE TABLE IF NOT EXISTS quarterly_cashflow (
-        ticker TEXT,
-        date TIMESTAMP,
-        data TEXT
-    )
-    ''')
-    conn_fs.commit()
-    conn_fs.close()
-
-init_db()
-
-
-# # Helper function to retrieve data from the database
-# def get_data_from_db(table, ticker):
-#     c_fs.execute(f'SELECT data FROM {table} WHERE ticker = ? ORDER BY date DESC LIMIT 1', (ticker,))
-#     result = c_fs.fetchone()
-#     if result:
-#         return pd.read_json(result[0])
-#     else:
-#         return None
-
-def get_data_from_db(table, ticker):
-    conn_fs = sqlite3.connect('financial_statements.db')
-    c_fs = conn_fs.cursor()
-    c_fs.execute(f'SELECT data FROM {table} WHERE ticker = ? ORDER BY date DESC LIMIT 1', (ticker,))
-    result = c_fs.fetchone()
-    if result:
-        return pd.read_json(result[0])
+def get_statement(ticker, statement, frequency):
+    # Served from the columnar store; only statements never fetched go to yfinance, and statements
+    # older than the fundamentals TTL are re-downloaded in the background
+    df = load_statement(ticker, statement, frequency)
+    if df is None:
+        df = fetch_statements(ticker, [(statement, frequency)])[(statement, frequency)]
+        store_statement(ticker, statement, frequency, df)
     else:
-        return None
-
-# # Helper function to store data in the database
-# def store_data_in_db(table, ticker, data):
-#     c_fs.execute(f'INSERT INTO {table} (ticker, date, data) VALUES (?, ?, ?)', (ticker, datetime.now(), data.to_json()))
-#     conn_fs.commit()
-
-
-def store_data_in_db(table, ticker, data):
-    conn_fs = sqlite3.connect('financial_statements.db')
-    c_fs = conn_fs.cursor()
-    c_fs.execute(f'INSERT INTO {table} (ticker, date, data) VALUES (?, ?, ?)', (ticker, datetime.now(), data.to_json()))
-    conn_fs.commit()
-    conn_fs.close()
+        revalidate_statements([ticker], [(statement, frequency)])
+    return df
 
 # Streamlit app for Financial Statements
+@timed('page.Earnings Report')
 def earnings_report():
     st.title("Financial Statements")
 
@@ -101,56 +28,37 @@ def earnings_report():
     else:
         try:
             with st.spinner('Please wait...'):
-                stock = yf.Ticker(ticker)
                 with st.container(border=True):
                     # Income Statement
                     st.subheader("Income Statement (Annual)")
-                    annual_income_stmt = get_data_from_db('annual_income_statement', ticker)
-                    if annual_income_stmt is None:
-                        annual_income_stmt = stock.financials.transpose()
-                        store_data_in_db('annual_income_statement', ticker, annual_income_stmt)
-                    st.dataframe(annual_income_stmt.transpose(), use_container_width=True)
+                    annual_income_stmt = get_statement(ticker, 'income', 'annual')
+                    st.dataframe(annual_income_stmt, use_container_width=True)
 
                     st.subheader("Income Statement (Quarterly)")
-                    quarterly_income_stmt = get_data_from_db('quarterly_income_statement', ticker)
-                    if quarterly_income_stmt is None:
-                        quarterly_income_stmt = stock.quarterly_financials.transpose()
-                        store_data_in_db('quarterly_income_statement', ticker, quarterly_income_stmt)
-                    st.dataframe(quarterly_income_stmt.transpose() , use_container_width=True)
+                    quarterly_income_stmt = get_statement(ticker, 'income', 'quarterly')
+                    st.dataframe(quarterly_income_stmt, use_container_width=True)
 
 
                 with st.container(border=True):
                     # Balance Sheet
                     st.subheader("Balance Sheet (Annual)")
-                    annual_balance_sheet = get_data_from_db('annual_balance_sheet', ticker)
-                    if annual_balance_sheet is None:
-                        annual_balance_sheet = stock.balance_sheet.transpose()
-                        store_data_in_db('annual_balance_sheet', ticker, annual_balance_sheet)
-                    st.dataframe(annual_balance_sheet.transpose(), use_container_width=True)
+                    annual_balance_sheet = get_statement(ticker, 'balance_sheet', 'annual')
+                    st.dataframe(annual_balance_sheet, use_container_width=True)
 
                     st.subheader("Balance Sheet (Quarterly)")
-                    quarterly_balance_sheet = get_data_from_db('quarterly_balance_sheet', ticker)
-                    if quarterly_balance_sheet is None:
-                        quarterly_balance_sheet = stock.quarterly_balance_sheet.transpose()
-                        store_data_in_db('quarterly_balance_sheet', ticker, quarterly_balance_sheet)
-                    st.dataframe(quarterly_balance_sheet.transpose(), use_container_width=True)
+                    quarterly_balance_sheet = get_statement(ticker, 'balance_sheet', 'quarterly')
+                    st.dataframe(quarterly_balance_sheet, use_container_width=True)
 
 
                 with st.container(border=True):
                     # Cash Flow Statement
                     st.subheader("Cash Flow Statement (Annual)")
-                    annual_cashflow = get_data_from_db('annual_cashflow', ticker)
-                    if annual_cashflow is None:
-                        annual_cashflow = stock.cashflow.transpose()
-                        store_data_in_db('annual_cashflow', ticker, annual_cashflow)
-                    st.dataframe(annual_cashflow.transpose(), use_container_width=True)
+                    annual_cashflow = get_statement(ticker, 'cashflow', 'annual')
+                    st.dataframe(annual_cashflow, use_container_width=True)
 
                     st.subheader("Cash Flow Statement (Quarterly)")
-                    quarterly_cashflow = get_data_from_db('quarterly_cashflow', ticker)
-                    if quarterly_cashflow is None:
-                        quarterly_cashflow = stock.quarterly_cashflow.transpose()
-                        store_data_in_db('quarterly_cashflow', ticker, quarterly_cashflow)
-                    st.dataframe(quarterly_cashflow.transpose(), use_container_width=True)
+                    quarterly_cashflow = get_statement(ticker, 'cashflow', 'quarterly')
+                    st.dataframe(quarterly_cashflow, use_container_width=True)
 
                 # Sankey Chart for Annual Income Statement
                 # if annual_income_stmt is not None:
@@ -1,14 +1,18 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 import plotly.graph_objects as go
-from utils import global_sidebar, stock_selector
+from utils import global_sidebar, stock_selector, get_fetch_executor
+from instrumentation import timed
+from statements import (missing_statements, fetch_statements, store_statements, load_line_items,
+                        revalidate_statements)
 
-def calculate_financial_metrics(ticker, years=5):
+METRIC_STATEMENTS = [('balance_sheet', 'annual'), ('income', 'annual')]
+BALANCE_SHEET_ITEMS = ['Invested Capital', 'Total Assets', 'Stockholders Equity', 'Current Liabilities']
+INCOME_STATEMENT_ITEMS = ['EBIT', 'Net Income']
+
+
+def calculate_financial_metrics(ticker, balance_sheet, income_stmt, years=5):
     try:
-        stock = yf.Ticker(ticker)
-        balance_sheet = stock.balance_sheet
-        income_stmt = stock.financials
         metrics = []
         for year in range(years):
             if year < len(balance_sheet.columns) and year < len(income_stmt.columns):
@@ -56,6 +60,7 @@ def create_metric_graph(df, metric):
     return fig
 
 
+@timed('page.Financial Metrics')
 def financial_metrics_page():
     st.title("Financial Metrics Calculator")
     years = st.slider("Select the number of years to calculate metrics for:", min_value=1, max_value=5, value=5)
@@ -63,9 +68,31 @@ def financial_metrics_page():
     if 'selected_tickers' in st.session_state and st.session_state.selected_tickers:
         all_metrics = []
         latest_metrics = {}
-        for ticker in st.session_state.selected_tickers:
-            metrics = calculate_financial_metrics(ticker, years=years)
-            if metrics is not None:
+        tickers = st.session_state.selected_tickers
+
+        # Only tickers without stored statements are downloaded, concurrently, storing each as it completes
+        missing_tickers = missing_statements(tickers, METRIC_STATEMENTS)
+        if missing_tickers:
+            progress = st.progress(0.0, text="Fetching financial statements...")
+            results = get_fetch_executor().as_completed(
+                "yfinance", lambda ticker: fetch_statements(ticker, METRIC_STATEMENTS), missing_tickers)
+            for done, (ticker, frames, error) in enumerate(results, start=1):
+                progress.progress(done / len(missing_tickers), text=f"Fetched {ticker} ({done}/{len(missing_tickers)})")
+                if error is not None:
+                    st.error(f"Error calculating metrics for {ticker}: {str(error)}")
+                    continue
+                store_statements(ticker, frames)
+            progress.empty()
+        revalidate_statements(tickers, METRIC_STATEMENTS)
+
+        # Just the line items the metrics need, for every ticker, in one query per statement
+        balance_sheets = load_line_items(tickers, 'balance_sheet', 'annual', BALANCE_SHEET_ITEMS)
+        income_stmts = load_line_items(tickers, 'income', 'annual', INCOME_STATEMENT_ITEMS)
+        for ticker in tickers:
+            if ticker not in balance_sheets or ticker not in income_stmts:
+                continue
+            metrics = calculate_financial_metrics(ticker, balance_sheets[ticker], income_stmts[ticker], years=years)
+            if metrics is not None and not metrics.empty:
                 metrics['Ticker'] = ticker
                 all_metrics.append(metrics)
                 latest_metrics[ticker] = metrics.iloc[0]
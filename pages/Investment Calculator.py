@@ -3,18 +3,27 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import numpy as np
-import yfinance as yf
 from datetime import datetime, timedelta
 from utils import global_sidebar, stock_selector
+from instrumentation import span, timed
+from price_store import ensure_bars, load_bars
+from investment_engine import (PERCENTILES, SIMULATION_METHODS, compound_balance, simulate_balances,
+                               percentile_bands, has_enough_history)
 
 st.set_page_config(layout="wide")
 
+# Years of daily returns the Monte Carlo simulation samples from
+SIMULATION_HISTORY_YEARS = 10
+
 
 @st.cache_data(ttl=3600)
 def fetch_stock_data(ticker, years=10):
     end_date = datetime.now()
     start_date = end_date - timedelta(days=years * 365)
-    data = yf.Ticker(ticker).history(start=start_date, end=end_date)
+    ensure_bars([ticker], start_date, end_date)
+    data = load_bars(ticker, start_date, end_date)
+    # Match the adjusted prices yfinance's history() returned before the bar store
+    data['Close'] = data['Adj Close']
     return data
 
 
@@ -24,10 +33,7 @@ def calculate_cagr(start_value, end_value, num_years):
 
 def compound_interest(principal, rate, time, contributions=0, frequency=12):
     """Calculate compound interest with optional regular contributions."""
-    total = principal
-    for _ in range(time * frequency):
-        total = total * (1 + rate / (100 * frequency)) + (contributions * (12 / frequency))
-    return total
+    return float(compound_balance(principal, rate, time, contributions, frequency))
 
 
 def retirement_savings(current_age, retirement_age, life_expectancy, current_savings,
@@ -46,10 +52,11 @@ def retirement_savings(current_age, retirement_age, life_expectancy, current_sav
 
 
 def plot_compound_interest(principal, rate, time, contributions, frequency, stock_data=None):
-    years = list(range(time + 1))
-    totals = [compound_interest(principal, rate, t, contributions, frequency) for t in years]
-    contributions_total = [principal + contributions * 12 * t for t in years]
-    interest_earned = [total - contrib for total, contrib in zip(totals, contributions_total)]
+    years = np.arange(time + 1)
+    # Every year's balance in one closed-form evaluation
+    totals = compound_balance(principal, rate, years, contributions, frequency)
+    contributions_total = principal + contributions * 12 * years
+    interest_earned = totals - contributions_total
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=years, y=totals, name='Total Balance', mode='lines'))
@@ -57,13 +64,41 @@ def plot_compound_interest(principal, rate, time, contributions, frequency, stoc
     fig.add_trace(go.Scatter(x=years, y=interest_earned, name='Interest Earned', fill='tonexty'))
 
     if stock_data is not None:
-        stock_performance = [principal * (1 + stock_data['yearly_return']) ** t for t in years]
+        stock_performance = principal * (1 + stock_data['yearly_return']) ** years
         fig.add_trace(go.Scatter(x=years, y=stock_performance, name='Stock Performance', line=dict(dash='dash')))
 
     fig.update_layout(title='Investment Growth Comparison', xaxis_title='Years', yaxis_title='Amount ($)')
     return fig
 
 
+@st.cache_data(max_entries=64)
+def simulate_bands(ticker, years, principal, contributions, paths, method):
+    history = fetch_stock_data(ticker, SIMULATION_HISTORY_YEARS)
+    daily_returns = history['Close'].pct_change().dropna().to_numpy()
+    with span('simulation', ticker=ticker):
+        balances = simulate_balances(daily_returns, principal, years, contributions, paths, method, seed=0)
+    # Only the percentiles are cached, not the paths x years balances
+    shortfall = float((balances[:, -1] < principal + contributions * 12 * years).mean())
+    return percentile_bands(balances), shortfall, not has_enough_history(daily_returns)
+
+
+def plot_simulation(bands, years, deterministic):
+    x = np.arange(years + 1)
+    fig = go.Figure()
+    # Outer band first so the inner one is drawn on top of it
+    for low, high, name in [(0, 4, f'{PERCENTILES[0]}th-{PERCENTILES[4]}th percentile'),
+                            (1, 3, f'{PERCENTILES[1]}th-{PERCENTILES[3]}th percentile')]:
+        fig.add_trace(go.Scatter(x=x, y=bands[low], mode='lines', line=dict(width=0), showlegend=False,
+                                 hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=x, y=bands[high], mode='lines', line=dict(width=0), fill='tonexty',
+                                 name=name))
+    fig.add_trace(go.Scatter(x=x, y=bands[2], mode='lines', name='Median'))
+    fig.add_trace(go.Scatter(x=x, y=deterministic, mode='lines', name='Compound Interest', line=dict(dash='dash')))
+    fig.update_layout(title='Simulated Balance', xaxis_title='Years', yaxis_title='Amount ($)')
+    return fig
+
+
+@timed('page.Investment Calculator')
 def investment_calculator():
     st.title("Investment Calculator")
     with st.container(border=True):
@@ -119,6 +154,33 @@ def investment_calculator():
             fig = plot_compound_interest(principal, rate, time, contributions, frequency, stock_data)
             st.plotly_chart(fig, use_container_width=True)
 
+    if stock_ticker:
+        with st.container(border=True):
+            st.subheader(f"Monte Carlo Simulation: {stock_ticker}")
+            col1, col2 = st.columns(2)
+            with col1:
+                method = st.radio("Sampling", SIMULATION_METHODS, horizontal=True,
+                                  format_func=lambda m: {'bootstrap': 'Bootstrap historical months',
+                                                         'parametric': 'Normal (historical mean and volatility)'}[m])
+            with col2:
+                paths = st.select_slider("Paths", [1000, 5000, 10000, 20000, 50000], value=20000)
+            bands, shortfall, compounded = simulate_bands(stock_ticker, time, principal, contributions, paths, method)
+            if compounded:
+                st.warning(f"{stock_ticker} has too little price history to sample months from; every path "
+                           f"compounds its mean return instead, so the percentiles coincide.")
+            st.caption(f"{paths:,} paths sampled from {SIMULATION_HISTORY_YEARS} years of {stock_ticker} daily "
+                       f"returns, contributing ${contributions:,} at the end of every month")
+
+            final = pd.DataFrame({'Percentile': [f"{p}th" for p in PERCENTILES], 'Final Balance': bands[:, -1]})
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.dataframe(final.style.format({'Final Balance': '${:,.0f}'}), hide_index=True,
+                             use_container_width=True)
+                st.write(f"- Chance of ending below total contributions: {shortfall:.1%}")
+            with col2:
+                deterministic = compound_balance(principal, rate, np.arange(time + 1), contributions, frequency)
+                st.plotly_chart(plot_simulation(bands, time, deterministic), use_container_width=True)
+
 
 
 global_sidebar()
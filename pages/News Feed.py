@@ -4,7 +4,8 @@ import pandas as pd
 from newsapi import NewsApiClient
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
-from utils import global_sidebar, stock_selector
+from utils import global_sidebar, stock_selector, get_fetch_executor
+from instrumentation import timed
 
 st.set_page_config(layout="wide")
 
@@ -17,14 +18,16 @@ def fetch_news(query, days=7):
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
 
-    articles = newsapi.get_everything(
+    articles = get_fetch_executor().submit(
+        "newsapi",
+        newsapi.get_everything,
         q=query,
         from_param=start_date.strftime('%Y-%m-%d'),
         to=end_date.strftime('%Y-%m-%d'),
         language='en',
         sort_by='publishedAt',
         page_size=100
-    )
+    ).result()
     return articles['articles']
 
 
@@ -65,6 +68,7 @@ def plot_news_timeline(df):
     return fig
 
 
+@timed('page.News Feed')
 def news_feed_integration():
     st.title("News Feed ")
 
@@ -1,100 +1,160 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
-from tessa import Symbol
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 from utils import global_sidebar, stock_selector, get_stock_data
-import sqlite3
-from functools import lru_cache
+from instrumentation import span, timed
+from db import PORTFOLIO_DB, get_connection, transaction
+from freshness import FreshnessCache, period_is_closed
+from portfolio_engine import load_lots, value_portfolio, equity_curve, performance_stats
+from portfolio_io import read_lots, import_lots, iter_lots_csv
+from portfolio_risk import BENCHMARK, RISK_WINDOWS, holdings_weights, portfolio_risk
 st.set_page_config(layout="wide")
 
-def init_db():
-    conn = sqlite3.connect('portfolio.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS portfolios
-                 (id INTEGER PRIMARY KEY, name TEXT UNIQUE)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS stocks
-                 (id INTEGER PRIMARY KEY, portfolio_id INTEGER,
-                  ticker TEXT, shares INTEGER, purchase_date TEXT,
-                  purchase_price REAL,
-                  FOREIGN KEY (portfolio_id) REFERENCES portfolios (id))''')
-    conn.commit()
-    return conn
-
-@lru_cache(maxsize=128)
-def get_stock_price(ticker, date):
+
+def fetch_stock_price(ticker, date):
+    from tessa import Symbol
     try:
         print(f"Fetching price for {ticker} on {date}")
-        return Symbol(ticker).price_point(str(date)).price
+        with span('fetch_stock_price', ticker=ticker):
+            return Symbol(ticker).price_point(str(date)).price
     except Exception as e:
         print(f"Error fetching price for {ticker} on {date}: {str(e)}")
         return None
 
 
+@st.cache_resource
+def get_price_cache():
+    # Prices of closed sessions never change; the open session's price is a quote with a short TTL
+    return FreshnessCache(lambda key: 'closed_period' if period_is_closed(key[1]) else 'quote', name='stock_price')
+
+
+def get_stock_price(ticker, date):
+    return get_price_cache().get((ticker, str(date)), lambda: fetch_stock_price(ticker, date))
+
+
 def load_portfolios():
-    conn = init_db()
-    portfolios = pd.read_sql('SELECT * FROM portfolios', conn)
-    conn.close()
+    portfolios = pd.read_sql('SELECT * FROM portfolios', get_connection(PORTFOLIO_DB))
     return portfolios
 
 
 def save_portfolio(name):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO portfolios (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO portfolios (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
 
 
 def update_portfolio(old_name, new_name):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE portfolios SET name = ? WHERE name = ?", (new_name, old_name))
-    conn.commit()
-    conn.close()
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE portfolios SET name = ? WHERE name = ?", (new_name, old_name))
 
 
 def delete_portfolio(name):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM portfolios WHERE name = ?", (name,))
-    cur.execute("DELETE FROM stocks WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)", (name,))
-    conn.commit()
-    conn.close()
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        # Delete the lots first; once the portfolio row is gone the sub-select matches nothing
+        cur.execute("DELETE FROM stocks WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)", (name,))
+        cur.execute("DELETE FROM equity_curve WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)",
+                    (name,))
+        cur.execute("DELETE FROM portfolios WHERE name = ?", (name,))
 
 
 def add_stock_to_portfolio(portfolio_name, ticker, shares, purchase_date, purchase_price):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO stocks (portfolio_id, ticker, shares, purchase_date, purchase_price)
-        VALUES ((SELECT id FROM portfolios WHERE name = ?), ?, ?, ?, ?)
-    """, (portfolio_name, ticker, shares, purchase_date, purchase_price))
-    conn.commit()
-    conn.close()
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO stocks (portfolio_id, ticker, shares, purchase_date, purchase_price)
+            VALUES ((SELECT id FROM portfolios WHERE name = ?), ?, ?, ?, ?)
+            ON CONFLICT (portfolio_id, ticker, purchase_date) DO UPDATE SET
+                purchase_price = (shares * purchase_price + excluded.shares * excluded.purchase_price)
+                                 / (shares + excluded.shares),
+                shares = shares + excluded.shares
+        """, (portfolio_name, ticker, shares, purchase_date, purchase_price))
 
 def delete_stock_from_portfolio(portfolio_name, stock_id):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("""
-        DELETE FROM stocks 
-        WHERE id = ? AND portfolio_id = (SELECT id FROM portfolios WHERE name = ?)
-    """, (stock_id, portfolio_name))
-    conn.commit()
-    conn.close()
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM stocks 
+            WHERE id = ? AND portfolio_id = (SELECT id FROM portfolios WHERE name = ?)
+        """, (stock_id, portfolio_name))
 
 def update_stock_in_portfolio(stock_id, shares, purchase_date, purchase_price):
-    conn = init_db()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE stocks 
-        SET shares = ?, purchase_date = ?, purchase_price = ?
-        WHERE id = ?
-    """, (shares, purchase_date, purchase_price, stock_id))
-    conn.commit()
-    conn.close()
-
+    with transaction(PORTFOLIO_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE stocks 
+            SET shares = ?, purchase_date = ?, purchase_price = ?
+            WHERE id = ?
+        """, (shares, purchase_date, purchase_price, stock_id))
+
+def portfolio_history(portfolio_stocks, end_date):
+    # Only the days since the stored curve's last closed session are computed on each render
+    with span('portfolio.equity_curve', lots=len(portfolio_stocks)):
+        curve = equity_curve(portfolio_stocks, end_date)
+    if len(curve) < 2:
+        st.info("Not enough price history yet to chart this portfolio.")
+        return
+    stats = performance_stats(curve)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Time-Weighted Return", f"{stats['twr'] * 100:.2f}%")
+    col2.metric("TWR (annualized)", f"{stats['twr_annualized'] * 100:.2f}%")
+    col3.metric("Money-Weighted Return (annualized)", f"{stats['mwr_annualized'] * 100:.2f}%")
+    col4.metric("Max Drawdown", f"{stats['max_drawdown'] * 100:.2f}%")
+
+    # WebGL traces keep multi-year daily curves responsive to zoom and hover
+    with span('chart.equity_curve'):
+        fig = go.Figure()
+        fig.add_trace(go.Scattergl(x=curve.index, y=curve['equity'], mode='lines', name="Market Value"))
+        fig.add_trace(go.Scattergl(x=curve.index, y=curve['cost_basis'], mode='lines', name="Cost Basis",
+                                   line=dict(dash='dash')))
+        fig.update_layout(title="Equity Curve", xaxis_title="Date", yaxis_title="Value ($)", hovermode="x unified")
+        drawdown = go.Figure(go.Scattergl(x=curve.index, y=curve['drawdown'] * 100, mode='lines', fill='tozeroy',
+                                          name="Drawdown"))
+        drawdown.update_layout(title="Drawdown", xaxis_title="Date", yaxis_title="Drawdown (%)", height=300)
+    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(drawdown, use_container_width=True)
+
+
+def risk_view(performance_df, portfolio_value, end_date):
+    col1, col2 = st.columns(2)
+    with col1:
+        window = st.selectbox("Return window (trading days)", RISK_WINDOWS, index=RISK_WINDOWS.index(252))
+    with col2:
+        confidence = st.selectbox("Confidence", [0.95, 0.99], format_func=lambda c: f"{c:.0%}")
+    with span('portfolio.risk', window=window):
+        result = portfolio_risk(holdings_weights(performance_df), end_date, window, confidence, portfolio_value)
+    if result is None:
+        st.info("Not enough overlapping price history for a risk estimate.")
+        return
+    summary, contributions = result
+    st.caption(f"One-day risk from {summary['observations']} daily returns, "
+               f"{summary['start']:%Y-%m-%d} to {summary['end']:%Y-%m-%d}")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Volatility (annualized)", f"{summary['volatility'] * 100:.2f}%")
+    col2.metric(f"Beta vs {BENCHMARK}", f"{summary['beta']:.2f}")
+    col3.metric("Observations", summary['observations'])
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Historical VaR", f"${summary['historical_var_dollars']:,.0f}",
+                f"{summary['historical_var'] * 100:.2f}%", delta_color="off")
+    col2.metric("Historical CVaR", f"${summary['historical_cvar_dollars']:,.0f}",
+                f"{summary['historical_cvar'] * 100:.2f}%", delta_color="off")
+    col3.metric("Parametric VaR", f"${summary['parametric_var_dollars']:,.0f}",
+                f"{summary['parametric_var'] * 100:.2f}%", delta_color="off")
+    col4.metric("Parametric CVaR", f"${summary['parametric_cvar_dollars']:,.0f}",
+                f"{summary['parametric_cvar'] * 100:.2f}%", delta_color="off")
+
+    st.dataframe(contributions.style.format({'Weight': '{:.1%}', 'Volatility': '{:.1%}', 'Beta': '{:.2f}',
+                                             'Marginal Risk': '{:.1%}', 'Risk Contribution': '{:.1%}'}),
+                 use_container_width=True)
+    fig = go.Figure(go.Bar(x=contributions.index, y=contributions['Risk Contribution'] * 100, name="Risk"))
+    fig.add_trace(go.Bar(x=contributions.index, y=contributions['Weight'] * 100, name="Weight"))
+    fig.update_layout(title="Share of Portfolio Risk vs Weight", yaxis_title="%", barmode='group')
+    st.plotly_chart(fig, use_container_width=True)
+
+
+@timed('page.Portfolio')
 def portfolio_management():
     st.title("Portfolio Management")
 
@@ -143,25 +203,39 @@ def portfolio_management():
                     st.success(f"Added {shares} shares of {ticker} to {selected_portfolio}")
                 if st.button("Add Stocks from List"):
                     stocks_list = st.session_state.selected_tickers
-                    for stock in stocks_list:
-                        add_stock_to_portfolio(selected_portfolio, stock, shares, purchase_date.isoformat(), get_stock_price(stock, purchase_date))
-                        st.success(f"Added {shares} shares of {stock} to {selected_portfolio}")
+                    # Purchase prices come from one batched close lookup and all lots commit together
+                    lots = pd.DataFrame({'ticker': stocks_list, 'shares': shares,
+                                         'purchase_date': purchase_date.isoformat(), 'purchase_price': float('nan')})
+                    added = import_lots(selected_portfolio, lots)
+                    st.success(f"Added {shares} shares each of {added} stocks to {selected_portfolio}")
+                    if added < len(lots):
+                        st.warning(f"No close on {purchase_date} for {len(lots) - added} of the selected stocks")
+
+            with st.container(border=True):
+                st.subheader("Import / Export Lots")
+                uploaded = st.file_uploader("Broker export (CSV or Parquet) with ticker/symbol, shares/quantity, "
+                                            "date and optional price columns", type=['csv', 'parquet'])
+                if uploaded is not None and st.button("Import Lots"):
+                    try:
+                        lots = read_lots(uploaded, uploaded.name)
+                        added = import_lots(selected_portfolio, lots)
+                        st.success(f"Imported {added} of {len(lots)} lots into {selected_portfolio}")
+                    except ValueError as e:
+                        st.error(f"Could not import {uploaded.name}: {e}")
+                st.download_button("Export Lots as CSV", ''.join(iter_lots_csv(selected_portfolio)),
+                                   file_name=f"{selected_portfolio}_lots.csv", mime='text/csv')
 
             # Display stocks in the selected portfolio
-            conn = init_db()
-            portfolio_stocks = pd.read_sql(
-                f"SELECT * FROM stocks WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)",
-                conn, params=(selected_portfolio,))
-            conn.close()
+            portfolio_stocks = load_lots(selected_portfolio)
 
             if not portfolio_stocks.empty:
                 # st.subheader(f"Stocks in {selected_portfolio}")
                 # st.dataframe(portfolio_stocks)
                 # Calculate current values and performance
                 end_date = datetime.now().date() - timedelta(days=1)
-                portfolio_value = 0
-                total_cost = 0
-                performance_data = []
+                # One close per distinct ticker from the bar store, joined to all lots at once
+                with span('portfolio.valuation', lots=len(portfolio_stocks)):
+                    performance_df, totals = value_portfolio(portfolio_stocks, end_date)
 
                 with st.container(border=True):
                     st.subheader(f"Stocks in {selected_portfolio}")
@@ -193,67 +267,53 @@ def portfolio_management():
                                     delete_stock_from_portfolio(selected_portfolio, stock['id'])
                                     st.success(f"Deleted {stock['ticker']} from {selected_portfolio}")
                                     st.experimental_rerun()
-                        ticker = stock['ticker']
-                        shares = stock['shares']
-                        purchase_price = stock['purchase_price']
-                        cost = shares * purchase_price
-                        total_cost += cost
-
-                        # Fetch current price (cached)
-                        current_price = get_stock_price(ticker, end_date)
-                        if current_price:
-                            current_value = current_price * shares
-                            portfolio_value += current_value
-                            gain_loss = (current_price - purchase_price) * shares
-                            percent_change = (current_price - purchase_price) / purchase_price * 100
-
-                            performance_data.append({
-                                'Ticker': ticker,
-                                'Shares': shares,
-                                'Purchase Price': purchase_price,
-                                'Current Price': current_price,
-                                'Current Value': current_value,
-                                'Gain/Loss': gain_loss,
-                                'Percent Change': percent_change
-                            })
-
-                if performance_data:
-                    performance_df = pd.DataFrame(performance_data)
+
+                if not performance_df.empty:
+                    unpriced = sorted(set(portfolio_stocks['ticker']) - set(performance_df['Ticker']))
+                    if unpriced:
+                        st.warning(f"No recent close for {', '.join(unpriced)}; left out of the totals")
 
                     with st.container(border=True):
                         st.subheader("Portfolio Performance")
-                        st.dataframe(performance_df.style.format({
+                        st.dataframe(performance_df.drop(columns='Cost').style.format({
+                            'Shares': '{:g}',
                             'Purchase Price': '${:.2f}',
                             'Current Price': '${:.2f}',
                             'Current Value': '${:.2f}',
                             'Gain/Loss': '${:.2f}',
-                            'Percent Change': '{:.2f}%'
-                        }), use_container_width=True)
+                            'Percent Change': '{:.2f}%',
+                            'Weight': '{:.1f}%'
+                        }), use_container_width=True, hide_index=True)
 
                     with st.container(border=True):
                         # Performance Summary
                         st.subheader("Performance Summary")
-                        total_gain_loss = portfolio_value - total_cost
-                        total_percent_change = (portfolio_value - total_cost) / total_cost * 100 if total_cost > 0 else 0
-
                         col1, col2, col3 = st.columns(3)
-                        col1.metric("Total Portfolio Value", f"${portfolio_value:.2f}")
-                        col2.metric("Total Gain/Loss", f"${total_gain_loss:.2f}")
-                        col3.metric("Total Percent Change", f"{total_percent_change:.2f}%")
+                        col1.metric("Total Portfolio Value", f"${totals['value']:.2f}")
+                        col2.metric("Total Gain/Loss", f"${totals['gain_loss']:.2f}")
+                        col3.metric("Total Percent Change", f"{totals['percent_change']:.2f}%")
 
-                        st.write(f"Total Cost Basis: ${total_cost:.2f}")
+                        st.write(f"Total Cost Basis: ${totals['cost']:.2f}")
                         if not performance_df.empty:
                             st.write(
                                 f"Best Performing Stock: {performance_df.loc[performance_df['Percent Change'].idxmax(), 'Ticker']} ({performance_df['Percent Change'].max():.2f}%)")
                             st.write(
                                 f"Worst Performing Stock: {performance_df.loc[performance_df['Percent Change'].idxmin(), 'Ticker']} ({performance_df['Percent Change'].min():.2f}%)")
 
-                        # Portfolio composition pie chart
-                        fig = go.Figure(
-                            data=[go.Pie(labels=performance_df['Ticker'], values=performance_df['Current Value'])])
+                        # Portfolio composition pie chart, one slice per ticker across its lots
+                        composition = performance_df.groupby('Ticker')['Current Value'].sum()
+                        fig = go.Figure(data=[go.Pie(labels=composition.index, values=composition.values)])
                         fig.update_layout(title="Portfolio Composition")
                         st.plotly_chart(fig)
 
+                    with st.container(border=True):
+                        st.subheader("Portfolio History")
+                        portfolio_history(portfolio_stocks, end_date)
+
+                    with st.container(border=True):
+                        st.subheader("Portfolio Risk")
+                        risk_view(performance_df, totals['value'], end_date)
+
                 else:
                     st.warning("Unable to fetch current prices. Please try again later.")
             else:
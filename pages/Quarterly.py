@@ -1,10 +1,12 @@
 import streamlit as st
-import pandas as pd
-from utils import get_last_n_quarters, get_last_n_years, fetch_stock_data, get_stock_data, store_stock_data, get_date_range
+from utils import get_last_n_quarters, get_last_n_years, get_date_range
 from utils import global_sidebar, stock_selector
+from instrumentation import timed
+from price_store import load_period_matrix, fill_period_matrix, track_network_calls
 import matplotlib.pyplot as plt
 st.set_page_config(layout="wide")
 
+@timed('page.Quarterly')
 def quarterly_analysis():
     st.title("Quarterly Percentage Change in Stock Prices")
 
@@ -14,7 +16,6 @@ def quarterly_analysis():
     col1, col2 = st.columns(2)
     selected_quarters = []
     graphs = []
-    combined_data = {ticker: [] for ticker in st.session_state.selected_tickers}
 
     for i in range(1, num_quarters + 1):
         if i % 2 != 0:
@@ -44,29 +45,21 @@ def quarterly_analysis():
         fig, axs = plt.subplots(num_quarters, 1, figsize=(15, 9 * num_quarters))
         axs = axs.flatten()
 
-        for i, (quarter, year) in enumerate(selected_quarters):
-            start_date, end_date = get_date_range(year, quarter)
-
-            stock_data = fetch_stock_data(selected_tickers, start_date,
-                                          end_date)
+        network_calls = track_network_calls()
+        periods = [get_date_range(year, quarter) for quarter, year in selected_quarters]
+        labels = [f"{quarter} {year}" for quarter, year in selected_quarters]
 
-            missing_tickers = [ticker for ticker in selected_tickers if ticker not in stock_data]
-            if missing_tickers:
-                api_stock_data = get_stock_data(missing_tickers, start_date, end_date, source="yfinance")
-                store_stock_data(api_stock_data, start_date, end_date)
-                stock_data.update(api_stock_data)
+        # One indexed query for the whole grid; only the masked cells are computed and cached
+        matrix, missing = load_period_matrix(selected_tickers, periods, labels)
+        if missing.values.any():
+            matrix = fill_period_matrix(matrix, missing, periods)
 
-            filtered_stock_data = {ticker: stock_data[ticker] for ticker in selected_tickers if
-                                   ticker in stock_data}
-
-            df = pd.DataFrame(list(filtered_stock_data.items()), columns=['Company', 'Percentage Change'])
+        for i, (quarter, year) in enumerate(selected_quarters):
+            df = matrix.iloc[:, i].dropna().rename('Percentage Change').reset_index()
 
             df = df.sort_values(by='Percentage Change', ascending=False)
 
             data.append(df)
-            # Update combined_data with the percentage changes
-            for ticker in selected_tickers:
-                combined_data[ticker].append(filtered_stock_data.get(ticker, 0.0))
 
             ax = axs[i]
             ax.bar(df['Company'], df['Percentage Change'], color='skyblue')
@@ -81,16 +74,11 @@ def quarterly_analysis():
                 st.bar_chart(data[i].set_index('Company'))
         with st.expander("Show Combined Plot", expanded=True):
             st.pyplot(fig)
-        # print(selected_quarters)
-        # print(combined_data)
-        combined_df = pd.DataFrame.from_dict(combined_data, orient='index',
-                                             columns=[f"{quarter} {year}" for quarter, year in selected_quarters])
-        combined_df.reset_index(inplace=True)
-        combined_df.rename(columns={'index': 'Company'}, inplace=True)
-        combined_df = combined_df.round(2)
+        combined_df = matrix.fillna(0.0).reset_index().round(2)
         with st.container(border=True):
             st.write("### Combined Percentage Change Table")
             st.dataframe(combined_df.sort_values("Company"), use_container_width=True, hide_index=True)
+            st.caption(f"Network calls this render: {network_calls.count}")
 # This includes fetching data, creating charts, and displaying results
 
 global_sidebar()
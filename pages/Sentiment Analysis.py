@@ -1,36 +1,31 @@
 import streamlit as st
 import pandas as pd
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
-import yfinance as yf
-import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime
-from utils import global_sidebar, stock_selector
+from utils import global_sidebar, stock_selector, get_fetch_executor
+from instrumentation import timed
 
 st.set_page_config(layout="wide")
 
 
 @st.cache_resource
-def download_nltk_resources():
+def get_sentiment_analyzer():
+    # nltk is imported and its lexicon downloaded only once sentiment is actually scored
+    import nltk
+    from nltk.sentiment import SentimentIntensityAnalyzer
     nltk.download('vader_lexicon')
-
-
-download_nltk_resources()
-
-# Initialize sentiment analyzer
-sia = SentimentIntensityAnalyzer()
+    return SentimentIntensityAnalyzer()
 
 
 def get_news(ticker):
     """Fetch news articles for a given stock ticker using yfinance."""
-    stock = yf.Ticker(ticker)
-    return stock.news
+    # Imported on first fetch rather than on every page load
+    import yfinance as yf
+    return get_fetch_executor().submit("yfinance", lambda: yf.Ticker(ticker).news).result()
 
 
 def analyze_sentiment(text):
     """Analyze the sentiment of a given text."""
-    return sia.polarity_scores(text)['compound']
+    return get_sentiment_analyzer().polarity_scores(text)['compound']
 
 
 def get_thumbnail_url(thumbnail_data):
@@ -46,6 +41,7 @@ def get_thumbnail_url(thumbnail_data):
     return None  # Return None if no thumbnail is available
 
 
+@timed('page.Sentiment Analysis')
 def stock_sentiment_analysis():
     st.title("Stock Sentiment Analysis")
 
@@ -80,6 +76,8 @@ def stock_sentiment_analysis():
             df = pd.DataFrame(sentiments)
 
             # Plot sentiment distribution
+            import matplotlib.pyplot as plt
+            import seaborn as sns
             fig, ax = plt.subplots(figsize=(10, 6))
             sns.histplot(df['sentiment'], kde=True, ax=ax)
             ax.set_title(f'Sentiment Distribution for {selected_stock}')
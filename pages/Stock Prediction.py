@@ -1,74 +1,59 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import numpy as np
-import os
 from datetime import datetime, timedelta
-from sklearn.preprocessing import MinMaxScaler
-from keras import models
-from keras import Sequential
-from keras import layers
 import plotly.graph_objs as go
 from utils import global_sidebar, stock_selector
+from instrumentation import span, timed, instrument_cache
+from forecasting import (LOOKBACK, MAX_FORECAST_DAYS, load_price_frame, prepare_data, scaler_from_params,
+                         evaluate_model, forecast_path)
+from model_registry import load_metadata, load_model, stale_reason, can_fine_tune, rollback, model_version
+from training_queue import FINE_TUNE_EPOCHS, get_training_queue, latest_job, job_losses
+from forecasters import LSTMForecaster, compare_forecasters, default_forecasters
 st.set_page_config(layout="wide")
 
-if not os.path.exists('saved_models'):
-    os.makedirs('saved_models')
-@st.cache_data
+@instrument_cache('load_data', st.cache_data)
 def load_data(ticker, start_date, end_date):
-    data = yf.download(ticker, start=start_date, end=end_date)
-    data.reset_index(inplace=True)
-    data['Date'] = data['Date'].dt.strftime('%Y-%m-%d')
-    return data
-
-
-def prepare_data(df):
-    df['Date'] = pd.to_datetime(df['Date'])
-
-    data_training = pd.DataFrame(df['Close'][0:int(len(df) * 0.70)])
-    data_testing = pd.DataFrame(df['Close'][int(len(df) * 0.70): int(len(df))])
-
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    data_training_array = scaler.fit_transform(data_training)
-
-    x_train = []
-    y_train = []
-    for i in range(100, data_training_array.shape[0]):
-        x_train.append(data_training_array[i - 100:i])
-        y_train.append(data_training_array[i, 0])
-
-    x_train, y_train = np.array(x_train), np.array(y_train)
-
-    past_100_days = data_training.tail(100)
-    final_df = pd.concat([past_100_days, data_testing], ignore_index=True)
-    input_data = scaler.transform(final_df)
-
-    x_test = []
-    y_test = []
-    for i in range(100, input_data.shape[0]):
-        x_test.append(input_data[i - 100:i])
-        y_test.append(input_data[i, 0])
-
-    x_test, y_test = np.array(x_test), np.array(y_test)
-
-    return x_train, y_train, x_test, y_test, scaler
-
-
-def create_model(input_shape):
-    model = Sequential()
-    model.add(layers.LSTM(units=50, activation='relu', return_sequences=True, input_shape=input_shape))
-    model.add(layers.Dropout(0.2))
-    model.add(layers.LSTM(units=60, activation='relu', return_sequences=True))
-    model.add(layers.Dropout(0.3))
-    model.add(layers.LSTM(units=80, activation='relu', return_sequences=True))
-    model.add(layers.Dropout(0.4))
-    model.add(layers.LSTM(units=120, activation='relu'))
-    model.add(layers.Dropout(0.5))
-    model.add(layers.Dense(units=1))
-    model.compile(optimizer='adam', loss='mean_squared_error')
-    return model
-
-
+    # Same bar store the training workers read, so a model's data hash matches what the page sees
+    return load_price_frame(ticker, start_date, end_date)
+
+
+@instrument_cache('load_prepared_data', st.cache_resource(max_entries=16))
+def load_prepared_data(ticker, start_date, end_date, lookback=LOOKBACK, scaler_params=None):
+    # cache_resource keeps the strided window views as they are; cache_data would pickle them into full copies
+    scaler = scaler_from_params(*scaler_params) if scaler_params else None
+    return prepare_data(load_data(ticker, start_date, end_date), lookback=lookback, scaler=scaler)
+
+
+@instrument_cache('compare_models', st.cache_data(max_entries=32))
+def compare_models(ticker, start_date, end_date, version, _model, _metadata):
+    # The alternatives are fitted on this window's split; the registered LSTM is scored with its own scaler
+    x_train, y_train, x_test, y_test, scaler = load_prepared_data(ticker, start_date, end_date)
+    comparison = compare_forecasters(default_forecasters(), x_train, y_train, x_test, y_test, scaler)
+    scaler_params = (_metadata['scaler_min'], _metadata['scaler_scale'])
+    _, _, x_test, y_test, scaler = load_prepared_data(ticker, start_date, end_date, LOOKBACK, scaler_params)
+    registered = {LSTMForecaster(_model): _metadata.get('train_seconds', float('nan'))}
+    registered = compare_forecasters([], None, None, x_test, y_test, scaler, trained=registered)
+    return pd.concat([comparison, registered]).sort_values('MAE').reset_index(drop=True)
+
+
+@st.experimental_fragment(run_every=2)
+def training_progress(ticker, served_version):
+    job = latest_job(ticker)
+    if job is None:
+        return
+    if job['status'] in ('queued', 'running'):
+        losses = job_losses(job['id'])
+        st.info(f"Training {ticker} in the background: {job['status']}, epoch {len(losses)} of {job['epochs']}")
+        if not losses.empty:
+            st.line_chart(losses, y='loss', height=200)
+    elif job['status'] == 'failed':
+        st.error(f"Training {ticker} failed: {job['error']}")
+    elif job['version'] != served_version:
+        # A newer model finished training; rerun the whole page to serve it
+        st.rerun()
+
+
+@timed('chart.price')
 def plot_price_and_ema(df):
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'], name="Close Price"))
@@ -76,6 +61,7 @@ def plot_price_and_ema(df):
     return fig
 
 
+@timed('chart.predictions')
 def plot_predictions(y_test, y_pred, dates):
     fig = go.Figure()
     fig.add_trace(go.Scatter(x=dates, y=y_test, name="Actual Price"))
@@ -90,20 +76,15 @@ def plot_price_and_predictions(df, predictions, future_dates):
     fig.update_layout(title='Historical and Predicted Stock Prices', xaxis_title='Date', yaxis_title='Price')
     return fig
 
-def predict_future(model, scaler, last_100_days, num_days):
-    future_predictions = []
-    current_batch = last_100_days[-100:].reshape((1, 100, 1))
-
-    for _ in range(num_days):
-        future_price = model.predict(current_batch)[0][0]
-        future_predictions.append(future_price)
-        current_batch = np.roll(current_batch, -1, axis=1)
-        current_batch[0, -1, 0] = future_price
-
-    future_predictions = scaler.inverse_transform(np.array(future_predictions).reshape(-1, 1))
-    return future_predictions.flatten()
+@instrument_cache('predict_future', st.cache_data(max_entries=256))
+def predict_future(model_version, last_bar_date, scaler_params, horizon, _model, _scaler, _last_window):
+    # Keyed by model version, last bar and scaler, so slider moves reuse one computed path
+    with span('model.forecast', model=model_version):
+        future_predictions = forecast_path(_model, _last_window, horizon)
+    return _scaler.inverse_transform(future_predictions.reshape(-1, 1)).flatten()
 
 
+@timed('page.Stock Prediction')
 def stock_prediction():
     st.title('Stock Trend Prediction using LSTM')
 
@@ -135,41 +116,60 @@ def stock_prediction():
         fig_price = plot_price_and_ema(df)
         st.plotly_chart(fig_price, use_container_width=True)
 
-    # Prepare data for LSTM
-    x_train, y_train, x_test, y_test, scaler = prepare_data(df)
-
-    # Check if a saved model exists
-    model_path = f'saved_models/{selected_stock}_model.h5'
-    if os.path.exists(model_path):
-        st.write(f"Loading saved model for {selected_stock}...")
-        model = models.load_model(model_path)
-    else:
-        st.write(f"No saved model found for {selected_stock}. Training a new model...")
-        model = create_model((x_train.shape[1], 1))
-        model.fit(x_train, y_train, epochs=5, batch_size=32, verbose=0)
-        model.save(model_path)
-
     with st.container(border=True):
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
             retrain = st.button("Retrain Model", use_container_width=True)
         with col2:
+            roll_back = st.button("Roll Back to Previous Model", use_container_width=True)
+        with col3:
             epochs = st.number_input("Number of epochs for retraining", min_value=1, max_value=200, value=5)
 
+    if roll_back:
+        previous = rollback(selected_stock)
+        if previous is None:
+            st.warning(f"No earlier model of {selected_stock} to roll back to")
+        else:
+            st.success(f"Serving model v{previous['version']} of {selected_stock} again")
+
+    # Models train in a background process pool; the page keeps serving the last good model meanwhile
+    training_queue = get_training_queue()
+    metadata = load_metadata(selected_stock)
+    reason = stale_reason(metadata, start_date, end_date, LOOKBACK, df['Close'])
+    # A stale model triggers one automatic training run per window; after that only "Retrain Model" does
+    last_job = latest_job(selected_stock)
+    tried_here = (last_job is not None
+                  and (last_job['start_date'], last_job['end_date']) == (str(start_date), str(end_date)))
+    # Sessions closed since the model's last bar are fine-tuned in, even while the model is still reused
+    tunable = can_fine_tune(metadata, start_date, end_date, LOOKBACK)
     if retrain:
-        st.write(f"Retraining model for {selected_stock}...")
-        model = create_model((x_train.shape[1], 1))
-        model.fit(x_train, y_train, epochs=epochs, batch_size=32, verbose=0)
-        model.save(model_path)
-        st.write("Retraining complete!")
+        training_queue.submit(selected_stock, start_date, end_date, epochs)
+    elif (reason is not None or tunable) and not tried_here:
+        if tunable:
+            # Only newer bars are missing: a few epochs on them instead of a full retrain
+            training_queue.submit(selected_stock, start_date, end_date, FINE_TUNE_EPOCHS, kind='fine_tune')
+        else:
+            training_queue.submit(selected_stock, start_date, end_date, 5)
+
+    training_progress(selected_stock, metadata['version'] if metadata else None)
+    if metadata is None:
+        st.stop()
+    if reason is not None:
+        st.warning(f"Serving saved model v{metadata['version']} for {selected_stock} ({reason}) "
+                   f"until the new model is trained")
+    else:
+        st.write(f"Using saved model v{metadata['version']} for {selected_stock} "
+                 f"(trained on {metadata['train_start']} to {metadata['train_end']})")
+    model, metadata = load_model(selected_stock, metadata['version'])
 
-    # Make predictions
-    y_predicted = model.predict(x_test)
+    # Prepare data for LSTM, scaled exactly as the model was trained
+    scaler_params = (metadata['scaler_min'], metadata['scaler_scale'])
+    x_train, y_train, x_test, y_test, scaler = load_prepared_data(selected_stock, start_date, end_date,
+                                                                  LOOKBACK, scaler_params)
 
-    # Scale back to original price
-    scale_factor = 1 / scaler.scale_[0]
-    y_predicted = y_predicted * scale_factor
-    y_test = y_test * scale_factor
+    # Make predictions, scaled back to original price
+    with span('model.predict', ticker=selected_stock):
+        y_predicted, y_test, metrics = evaluate_model(model, x_test, y_test, scaler)
 
     with st.expander("Show/hide model prediction details", expanded=True):
         # Plot predictions
@@ -180,8 +180,7 @@ def stock_prediction():
 
         # Calculate and display metrics
         st.subheader("Model Performance Metrics")
-        mae = np.mean(np.abs(y_predicted - y_test))
-        mape = np.mean(np.abs((y_test - y_predicted) / y_test)) * 100
+        mae, mape = metrics['mae'], metrics['mape']
         col1, col2 = st.columns(2)
         col1.metric("Mean Absolute Error", f"${mae:.2f}")
         col2.metric("Mean Absolute Percentage Error", f"{mape:.2f}%")
@@ -194,16 +193,26 @@ def stock_prediction():
         A lower value for both metrics indicates better model performance.
         """)
 
+    with st.expander("Show/hide model comparison", expanded=False):
+        st.subheader("Compare Forecasting Models")
+        st.write("Cheaper models trained and scored on the same 70/30 split as the LSTM.")
+        if st.button("Run comparison"):
+            comparison = compare_models(selected_stock, start_date, end_date, model_version(metadata), model, metadata)
+            st.dataframe(comparison.style.format({'MAE': '${:.2f}', 'MAPE': '{:.2f}%', 'Train s': '{:.2f}',
+                                                  'Predict ms': '{:.1f}'}), use_container_width=True)
+
 
     with st.expander("Show/hide future price predictions", expanded=True):
         # Future predictions
         st.subheader("Future Price Predictions")
-        num_future_days = st.slider("Number of days to predict:", 1, 30, 7)
+        num_future_days = st.slider("Number of days to predict:", 1, MAX_FORECAST_DAYS, 7)
 
-        last_100_days = df['Close'].values[-100:]
-        last_100_days_scaled = scaler.transform(last_100_days.reshape(-1, 1))
+        last_window = df['Close'].values[-LOOKBACK:]
+        last_window_scaled = scaler.transform(last_window.reshape(-1, 1))
 
-        future_predictions = predict_future(model, scaler, last_100_days_scaled, num_future_days)
+        future_path = predict_future(model_version(metadata), df['Date'].iloc[-1], scaler_params, MAX_FORECAST_DAYS,
+                                     model, scaler, last_window_scaled)
+        future_predictions = future_path[:num_future_days]
 
         future_dates = pd.date_range(start=df['Date'].iloc[-1], periods=num_future_days + 1)[1:].strftime('%Y-%m-%d')
 
@@ -212,10 +221,12 @@ def stock_prediction():
 
         # Plot historical and future predictions
         st.subheader('Historical and Future Price Predictions')
-        fig_future = go.Figure()
-        fig_future.add_trace(go.Scatter(x=df['Date'], y=df['Close'], name="Historical Close Price"))
-        fig_future.add_trace(go.Scatter(x=future_dates, y=future_predictions, name="Predicted Future Price"))
-        fig_future.update_layout(title='Historical and Predicted Stock Prices', xaxis_title='Date', yaxis_title='Price')
+        with span('chart.future'):
+            fig_future = go.Figure()
+            fig_future.add_trace(go.Scatter(x=df['Date'], y=df['Close'], name="Historical Close Price"))
+            fig_future.add_trace(go.Scatter(x=future_dates, y=future_predictions, name="Predicted Future Price"))
+            fig_future.update_layout(title='Historical and Predicted Stock Prices', xaxis_title='Date',
+                                     yaxis_title='Price')
         st.plotly_chart(fig_future, use_container_width=True)
 global_sidebar()
 stock_selector()
@@ -1,47 +1,13 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import sqlite3
-from contextlib import closing
 from utils import global_sidebar
+from stock_info import get_stock_info
 import plotly.graph_objects as go
 import streamlit_antd_components as sac
 st.set_page_config(layout="wide")
 
-# Function to get a new database connection
-def get_db_connection():
-    return sqlite3.connect('stock_price_data.db')
 
 global_sidebar()
-# Create table to store stock data if it doesn't exist
-with closing(get_db_connection()) as conn:
-    with conn:
-        conn.execute('''
-        CREATE TABLE IF NOT EXISTS stock_info (
-            ticker TEXT,
-            name TEXT,
-            country TEXT,
-            sector TEXT,
-            industry TEXT,
-            market_cap REAL,
-            enterprise_value REAL,
-            employees INTEGER,
-            current_price REAL,
-            prev_close REAL,
-            day_high REAL,
-            day_low REAL,
-            ft_week_high REAL,
-            ft_week_low REAL,
-            forward_eps REAL,
-            forward_pe REAL,
-            peg_ratio REAL,
-            dividend_rate REAL,
-            dividend_yield REAL,
-            recommendation TEXT,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
 
 with st.sidebar:
     with st.container(border=True):
@@ -59,26 +25,6 @@ def format_value(value):
         suffix_index += 1
     return f"${value:.1f}{suffixes[suffix_index]}"
 
-# Check if data for the stock ticker already exists in the database
-def get_stock_data_from_db(ticker):
-    with closing(get_db_connection()) as conn:
-        with conn:
-            c = conn.cursor()
-            c.execute('SELECT * FROM stock_info WHERE ticker = ?', (ticker,))
-            return c.fetchone()
-
-# Store data into the database
-def store_stock_data_in_db(data):
-    with closing(get_db_connection()) as conn:
-        with conn:
-            c = conn.cursor()
-            c.execute('''
-            INSERT INTO stock_info (ticker, name, country, sector, industry, market_cap, enterprise_value, employees, 
-                                    current_price, prev_close, day_high, day_low, ft_week_high, ft_week_low, 
-                                    forward_eps, forward_pe, peg_ratio, dividend_rate, dividend_yield, recommendation)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', data)
-
 # If Submit button is clicked
 #if button:
 title = st.empty()
@@ -100,49 +46,14 @@ if not ticker.strip():
 else:
     try:
         with st.spinner('Please wait...'):
-            # Check if data for the ticker exists in the database
-            db_data = get_stock_data_from_db(ticker)
-
-            if db_data:
-                title.subheader(f"{ticker} - {db_data[1]} (from database)")
-                country, sector, industry, market_cap, ent_value, employees, current_price, prev_close, day_high, day_low, ft_week_high, ft_week_low, forward_eps, forward_pe, peg_ratio, dividend_rate, dividend_yield, recommendation = db_data[
-                                                                                                                                                                                                                                          2:-1]
-                stock = yf.Ticker(ticker)  # Define stock here for historical data plotting
-            else:
-                # Retrieve stock data from yfinance
-                stock = yf.Ticker(ticker)
-                info = stock.info
-
-                # Retrieve and format stock information
-                country = info.get('country', 'N/A')
-                sector = info.get('sector', 'N/A')
-                industry = info.get('industry', 'N/A')
-                market_cap = info.get('marketCap', 'N/A')
-                ent_value = info.get('enterpriseValue', 'N/A')
-                employees = info.get('fullTimeEmployees', 'N/A')
-                current_price = info.get('currentPrice', 'N/A')
-                prev_close = info.get('previousClose', 'N/A')
-                day_high = info.get('dayHigh', 'N/A')
-                day_low = info.get('dayLow', 'N/A')
-                ft_week_high = info.get('fiftyTwoWeekHigh', 'N/A')
-                ft_week_low = info.get('fiftyTwoWeekLow', 'N/A')
-                forward_eps = info.get('forwardEps', 'N/A')
-                forward_pe = info.get('forwardPE', 'N/A')
-                peg_ratio = info.get('pegRatio', 'N/A')
-                dividend_rate = info.get('dividendRate', 'N/A')
-                dividend_yield = info.get('dividendYield', 'N/A')
-                recommendation = info.get('recommendationKey', 'N/A')
-
-                stock_data = (
-                ticker, info.get('longName', 'N/A'), country, sector, industry, market_cap, ent_value, employees,
-                current_price, prev_close, day_high, day_low, ft_week_high, ft_week_low, forward_eps,
-                forward_pe, peg_ratio, dividend_rate, dividend_yield, recommendation)
-
-                # Store the data in the database
-                store_stock_data_in_db(stock_data)
-
-                title.subheader(f"{ticker} - {info.get('longName', 'N/A')}")
-
+            # Stored info is served at once; rows older than the quote TTL refresh in the background
+            db_data, stale = get_stock_info(ticker)
+            title.subheader(f"{ticker} - {db_data[1]}" + (" (refreshing)" if stale else ""))
+            country, sector, industry, market_cap, ent_value, employees, current_price, prev_close, day_high, day_low, ft_week_high, ft_week_low, forward_eps, forward_pe, peg_ratio, dividend_rate, dividend_yield, recommendation = db_data[
+                                                                                                                                                                                                                                      2:-1]
+            # yfinance is imported on first use rather than on every page load
+            import yfinance as yf
+            stock = yf.Ticker(ticker)  # Define stock here for historical data plotting
 
             # Plot historical stock price data
             history = stock.history(period=period)
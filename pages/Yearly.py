@@ -1,9 +1,11 @@
 import streamlit as st
-import pandas as pd
-from utils import get_last_n_years, fetch_stock_data, get_stock_data, store_stock_data
+from utils import get_last_n_years
 from utils import global_sidebar, stock_selector
+from instrumentation import timed
+from price_store import load_period_matrix, fill_period_matrix, track_network_calls
 st.set_page_config(layout="wide")
 
+@timed('page.Yearly')
 def yearly_analysis():
     st.title("Yearly Percentage Change in Stock Prices")
 
@@ -12,7 +14,6 @@ def yearly_analysis():
 
     selected_years = []
     graphs = []
-    combined_data = {ticker: [] for ticker in st.session_state.selected_tickers}
 
     col1, col2 = st.columns(2)
 
@@ -35,35 +36,22 @@ def yearly_analysis():
     selected_tickers = st.session_state.selected_tickers
     if selected_tickers:
         data = []
-        for i, year in enumerate(selected_years):
-            start_date = f"{year}-01-01"
-            end_date = f"{year}-12-31"
-
-            stock_data = fetch_stock_data(selected_tickers, start_date,
-                                          end_date)
-
-            missing_tickers = [ticker for ticker in selected_tickers if ticker not in stock_data]
-            if missing_tickers:
-                api_stock_data = get_stock_data(missing_tickers, start_date, end_date, source="yfinance")
-                store_stock_data(api_stock_data, start_date, end_date)
-                stock_data.update(api_stock_data)
+        network_calls = track_network_calls()
+        periods = [(f"{year}-01-01", f"{year}-12-31") for year in selected_years]
 
-            filtered_stock_data = {ticker: stock_data[ticker] for ticker in selected_tickers if ticker in stock_data}
+        # One indexed query for the whole grid; only the masked cells are computed and cached
+        matrix, missing = load_period_matrix(selected_tickers, periods, selected_years)
+        if missing.values.any():
+            matrix = fill_period_matrix(matrix, missing, periods)
 
-            df = pd.DataFrame(list(filtered_stock_data.items()), columns=['Company', 'Percentage Change'])
+        for i, year in enumerate(selected_years):
+            df = matrix.iloc[:, i].dropna().rename('Percentage Change').reset_index()
 
             df = df.sort_values(by='Percentage Change', ascending=False)
 
             data.append(df)
 
-            for ticker in selected_tickers:
-                combined_data[ticker].append(filtered_stock_data.get(ticker, 0.0))
-
-        combined_df = pd.DataFrame.from_dict(combined_data, orient='index',
-                                             columns=selected_years)
-        combined_df.reset_index(inplace=True)
-        combined_df.rename(columns={'index': 'Company'}, inplace=True)
-        combined_df = combined_df.round(2)
+        combined_df = matrix.fillna(0.0).reset_index().round(2)
 
         for i, graph in enumerate(graphs):
             with graph:
@@ -73,6 +61,7 @@ def yearly_analysis():
         with st.container(border=True):
             st.write("### Combined Percentage Change Table")
             st.dataframe(combined_df.sort_values("Company"), use_container_width=True, hide_index=True)
+            st.caption(f"Network calls this render: {network_calls.count}")
 
 global_sidebar()
 stock_selector()
@@ -0,0 +1,227 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from db import PORTFOLIO_DB, get_connection, transaction
+from freshness import last_closed_session_date
+from price_store import ensure_bars, load_closes
+
+# Calendar days looked back for a ticker's latest close, enough to span weekends and holidays
+LATEST_CLOSE_LOOKBACK_DAYS = 10
+
+CURVE_COLUMNS = ['equity', 'cost_basis', 'cash_flow', 'twr_index', 'peak']
+VALUATION_COLUMNS = ['Ticker', 'Shares', 'Purchase Price', 'Current Price', 'Cost', 'Current Value', 'Gain/Loss',
+                     'Percent Change', 'Weight']
+
+
+def load_lots(portfolio_name):
+    """All lots of a portfolio, one row per (ticker, purchase date)."""
+    return pd.read_sql('''
+        SELECT * FROM stocks WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)
+    ''', get_connection(PORTFOLIO_DB), params=(portfolio_name,))
+
+
+def latest_closes(tickers, as_of):
+    """Last stored close on or before as_of for each distinct ticker, backfilling the bar store in one batch.
+
+    Tickers without a close in the lookback window are left out.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return pd.Series(dtype=float)
+    end = pd.Timestamp(as_of) + pd.Timedelta(days=1)
+    start = end - pd.Timedelta(days=LATEST_CLOSE_LOOKBACK_DAYS)
+    ensure_bars(tickers, start, end)
+    closes = load_closes(tickers, start, end, column='close')
+    return closes.ffill().iloc[-1].dropna() if not closes.empty else pd.Series(dtype=float)
+
+
+def value_lots(lots, prices):
+    """Value every lot against prices (a Series indexed by ticker) in one join.
+
+    Returns one row per priced lot with cost, value, gain/loss, percent change and portfolio weight;
+    lots whose ticker has no price are dropped.
+    """
+    valued = lots.join(prices.rename('Current Price'), on='ticker', how='inner')
+    shares = valued['shares'].to_numpy(dtype=float)
+    purchase_price = valued['purchase_price'].to_numpy(dtype=float)
+    current_price = valued['Current Price'].to_numpy(dtype=float)
+    cost = shares * purchase_price
+    value = shares * current_price
+    total_value = value.sum()
+    return pd.DataFrame({
+        'Ticker': valued['ticker'].to_numpy(),
+        'Shares': shares,
+        'Purchase Price': purchase_price,
+        'Current Price': current_price,
+        'Cost': cost,
+        'Current Value': value,
+        'Gain/Loss': value - cost,
+        'Percent Change': (current_price - purchase_price) / purchase_price * 100,
+        'Weight': value / total_value * 100 if total_value else np.zeros(len(value)),
+    }, index=valued.index, columns=VALUATION_COLUMNS)
+
+
+def portfolio_totals(valuation):
+    """Total value, cost, gain/loss and percent change of a value_lots result."""
+    value = valuation['Current Value'].sum()
+    cost = valuation['Cost'].sum()
+    return {
+        'value': value,
+        'cost': cost,
+        'gain_loss': value - cost,
+        'percent_change': (value - cost) / cost * 100 if cost > 0 else 0,
+    }
+
+
+def value_portfolio(lots, as_of):
+    """Value a portfolio's lots at the latest close on or before as_of, each ticker priced once."""
+    prices = latest_closes(lots['ticker'], as_of)
+    valuation = value_lots(lots, prices)
+    return valuation, portfolio_totals(valuation)
+
+
+def holdings_hash(lots):
+    """Fingerprint of the lots an equity curve was computed from."""
+    key = lots.sort_values(['ticker', 'purchase_date'])[['ticker', 'shares', 'purchase_date', 'purchase_price']]
+    return hashlib.sha256(key.to_csv(index=False).encode()).hexdigest()[:16]
+
+
+def _load_curve(portfolio_id, fingerprint):
+    curve = pd.read_sql('''
+        SELECT date, equity, cost_basis, cash_flow, twr_index, peak FROM equity_curve
+        WHERE portfolio_id = ? AND holdings_hash = ?
+        ORDER BY date
+    ''', get_connection(PORTFOLIO_DB), params=(portfolio_id, fingerprint))
+    curve.index = pd.to_datetime(curve.pop('date')).rename('Date')
+    return curve
+
+
+def _store_curve(portfolio_id, fingerprint, curve, replace):
+    # Only closed sessions are final; later days are recomputed from the last stored row
+    closed = curve[curve.index <= pd.Timestamp(last_closed_session_date())]
+    rows = zip([portfolio_id] * len(closed), closed.index.strftime('%Y-%m-%d'), [fingerprint] * len(closed),
+               *(closed[column].tolist() for column in CURVE_COLUMNS))
+    with transaction(PORTFOLIO_DB) as conn:
+        if replace:
+            conn.execute('DELETE FROM equity_curve WHERE portfolio_id = ?', (portfolio_id,))
+        conn.executemany('''
+            INSERT OR REPLACE INTO equity_curve (portfolio_id, date, holdings_hash, equity, cost_basis, cash_flow,
+                                                 twr_index, peak)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def extend_curve(lots, closes, previous=None):
+    """Equity curve over the dates of closes (forward-filled, date by ticker), continuing from previous.
+
+    previous is the curve's last row so far; lots bought on or before its date are already held. A lot
+    enters on the first trading day on or after its purchase date, at its purchase price as cash flow.
+    """
+    dates, tickers = closes.index, closes.columns
+    purchase_dates = pd.to_datetime(lots['purchase_date'])
+    held = purchase_dates <= previous.name if previous is not None else np.zeros(len(lots), dtype=bool)
+    shares = lots['shares'].to_numpy(dtype=float)
+    columns = tickers.get_indexer(lots['ticker'])
+
+    opening_shares = np.zeros(len(tickers))
+    np.add.at(opening_shares, columns[held], shares[held])
+    positions = dates.searchsorted(purchase_dates[~held])
+    in_range = positions < len(dates)
+    new_columns = columns[~held][in_range]
+    new_shares = shares[~held][in_range]
+    new_prices = lots['purchase_price'].to_numpy(dtype=float)[~held][in_range]
+    share_flows = np.zeros((len(dates), len(tickers)))
+    np.add.at(share_flows, (positions[in_range], new_columns), new_shares)
+    cash_flow = np.zeros(len(dates))
+    np.add.at(cash_flow, positions[in_range], new_shares * new_prices)
+
+    # Tickers without a close yet are worth nothing until their first bar
+    prices = np.nan_to_num(closes.to_numpy(dtype=float))
+    equity = ((opening_shares + np.cumsum(share_flows, axis=0)) * prices).sum(axis=1)
+    opening = previous if previous is not None else pd.Series({'equity': 0.0, 'cost_basis': 0.0, 'twr_index': 1.0,
+                                                                'peak': 0.0})
+    prior_equity = np.concatenate([[opening['equity']], equity[:-1]])
+    # Each day's return nets out that day's purchases, so added money is not counted as performance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_growth = np.where(prior_equity > 0, (equity - cash_flow) / prior_equity, 1.0)
+    return pd.DataFrame({
+        'equity': equity,
+        'cost_basis': opening['cost_basis'] + np.cumsum(cash_flow),
+        'cash_flow': cash_flow,
+        'twr_index': opening['twr_index'] * np.cumprod(daily_growth),
+        'peak': np.maximum.accumulate(np.concatenate([[opening['peak']], equity]))[1:],
+    }, index=dates.rename('Date'))
+
+
+def equity_curve(lots, end_date):
+    """Daily equity, cost basis, purchases, time-weighted return index, peak and drawdown through end_date.
+
+    The curve is kept in equity_curve through the last closed session, so each call only computes the
+    days after the last stored one. Editing any lot recomputes it from the first purchase.
+    """
+    if lots.empty:
+        return pd.DataFrame(columns=CURVE_COLUMNS + ['drawdown'])
+    portfolio_id = int(lots['portfolio_id'].iloc[0])
+    fingerprint = holdings_hash(lots)
+    curve = _load_curve(portfolio_id, fingerprint)
+    previous = curve.iloc[-1] if not curve.empty else None
+    start = (previous.name + pd.Timedelta(days=1) if previous is not None
+             else pd.to_datetime(lots['purchase_date']).min())
+    end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+
+    if start < end:
+        tickers = list(dict.fromkeys(lots['ticker']))
+        # A few days before start so the first new day can carry forward the last known closes
+        window_start = start - pd.Timedelta(days=LATEST_CLOSE_LOOKBACK_DAYS)
+        ensure_bars(tickers, window_start, end)
+        closes = load_closes(tickers, window_start, end, column='close')
+        # Stop at the last day every ticker has a bar for; a tail still being fetched must not be stored
+        # as a flat price. Tickers with no bar in the window at all (e.g. delisted) do not hold it back.
+        last_bars = closes.apply(pd.Series.last_valid_index).dropna()
+        closes = closes.ffill()
+        until = last_bars.min() if not last_bars.empty else start - pd.Timedelta(days=1)
+        closes = closes[(closes.index >= start) & (closes.index <= until)]
+        if not closes.empty:
+            new_days = extend_curve(lots, closes, previous)
+            _store_curve(portfolio_id, fingerprint, new_days, replace=previous is None)
+            curve = pd.concat([curve, new_days]) if not curve.empty else new_days
+
+    curve = curve.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curve['drawdown'] = np.where(curve['peak'] > 0, curve['equity'] / curve['peak'] - 1, 0.0)
+    return curve
+
+
+def money_weighted_return(cash_flow, final_value):
+    """Annualized internal rate of return of dated purchases (cash_flow, indexed by date) ending at final_value."""
+    flows = cash_flow[cash_flow != 0]
+    if flows.empty or flows.index[0] >= cash_flow.index[-1]:
+        return np.nan
+    years = ((cash_flow.index[-1] - flows.index).days / 365.25).to_numpy()
+    amounts = flows.to_numpy()
+
+    def excess(rate):
+        # Final value less every purchase grown at rate; falls as rate rises
+        return final_value - (amounts * (1 + rate) ** years).sum()
+
+    low, high = -0.99, 1.0
+    while excess(high) > 0 and high < 1e6:
+        high *= 2
+    if excess(low) < 0 or excess(high) > 0:
+        return np.nan
+    for _ in range(100):
+        middle = (low + high) / 2
+        low, high = (middle, high) if excess(middle) > 0 else (low, middle)
+    return (low + high) / 2
+
+
+def performance_stats(curve):
+    """Time-weighted return (total and annualized), money-weighted return and maximum drawdown of a curve."""
+    years = (curve.index[-1] - curve.index[0]).days / 365.25
+    twr = curve['twr_index'].iloc[-1] - 1
+    return {
+        'twr': twr,
+        'twr_annualized': (1 + twr) ** (1 / years) - 1 if years > 0 else np.nan,
+        'mwr_annualized': money_weighted_return(curve['cash_flow'], curve['equity'].iloc[-1]),
+        'max_drawdown': curve['drawdown'].min(),
+    }
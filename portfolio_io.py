@@ -0,0 +1,175 @@
+# Bulk lot import from broker exports and streaming export of a portfolio's lots.
+#   python portfolio_io.py import NAME lots.csv|lots.parquet
+#   python portfolio_io.py export NAME lots.csv|lots.parquet
+import os
+import argparse
+import pandas as pd
+from db import PORTFOLIO_DB, get_connection, transaction, run_migrations
+from price_store import ensure_bars, load_closes
+
+LOT_COLUMNS = ['ticker', 'shares', 'purchase_date', 'purchase_price']
+# Column names used by common broker exports, mapped to the lot columns they hold
+COLUMN_ALIASES = {
+    'ticker': ['ticker', 'symbol', 'security', 'instrument'],
+    'shares': ['shares', 'quantity', 'qty', 'units'],
+    'purchase_date': ['purchase_date', 'purchase date', 'date', 'trade date', 'date acquired', 'acquired',
+                      'open date'],
+    'purchase_price': ['purchase_price', 'purchase price', 'price', 'cost per share', 'unit cost',
+                       'average cost', 'avg cost'],
+}
+# Lots read from the database per batch while exporting
+EXPORT_CHUNK_SIZE = 5000
+# Calendar days looked back for a close when a purchase fell on a weekend or holiday
+PRICE_LOOKBACK_DAYS = 10
+
+
+def normalize_lots(raw):
+    """Map a broker export's columns onto ticker, shares, purchase_date and purchase_price.
+
+    purchase_price may be missing or blank; those lots are priced from stored closes by fill_purchase_prices.
+    """
+    by_name = {str(column).strip().lower(): column for column in raw.columns}
+    columns = {}
+    for target, aliases in COLUMN_ALIASES.items():
+        source = next((by_name[alias] for alias in aliases if alias in by_name), None)
+        if source is not None:
+            columns[target] = raw[source]
+    missing = [column for column in ('ticker', 'shares', 'purchase_date') if column not in columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    lots = pd.DataFrame(columns)
+    lots['ticker'] = lots['ticker'].astype(str).str.strip().str.upper()
+    lots['shares'] = pd.to_numeric(lots['shares'], errors='coerce')
+    lots['purchase_date'] = pd.to_datetime(lots['purchase_date'], errors='coerce').dt.strftime('%Y-%m-%d')
+    if 'purchase_price' in lots:
+        # Currency formatted prices such as "$1,234.50"
+        prices = lots['purchase_price'].astype(str).str.replace(r'[$,\s]', '', regex=True)
+        lots['purchase_price'] = pd.to_numeric(prices, errors='coerce')
+    else:
+        lots['purchase_price'] = float('nan')
+    lots = lots.dropna(subset=['shares', 'purchase_date'])
+    return lots[(lots['ticker'] != '') & (lots['shares'] > 0)][LOT_COLUMNS].reset_index(drop=True)
+
+
+def read_lots(file, name):
+    """Read and normalize a CSV or Parquet broker export; name (the file name) picks the format."""
+    if name.lower().endswith('.parquet'):
+        raw = pd.read_parquet(file)
+    else:
+        raw = pd.read_csv(file)
+    return normalize_lots(raw)
+
+
+def purchase_closes(lots):
+    """Close on or before each lot's purchase date, from one backfill and one query over all its tickers."""
+    tickers = list(dict.fromkeys(lots['ticker']))
+    dates = pd.to_datetime(lots['purchase_date'])
+    start = dates.min() - pd.Timedelta(days=PRICE_LOOKBACK_DAYS)
+    end = dates.max() + pd.Timedelta(days=1)
+    ensure_bars(tickers, start, end)
+    closes = load_closes(tickers, start, end, column='close').ffill()
+    if closes.empty:
+        return pd.Series(float('nan'), index=lots.index)
+    # Row of the last trading day on or before each purchase, then the lot's ticker column
+    rows = closes.index.searchsorted(dates, side='right') - 1
+    values = closes.to_numpy()[rows.clip(0), closes.columns.get_indexer(lots['ticker'])]
+    values[rows < 0] = float('nan')
+    return pd.Series(values, index=lots.index)
+
+
+def fill_purchase_prices(lots):
+    """Price lots without a purchase price at their purchase date's close, in one batched lookup."""
+    unpriced = lots['purchase_price'].isna()
+    if unpriced.any():
+        lots = lots.copy()
+        lots.loc[unpriced, 'purchase_price'] = purchase_closes(lots[unpriced])
+    return lots
+
+
+def import_lots(portfolio_name, lots):
+    """Add lots to a portfolio in one transaction; a lot matching an existing (ticker, purchase date) is merged.
+
+    Returns the number of lots written; lots still without a price are skipped.
+    """
+    lots = fill_purchase_prices(lots).dropna(subset=['purchase_price'])
+    with transaction(PORTFOLIO_DB) as conn:
+        row = conn.execute('SELECT id FROM portfolios WHERE name = ?', (portfolio_name,)).fetchone()
+        if row is None:
+            raise ValueError(f"No portfolio named {portfolio_name}")
+        conn.executemany('''
+            INSERT INTO stocks (portfolio_id, ticker, shares, purchase_date, purchase_price)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (portfolio_id, ticker, purchase_date) DO UPDATE SET
+                purchase_price = (shares * purchase_price + excluded.shares * excluded.purchase_price)
+                                 / (shares + excluded.shares),
+                shares = shares + excluded.shares
+        ''', zip([row[0]] * len(lots), lots['ticker'], lots['shares'].tolist(), lots['purchase_date'],
+                 lots['purchase_price'].tolist()))
+    return len(lots)
+
+
+def iter_lot_chunks(portfolio_name, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a portfolio's lots as DataFrames of at most chunk_size rows, without loading them all at once."""
+    cur = get_connection(PORTFOLIO_DB).execute('''
+        SELECT ticker, shares, purchase_date, purchase_price FROM stocks
+        WHERE portfolio_id = (SELECT id FROM portfolios WHERE name = ?)
+        ORDER BY ticker, purchase_date
+    ''', (portfolio_name,))
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=LOT_COLUMNS)
+
+
+def iter_lots_csv(portfolio_name, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield a portfolio's lots as CSV text, header first, one chunk at a time."""
+    yield ','.join(LOT_COLUMNS) + '\n'
+    for chunk in iter_lot_chunks(portfolio_name, chunk_size):
+        yield chunk.to_csv(index=False, header=False)
+
+
+def export_lots(portfolio_name, path, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write a portfolio's lots to a CSV or Parquet file chunk by chunk, and return the number written."""
+    written = 0
+    if path.lower().endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([('ticker', pa.string()), ('shares', pa.float64()), ('purchase_date', pa.string()),
+                            ('purchase_price', pa.float64())])
+        with pq.ParquetWriter(path, schema) as writer:
+            for chunk in iter_lot_chunks(portfolio_name, chunk_size):
+                chunk['shares'] = chunk['shares'].astype(float)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                written += len(chunk)
+        return written
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(LOT_COLUMNS) + '\n')
+        for chunk in iter_lot_chunks(portfolio_name, chunk_size):
+            chunk.to_csv(f, index=False, header=False)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or export a portfolio's lots as CSV or Parquet.")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('portfolio', help='portfolio name; created on import if it does not exist')
+    parser.add_argument('path', help='.csv or .parquet file')
+    args = parser.parse_args()
+
+    run_migrations()
+    if args.action == 'export':
+        print(f"Exported {export_lots(args.portfolio, args.path)} lots to {args.path}")
+        return
+    with open(args.path, 'rb') as f:
+        lots = read_lots(f, os.path.basename(args.path))
+    with transaction(PORTFOLIO_DB) as conn:
+        conn.execute('INSERT INTO portfolios (name) VALUES (?) ON CONFLICT (name) DO NOTHING', (args.portfolio,))
+    imported = import_lots(args.portfolio, lots)
+    print(f"Imported {imported} of {len(lots)} lots into {args.portfolio}")
+
+
+if __name__ == '__main__':
+    main()
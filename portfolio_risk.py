@@ -0,0 +1,138 @@
+import threading
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import streamlit as st
+from price_store import ensure_bars, load_closes
+
+BENCHMARK = 'SOXX'
+TRADING_DAYS = 252
+# Return windows offered, in trading days
+RISK_WINDOWS = [63, 126, 252, 504]
+# Calendar days of bars loaded per trading day of window, with room for holidays
+CALENDAR_DAYS_PER_TRADING_DAY = 1.5
+
+
+class ReturnWindow:
+    """The last `window` aligned daily returns of some tickers, with running sums for their covariance.
+
+    update() appends the returns of newly arrived bars and drops the oldest ones, adjusting the sums of
+    returns and of their cross products instead of recomputing the covariance from all rows.
+    """
+
+    def __init__(self, tickers, window):
+        self.tickers = list(tickers)
+        self.window = window
+        self.returns = pd.DataFrame(columns=self.tickers, dtype=float)
+        self.sums = np.zeros(len(self.tickers))
+        self.cross = np.zeros((len(self.tickers), len(self.tickers)))
+        self.lock = threading.Lock()
+
+    def _load_returns(self, start, end):
+        ensure_bars(self.tickers, start, end)
+        closes = load_closes(self.tickers, start, end)
+        # Rows where every ticker traded, so each return spans the same two sessions for all of them
+        return closes.dropna().pct_change().iloc[1:]
+
+    def update(self, end_date):
+        end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        with self.lock:
+            if self.returns.empty:
+                lookback = pd.Timedelta(days=int((self.window + 1) * CALENDAR_DAYS_PER_TRADING_DAY) + 10)
+                new = self._load_returns(end - lookback, end)
+            else:
+                # Restart from the last stored close so the first new return is against it
+                new = self._load_returns(self.returns.index[-1] - pd.Timedelta(days=10), end)
+                new = new[new.index > self.returns.index[-1]]
+            if new.empty:
+                return self
+            if len(new) >= self.window:
+                self.returns = new.iloc[-self.window:]
+                values = self.returns.to_numpy()
+                self.sums = values.sum(axis=0)
+                self.cross = values.T @ values
+                return self
+            returns = pd.concat([self.returns, new]) if not self.returns.empty else new
+            dropped = returns.iloc[:max(len(returns) - self.window, 0)].to_numpy()
+            added = new.to_numpy()
+            self.sums += added.sum(axis=0) - dropped.sum(axis=0)
+            self.cross += added.T @ added - dropped.T @ dropped
+            self.returns = returns.iloc[-self.window:]
+        return self
+
+    def covariance(self):
+        """Sample covariance of the daily returns in the window."""
+        n = len(self.returns)
+        return (self.cross - np.outer(self.sums, self.sums) / n) / (n - 1)
+
+    def mean(self):
+        return self.sums / len(self.returns)
+
+
+@st.cache_resource(max_entries=32)
+def get_return_window(tickers, window):
+    """Shared ReturnWindow per (tickers, window); later calls only fold in bars that arrived since."""
+    return ReturnWindow(tickers, window)
+
+
+def holdings_weights(valuation):
+    """Weight of each ticker in the portfolio, from a portfolio_engine.value_lots result."""
+    values = valuation.groupby('Ticker')['Current Value'].sum()
+    return values / values.sum()
+
+
+def portfolio_risk(weights, end_date, window=TRADING_DAYS, confidence=0.95, value=1.0):
+    """Volatility, beta against SOXX, VaR/CVaR and per-ticker risk contributions of a weighted portfolio.
+
+    VaR and CVaR are one-day losses as positive fractions of value and, scaled by value, in dollars.
+    Returns (summary dict, per-ticker contributions frame); None when there are too few aligned returns.
+    """
+    tickers = tuple(sorted(weights.index))
+    columns = list(tickers) + ([BENCHMARK] if BENCHMARK not in tickers else [])
+    returns_window = get_return_window(tuple(columns), window).update(end_date)
+    if len(returns_window.returns) < 20:
+        return None
+
+    covariance = returns_window.covariance()
+    mean = returns_window.mean()
+    assets = [columns.index(ticker) for ticker in tickers]
+    benchmark = columns.index(BENCHMARK)
+    w = weights.reindex(tickers).to_numpy()
+
+    asset_covariance = covariance[np.ix_(assets, assets)]
+    variance = w @ asset_covariance @ w
+    volatility = np.sqrt(variance)
+    beta = (w @ covariance[assets, benchmark]) / covariance[benchmark, benchmark]
+
+    # Marginal contribution of each ticker to portfolio volatility; the contributions sum to it
+    marginal = asset_covariance @ w / volatility
+    contributions = pd.DataFrame({
+        'Weight': w,
+        'Volatility': np.sqrt(np.diag(asset_covariance) * TRADING_DAYS),
+        'Beta': covariance[assets, benchmark] / covariance[benchmark, benchmark],
+        'Marginal Risk': marginal * np.sqrt(TRADING_DAYS),
+        'Risk Contribution': w * marginal / volatility,
+    }, index=pd.Index(tickers, name='Ticker'))
+
+    portfolio_returns = returns_window.returns.iloc[:, assets].to_numpy() @ w
+    historical_var = -np.quantile(portfolio_returns, 1 - confidence)
+    historical_cvar = -portfolio_returns[portfolio_returns <= -historical_var].mean()
+    z = NormalDist().inv_cdf(confidence)
+    mean_return = mean[assets] @ w
+    parametric_var = z * volatility - mean_return
+    parametric_cvar = volatility * NormalDist().pdf(z) / (1 - confidence) - mean_return
+
+    summary = {
+        'observations': len(portfolio_returns),
+        'start': returns_window.returns.index[0],
+        'end': returns_window.returns.index[-1],
+        'volatility': volatility * np.sqrt(TRADING_DAYS),
+        'beta': beta,
+        'historical_var': historical_var,
+        'historical_cvar': historical_cvar,
+        'parametric_var': parametric_var,
+        'parametric_cvar': parametric_cvar,
+    }
+    for key in ('historical_var', 'historical_cvar', 'parametric_var', 'parametric_cvar'):
+        summary[f'{key}_dollars'] = summary[key] * value
+    return summary, contributions.sort_values('Risk Contribution', ascending=False)
@@ -0,0 +1,290 @@
+import contextvars
+import zlib
+from concurrent.futures import as_completed
+import numpy as np
+import pandas as pd
+from fetcher import get_fetch_executor
+from db import ALL_STOCK_DB, get_connection, transaction
+from freshness import last_closed_session_date, period_is_closed, revalidate
+from instrumentation import timed, record_cache
+
+BARS_DB = ALL_STOCK_DB
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+def _to_date_str(value):
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def download_history_batch(tickers, start_date, end_date):
+    """Download daily bars for several tickers from yfinance in one grouped request."""
+    import yfinance as yf
+    hist = yf.download(tickers, start=start_date, end=end_date, group_by='ticker', auto_adjust=False,
+                       threads=True, progress=False)
+    bars = {}
+    for ticker in tickers:
+        if isinstance(hist.columns, pd.MultiIndex):
+            if ticker not in hist.columns.get_level_values(0):
+                continue
+            ticker_hist = hist[ticker]
+        else:
+            ticker_hist = hist
+        ticker_hist = ticker_hist.reindex(columns=BAR_COLUMNS).dropna(how='all')
+        ticker_hist.index = pd.DatetimeIndex(pd.DatetimeIndex(ticker_hist.index).strftime('%Y-%m-%d'))
+        bars[ticker] = ticker_hist
+    return bars
+
+
+def synthetic_download_batch(tickers, start_date, end_date):
+    """Deterministic offline stand-in for download_history_batch, for tests and benchmarks."""
+    dates = pd.bdate_range(start_date, pd.Timestamp(end_date) - pd.Timedelta(days=1))
+    bars = {}
+    for ticker in tickers:
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        # Prices depend only on the calendar date, so overlapping windows agree
+        days = (dates - pd.Timestamp('2000-01-01')).days.to_numpy()
+        close = 100 * np.exp(0.0003 * days + 0.1 * np.sin(days / (20 + rng.integers(20))))
+        bars[ticker] = pd.DataFrame({
+            'Open': close * 0.995, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+            'Adj Close': close, 'Volume': rng.integers(1_000_000, 5_000_000, len(dates)),
+        }, index=dates)
+    return bars
+
+
+class NetworkCallCounter:
+    def __init__(self):
+        self.count = 0
+
+
+_network_counter = contextvars.ContextVar('network_counter', default=None)
+
+
+def track_network_calls():
+    """Start counting downloader round trips in the current context (e.g. one page render)."""
+    counter = NetworkCallCounter()
+    _network_counter.set(counter)
+    return counter
+
+
+def _record_network_call():
+    counter = _network_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
+def _missing_ranges(c, tickers, start_date, end_date):
+    # Bars are final only through the last closed session; later dates are re-fetched after the next close
+    final_until = _to_date_str(pd.Timestamp(last_closed_session_date()) + pd.Timedelta(days=1))
+    covered_until = min(end_date, final_until)
+    placeholders = ','.join(['?'] * len(tickers))
+    c.execute(f'SELECT ticker, first_date, last_date FROM bar_coverage WHERE ticker IN ({placeholders})',
+              list(tickers))
+    coverage = {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+    missing = {}
+    for ticker in tickers:
+        if ticker not in coverage:
+            if start_date < end_date:
+                missing[ticker] = [(start_date, end_date)]
+            continue
+        first_date, last_date = coverage[ticker]
+        ranges = []
+        if start_date < first_date:
+            ranges.append((start_date, first_date))
+        if covered_until > last_date:
+            ranges.append((last_date, end_date))
+        if ranges:
+            missing[ticker] = ranges
+    return missing, coverage, covered_until
+
+
+def store_bars(c, ticker, bars):
+    bars = bars.dropna(subset=['Close'])
+    volume = bars['Volume'].astype(object).where(bars['Volume'].notna(), None)
+    rows = zip([ticker] * len(bars), bars.index.strftime('%Y-%m-%d'),
+               bars['Open'].tolist(), bars['High'].tolist(), bars['Low'].tolist(), bars['Close'].tolist(),
+               bars['Adj Close'].tolist(), [None if v is None else int(v) for v in volume])
+    c.executemany('''
+        INSERT OR REPLACE INTO daily_bars (ticker, date, open, high, low, close, adj_close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def _update_coverage(c, ticker, coverage, start_date, covered_until):
+    if ticker in coverage:
+        first_date, last_date = coverage[ticker]
+        start_date, covered_until = min(first_date, start_date), max(last_date, covered_until)
+    if start_date < covered_until:
+        c.execute('''
+            INSERT OR REPLACE INTO bar_coverage (ticker, first_date, last_date) VALUES (?, ?, ?)
+        ''', (ticker, start_date, covered_until))
+
+
+@timed('ensure_bars')
+def ensure_bars(tickers, start_date, end_date, downloader=download_history_batch, revalidate_tail=True):
+    """Backfill the local bar store so every ticker covers [start_date, end_date).
+
+    Tickers sharing the same uncovered range are fetched together in one downloader call. With
+    revalidate_tail, tickers that only lack the sessions closed since their last fetch keep serving
+    the stored bars while the tail is refreshed in the background.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return
+    start_date, end_date = _to_date_str(start_date), _to_date_str(end_date)
+    conn = get_connection(BARS_DB)
+    c = conn.cursor()
+    missing, coverage, covered_until = _missing_ranges(c, tickers, start_date, end_date)
+
+    if revalidate_tail:
+        stale_tails = [ticker for ticker, ranges in missing.items()
+                       if ticker in coverage and coverage[ticker][0] <= start_date < coverage[ticker][1]
+                       and ranges == [(coverage[ticker][1], end_date)]]
+        if stale_tails:
+            revalidate(('bars', tuple(stale_tails), end_date), ensure_bars, stale_tails, start_date, end_date,
+                       downloader, revalidate_tail=False)
+            for ticker in stale_tails:
+                del missing[ticker]
+
+    tickers_by_range = {}
+    for ticker, ranges in missing.items():
+        for date_range in ranges:
+            tickers_by_range.setdefault(date_range, []).append(ticker)
+
+    # Distinct ranges download concurrently; results are written here, on the calling thread
+    failed = set()
+    executor = get_fetch_executor()
+    futures = {}
+    for (range_start, range_end), range_tickers in tickers_by_range.items():
+        _record_network_call()
+        futures[executor.submit('yfinance', downloader, range_tickers, range_start, range_end)] = range_tickers
+    for future in as_completed(futures):
+        range_tickers = futures[future]
+        if future.exception() is not None:
+            print(f"Error fetching bars for {', '.join(range_tickers)}: {future.exception()}")
+            failed.update(range_tickers)
+            continue
+        bars = future.result()
+        for ticker in range_tickers:
+            if ticker in bars:
+                store_bars(c, ticker, bars[ticker])
+        conn.commit()
+
+    for ticker in missing:
+        if ticker not in failed:
+            _update_coverage(c, ticker, coverage, start_date, covered_until)
+    conn.commit()
+
+
+@timed('db.load_bars')
+def load_bars(ticker, start_date, end_date):
+    """Return stored OHLCV bars for one ticker in [start_date, end_date)."""
+    conn = get_connection(BARS_DB)
+    df = pd.read_sql('''
+        SELECT date, open, high, low, close, adj_close, volume FROM daily_bars
+        WHERE ticker = ? AND date >= ? AND date < ?
+        ORDER BY date
+    ''', conn, params=(ticker, _to_date_str(start_date), _to_date_str(end_date)))
+    df.columns = ['Date'] + BAR_COLUMNS
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df.set_index('Date')
+
+
+@timed('db.load_closes')
+def load_closes(tickers, start_date, end_date, column='adj_close'):
+    """Return a date-by-ticker frame of stored closes in [start_date, end_date)."""
+    tickers = list(tickers)
+    placeholders = ','.join(['?'] * len(tickers))
+    conn = get_connection(BARS_DB)
+    df = pd.read_sql(f'''
+        SELECT ticker, date, {column} AS price FROM daily_bars
+        WHERE ticker IN ({placeholders}) AND date >= ? AND date < ?
+    ''', conn, params=tickers + [_to_date_str(start_date), _to_date_str(end_date)])
+    closes = df.pivot(index='date', columns='ticker', values='price')
+    closes.index = pd.to_datetime(closes.index).rename('Date')
+    closes.columns.name = None
+    return closes.sort_index().reindex(columns=tickers)
+
+
+def period_returns(tickers, start_date, end_date):
+    """Percent change from the first to the last stored close of each ticker in the window."""
+    closes = load_closes(tickers, start_date, end_date)
+    data = {}
+    for ticker in closes.columns:
+        prices = closes[ticker].dropna()
+        if not prices.empty:
+            start_price = prices.iloc[0]
+            end_price = prices.iloc[-1]
+            data[ticker] = ((end_price - start_price) / start_price) * 100
+    return data
+
+
+@timed('db.load_period_matrix')
+def load_period_matrix(tickers, periods, labels):
+    """Load cached percent changes for a tickers x periods grid in one query.
+
+    Returns the ticker-by-period matrix and a boolean mask of the cells missing from the cache.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    period_values = ','.join(['(?, ?)'] * len(periods))
+    placeholders = ','.join(['?'] * len(tickers))
+    conn = get_connection(BARS_DB)
+    cached = pd.read_sql(f'''
+        WITH periods (start_date, end_date) AS (VALUES {period_values})
+        SELECT s.company, s.start_date, s.end_date, s.percent_change
+        FROM periods p
+        JOIN stocks s ON s.start_date = p.start_date AND s.end_date = p.end_date
+        WHERE s.company IN ({placeholders})
+    ''', conn, params=[d for period in periods for d in period] + tickers)
+
+    period_index = pd.MultiIndex.from_tuples(periods, names=['start_date', 'end_date'])
+    matrix = (cached.drop_duplicates(['company', 'start_date', 'end_date'], keep='last')
+              .set_index(['company', 'start_date', 'end_date'])['percent_change']
+              .unstack(['start_date', 'end_date']))
+    matrix = matrix.reindex(index=tickers, columns=period_index).astype(float)
+    matrix.index.name = 'Company'
+    matrix.columns = labels
+    missing = matrix.isna()
+    # Returns of a period that has not closed yet are recomputed from the bars on every render
+    for position, (_, end_date) in enumerate(periods):
+        if not period_is_closed(end_date):
+            missing.iloc[:, position] = True
+    missing_cells = int(missing.to_numpy().sum())
+    record_cache('period_matrix', 'hit', missing.size - missing_cells)
+    record_cache('period_matrix', 'miss', missing_cells)
+    return matrix, missing
+
+
+def fill_period_matrix(matrix, missing, periods):
+    """Compute the masked cells from stored bars, backfilling the union window once, and cache them."""
+    missing_tickers = missing.index[missing.any(axis=1)].tolist()
+    if not missing_tickers:
+        return matrix
+    union_start = min(start for start, _ in periods)
+    union_end = max(end for _, end in periods)
+    ensure_bars(missing_tickers, union_start, union_end)
+    closes = load_closes(missing_tickers, union_start, union_end)
+
+    matrix = matrix.copy()
+    new_rows = []
+    for position, (start_date, end_date) in enumerate(periods):
+        column_missing = missing.iloc[:, position]
+        tickers = column_missing.index[column_missing].tolist()
+        if not tickers:
+            continue
+        window = closes.loc[(closes.index >= start_date) & (closes.index < end_date), tickers]
+        # First and last valid close of every ticker in the window, without a per-ticker loop
+        start_prices = window.bfill().iloc[0] if not window.empty else pd.Series(float('nan'), index=tickers)
+        end_prices = window.ffill().iloc[-1] if not window.empty else pd.Series(float('nan'), index=tickers)
+        changes = (end_prices - start_prices) / start_prices * 100
+        matrix.iloc[matrix.index.get_indexer(tickers), position] = changes.values
+        if period_is_closed(end_date):
+            new_rows.extend((ticker, start_date, end_date, change)
+                            for ticker, change in changes.dropna().items() if change != 0)
+
+    with transaction(BARS_DB) as conn:
+        conn.executemany('''
+            INSERT INTO stocks (company, start_date, end_date, percent_change) VALUES (?, ?, ?, ?)
+            ON CONFLICT (start_date, end_date, company) DO UPDATE SET percent_change = excluded.percent_change
+        ''', new_rows)
+    return matrix
@@ -0,0 +1,161 @@
+# Pre-warms the local caches after every market close. Started in-process by the app, or run once with
+#   python refresher.py [--workers N] [--force] [TICKER ...]
+import os
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from db import ALL_STOCK_DB, PORTFOLIO_DB, get_connection, transaction, run_migrations
+from freshness import is_fresh, last_closed_session_date, next_session_close, utc_now
+from price_store import ensure_bars, load_period_matrix, fill_period_matrix
+from statements import STATEMENT_SOURCES, missing_statements, stale_statements, refresh_statements
+from stock_info import load_stock_info, refresh_stock_info
+
+SOXX_STOCKS = ['AVGO', 'NVDA', 'AMD', 'AMAT', 'QCOM', 'LRCX', 'TSM', 'KLAC', 'INTC', 'MRVL', 'MU', 'MPWR',
+               'TXN', 'ASML', 'NXPI', 'ADI', 'MCHP', 'ON', 'TER', 'ENTG', 'SWKS', 'QRVO', 'STM', 'MKSI',
+               'ASX',
+               'LSCC', 'RMBS', 'UMC', 'ACLS', 'WOLF', '8035.T']
+
+# Tickers refreshed at once; downloads are additionally throttled by the fetch executor's rate limits
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 4))
+# Years of daily bars kept warm, matching the longest range the Quarterly/Yearly selectors offer
+REFRESH_YEARS = 10
+
+
+def refresh_universe():
+    """SOXX components, every saved stock list and every portfolio ticker, without duplicates."""
+    tickers = list(SOXX_STOCKS)
+    for (saved,) in get_connection(ALL_STOCK_DB).execute('SELECT tickers FROM stock_lists').fetchall():
+        tickers.extend(ticker.strip() for ticker in (saved or '').split(','))
+    tickers.extend(row[0] for row in get_connection(PORTFOLIO_DB).execute('SELECT DISTINCT ticker FROM stocks'))
+    return [ticker for ticker in dict.fromkeys(tickers) if ticker]
+
+
+def _bar_window():
+    end = datetime.strptime(last_closed_session_date(), '%Y-%m-%d')
+    start = datetime(end.year - REFRESH_YEARS + 1, 1, 1)
+    return start.strftime('%Y-%m-%d'), f'{end.year}-12-31'
+
+
+def _default_periods():
+    # Every calendar year and quarter in the bar window, as the Quarterly and Yearly pages request them
+    start_date, end_date = _bar_window()
+    periods, labels = [], []
+    for year in range(int(start_date[:4]), int(end_date[:4]) + 1):
+        periods.append((f'{year}-01-01', f'{year}-12-31'))
+        labels.append(str(year))
+        for quarter, (first, last) in enumerate([('01-01', '03-31'), ('04-01', '06-30'),
+                                                 ('07-01', '09-30'), ('10-01', '12-31')], start=1):
+            periods.append((f'{year}-{first}', f'{year}-{last}'))
+            labels.append(f'Q{quarter} {year}')
+    return periods, labels
+
+
+def refresh_ticker(ticker):
+    """Bring one ticker's bars, stock info and statements up to date, returning seconds spent on each."""
+    timings = {}
+    start_date, end_date = _bar_window()
+
+    started = time.perf_counter()
+    ensure_bars([ticker], start_date, end_date, revalidate_tail=False)
+    timings['bars_seconds'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    row = load_stock_info(ticker)
+    if row is None or not is_fresh('quote', row[-1]):
+        refresh_stock_info(ticker)
+    timings['info_seconds'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    statements = list(STATEMENT_SOURCES)
+    if missing_statements([ticker], statements) or stale_statements([ticker], statements):
+        refresh_statements(ticker, statements)
+    timings['statements_seconds'] = time.perf_counter() - started
+    return timings
+
+
+def _finished_tickers(session_date):
+    rows = get_connection(ALL_STOCK_DB).execute(
+        "SELECT ticker FROM refresh_log WHERE session_date = ? AND status = 'ok'", (session_date,)).fetchall()
+    return {row[0] for row in rows}
+
+
+def _log_result(session_date, ticker, status, timings, error=None):
+    with transaction(ALL_STOCK_DB) as conn:
+        conn.execute('''
+            INSERT INTO refresh_log (session_date, ticker, status, bars_seconds, info_seconds, statements_seconds,
+                                     error, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (session_date, ticker) DO UPDATE SET
+                status = excluded.status, bars_seconds = excluded.bars_seconds,
+                info_seconds = excluded.info_seconds, statements_seconds = excluded.statements_seconds,
+                error = excluded.error, finished_at = excluded.finished_at
+        ''', (session_date, ticker, status, timings.get('bars_seconds'), timings.get('info_seconds'),
+              timings.get('statements_seconds'), error))
+
+
+def run_refresh(tickers=None, workers=REFRESH_WORKERS, force=False):
+    """Refresh every ticker not yet done for the last closed session and return per-ticker timings.
+
+    Progress is logged per ticker, so an interrupted run resumes where it stopped.
+    """
+    session_date = last_closed_session_date()
+    tickers = tickers or refresh_universe()
+    done = set() if force else _finished_tickers(session_date)
+    pending = [ticker for ticker in tickers if ticker not in done]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresher') as pool:
+        futures = {pool.submit(refresh_ticker, ticker): ticker for ticker in pending}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                timings, status, error = future.result(), 'ok', None
+            except Exception as e:
+                timings, status, error = {}, 'error', str(e)
+                print(f"Error refreshing {ticker}: {error}")
+            _log_result(session_date, ticker, status, timings, error)
+            results.append({'ticker': ticker, 'status': status, **timings})
+
+    # Closed-period returns for the whole universe are computed from the warm bars in one pass
+    periods, labels = _default_periods()
+    matrix, missing = load_period_matrix(tickers, periods, labels)
+    if missing.values.any():
+        fill_period_matrix(matrix, missing, periods)
+    return pd.DataFrame(results, columns=['ticker', 'status', 'bars_seconds', 'info_seconds', 'statements_seconds'])
+
+
+def _refresh_loop(workers):
+    while True:
+        try:
+            run_refresh(workers=workers)
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+        # Sleep until the next session has closed and its bars are final
+        time.sleep(max((next_session_close() - utc_now()).total_seconds(), 60))
+
+
+def start_refresher(workers=REFRESH_WORKERS):
+    """Start the daemon thread that refreshes the universe now and after every market close."""
+    thread = threading.Thread(target=_refresh_loop, args=(workers,), name='refresher', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-warm price, stock info and statement caches.')
+    parser.add_argument('tickers', nargs='*', help='tickers to refresh (default: SOXX, stock lists and portfolios)')
+    parser.add_argument('--workers', type=int, default=REFRESH_WORKERS, help='tickers refreshed concurrently')
+    parser.add_argument('--force', action='store_true', help='refresh tickers already done for this session')
+    args = parser.parse_args()
+
+    run_migrations()
+    started = time.perf_counter()
+    report = run_refresh(args.tickers, workers=args.workers, force=args.force)
+    if report.empty:
+        print('Everything is already up to date for this session.')
+    else:
+        print(report.sort_values('ticker').to_string(index=False, float_format='{:.2f}'.format))
+    print(f'Refreshed {len(report)} tickers in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,128 @@
+import pandas as pd
+from db import FINANCIAL_STATEMENTS_DB, get_connection, transaction
+from freshness import is_fresh, revalidate, utc_now
+
+# yfinance attribute for every (statement, frequency) pair kept in statement_items
+STATEMENT_SOURCES = {
+    ('income', 'annual'): 'financials',
+    ('income', 'quarterly'): 'quarterly_financials',
+    ('balance_sheet', 'annual'): 'balance_sheet',
+    ('balance_sheet', 'quarterly'): 'quarterly_balance_sheet',
+    ('cashflow', 'annual'): 'cashflow',
+    ('cashflow', 'quarterly'): 'quarterly_cashflow',
+}
+
+
+def statement_rows(ticker, statement, frequency, df):
+    """Flatten a yfinance statement (line items x period ends) into statement_items rows."""
+    rows = []
+    for position, (line_item, values) in enumerate(df.iterrows()):
+        for period_end, value in values.items():
+            if pd.notna(value):
+                rows.append((ticker, statement, frequency, str(line_item), pd.Timestamp(period_end).strftime('%Y-%m-%d'),
+                             float(value), position))
+    return rows
+
+
+def store_statement(ticker, statement, frequency, df):
+    """Upsert a statement; periods already stored are updated and new fiscal periods appended.
+
+    The statement_fetches row is written even when df is empty, marking a ticker without filings as fetched.
+    """
+    with transaction(FINANCIAL_STATEMENTS_DB) as conn:
+        conn.executemany('''
+            INSERT INTO statement_items (ticker, statement, frequency, line_item, period_end, value, position)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (ticker, statement, frequency, line_item, period_end)
+            DO UPDATE SET value = excluded.value, position = excluded.position
+        ''', statement_rows(ticker, statement, frequency, df))
+        conn.execute('''
+            INSERT INTO statement_fetches (ticker, statement, frequency, fetched_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (ticker, statement, frequency) DO UPDATE SET fetched_at = excluded.fetched_at
+        ''', (ticker, statement, frequency, utc_now().replace(tzinfo=None).isoformat(sep=' ')))
+
+
+def _pivot(items):
+    # Back to the yfinance layout: line items in statement order, newest period first
+    order = items.groupby('line_item')['position'].min().sort_values().index
+    df = items.pivot(index='line_item', columns='period_end', values='value').reindex(order)
+    df.columns = pd.to_datetime(df.columns)
+    df.index.name = None
+    df.columns.name = None
+    return df[sorted(df.columns, reverse=True)]
+
+
+def load_statement(ticker, statement, frequency):
+    """Return a stored statement as line items x period ends, or None if it was never fetched.
+
+    A statement fetched without any line items comes back as an empty frame, so it is not fetched again.
+    """
+    conn = get_connection(FINANCIAL_STATEMENTS_DB)
+    fetched = conn.execute('''
+        SELECT 1 FROM statement_fetches WHERE ticker = ? AND statement = ? AND frequency = ?
+    ''', (ticker, statement, frequency)).fetchone()
+    if fetched is None:
+        return None
+    items = pd.read_sql('''
+        SELECT line_item, period_end, value, position FROM statement_items
+        WHERE ticker = ? AND statement = ? AND frequency = ?
+    ''', conn, params=(ticker, statement, frequency))
+    if items.empty:
+        return pd.DataFrame()
+    return _pivot(items)
+
+
+def load_line_items(tickers, statement, frequency, line_items):
+    """Read only the requested line items for many tickers in one query, as {ticker: statement frame}."""
+    tickers = list(tickers)
+    ticker_placeholders = ','.join(['?'] * len(tickers))
+    item_placeholders = ','.join(['?'] * len(line_items))
+    items = pd.read_sql(f'''
+        SELECT ticker, line_item, period_end, value, position FROM statement_items
+        WHERE ticker IN ({ticker_placeholders}) AND statement = ? AND frequency = ?
+          AND line_item IN ({item_placeholders})
+    ''', get_connection(FINANCIAL_STATEMENTS_DB), params=tickers + [statement, frequency] + list(line_items))
+    return {ticker: _pivot(ticker_items) for ticker, ticker_items in items.groupby('ticker')}
+
+
+def missing_statements(tickers, statements):
+    """Return the tickers that have never fetched one of the (statement, frequency) pairs."""
+    fetched = pd.read_sql('SELECT ticker, statement, frequency FROM statement_fetches',
+                          get_connection(FINANCIAL_STATEMENTS_DB))
+    fetched = set(fetched.itertuples(index=False, name=None))
+    return [ticker for ticker in tickers
+            if any((ticker, statement, frequency) not in fetched for statement, frequency in statements)]
+
+
+def stale_statements(tickers, statements):
+    """Return the tickers with a stored (statement, frequency) pair older than the fundamentals TTL."""
+    fetched = pd.read_sql('SELECT ticker, statement, frequency, fetched_at FROM statement_fetches',
+                          get_connection(FINANCIAL_STATEMENTS_DB))
+    fetched_at = {(ticker, statement, frequency): at for ticker, statement, frequency, at
+                  in fetched.itertuples(index=False, name=None)}
+    return [ticker for ticker in tickers
+            if any((ticker, statement, frequency) in fetched_at
+                   and not is_fresh('fundamentals', fetched_at[(ticker, statement, frequency)])
+                   for statement, frequency in statements)]
+
+
+def refresh_statements(ticker, statements):
+    store_statements(ticker, fetch_statements(ticker, statements))
+
+
+def revalidate_statements(tickers, statements):
+    """Keep serving stored statements while stale ones are re-downloaded in the background."""
+    for ticker in stale_statements(tickers, statements):
+        revalidate(('statements', ticker, tuple(statements)), refresh_statements, ticker, statements)
+
+
+def fetch_statements(ticker, statements):
+    """Download the requested statements for one ticker from yfinance."""
+    import yfinance as yf
+    stock = yf.Ticker(ticker)
+    return {key: getattr(stock, STATEMENT_SOURCES[key]) for key in statements}
+
+
+def store_statements(ticker, frames):
+    for (statement, frequency), df in frames.items():
+        store_statement(ticker, statement, frequency, df)
@@ -0,0 +1,53 @@
+from db import STOCK_PRICE_DB, get_connection, transaction
+from freshness import is_fresh, revalidate
+
+# stock_info columns filled from yfinance's Ticker.info, in table order after the ticker
+INFO_FIELDS = ['longName', 'country', 'sector', 'industry', 'marketCap', 'enterpriseValue', 'fullTimeEmployees',
+               'currentPrice', 'previousClose', 'dayHigh', 'dayLow', 'fiftyTwoWeekHigh', 'fiftyTwoWeekLow',
+               'forwardEps', 'forwardPE', 'pegRatio', 'dividendRate', 'dividendYield', 'recommendationKey']
+
+
+def load_stock_info(ticker):
+    c = get_connection(STOCK_PRICE_DB).cursor()
+    c.execute('SELECT * FROM stock_info WHERE ticker = ?', (ticker,))
+    return c.fetchone()
+
+
+def store_stock_info(data):
+    with transaction(STOCK_PRICE_DB) as conn:
+        conn.execute('''
+        INSERT INTO stock_info (ticker, name, country, sector, industry, market_cap, enterprise_value, employees, 
+                                current_price, prev_close, day_high, day_low, ft_week_high, ft_week_low, 
+                                forward_eps, forward_pe, peg_ratio, dividend_rate, dividend_yield, recommendation)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ticker) DO UPDATE SET
+            name = excluded.name, country = excluded.country, sector = excluded.sector,
+            industry = excluded.industry, market_cap = excluded.market_cap,
+            enterprise_value = excluded.enterprise_value, employees = excluded.employees,
+            current_price = excluded.current_price, prev_close = excluded.prev_close,
+            day_high = excluded.day_high, day_low = excluded.day_low, ft_week_high = excluded.ft_week_high,
+            ft_week_low = excluded.ft_week_low, forward_eps = excluded.forward_eps,
+            forward_pe = excluded.forward_pe, peg_ratio = excluded.peg_ratio,
+            dividend_rate = excluded.dividend_rate, dividend_yield = excluded.dividend_yield,
+            recommendation = excluded.recommendation, date = CURRENT_TIMESTAMP
+        ''', data)
+
+
+def refresh_stock_info(ticker):
+    """Download Ticker.info, store it and return the stored row."""
+    import yfinance as yf
+    info = yf.Ticker(ticker).info
+    store_stock_info((ticker, *(info.get(field, 'N/A') for field in INFO_FIELDS)))
+    return load_stock_info(ticker)
+
+
+def get_stock_info(ticker):
+    """Return (row, stale). A stale row is still returned while a refresh runs in the background."""
+    row = load_stock_info(ticker)
+    if row is None:
+        return refresh_stock_info(ticker), False
+    # The last column is the row's UTC write time
+    if is_fresh('quote', row[-1]):
+        return row, False
+    revalidate(('stock_info', ticker), refresh_stock_info, ticker)
+    return row, True
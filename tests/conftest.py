@@ -0,0 +1,41 @@
+import os
+import sys
+import types
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_store
+from db import ALL_STOCK_DB, MIGRATIONS, migrate
+
+
+class FakeYFinance(types.ModuleType):
+    """Stands in for yfinance; records every download call and omits tickers in `unknown`."""
+
+    def __init__(self, unknown=()):
+        super().__init__('yfinance')
+        self.calls = []
+        self.unknown = set(unknown)
+
+    def download(self, tickers, start, end, group_by, **kwargs):
+        self.calls.append((tuple(tickers), start, end))
+        bars = price_store.synthetic_download_batch([t for t in tickers if t not in self.unknown], start, end)
+        if not bars:
+            return pd.DataFrame()
+        return pd.concat(bars, axis=1)
+
+
+@pytest.fixture
+def bars_db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bars.db')
+    migrate(path, MIGRATIONS[ALL_STOCK_DB])
+    monkeypatch.setattr(price_store, 'BARS_DB', path)
+    return path
+
+
+@pytest.fixture
+def fake_yfinance(monkeypatch):
+    fake = FakeYFinance()
+    monkeypatch.setitem(sys.modules, 'yfinance', fake)
+    return fake
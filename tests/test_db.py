@@ -0,0 +1,21 @@
+import sqlite3
+import threading
+import pytest
+import db
+
+
+def test_connections_of_finished_threads_are_closed(tmp_path):
+    pool = db.ConnectionPool()
+    path = str(tmp_path / 'pool.db')
+    opened = []
+    worker = threading.Thread(target=lambda: opened.append(pool.connection(path)))
+    worker.start()
+    worker.join()
+
+    conn = pool.connection(path)
+    assert conn is pool.connection(path)
+    assert conn is not opened[0]
+    # The worker's connection was closed when this thread checked out its own
+    assert list(pool.connections) == [(threading.current_thread(), path)]
+    with pytest.raises(sqlite3.ProgrammingError, match='closed'):
+        opened[0].execute('SELECT 1')
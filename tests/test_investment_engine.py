@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+import investment_engine
+from investment_engine import compound_balance, mean_annual_return, simulate_balances
+
+
+@pytest.mark.parametrize('sessions', [0, 5, 25])
+def test_short_history_falls_back_to_compounding(sessions):
+    daily_returns = np.full(sessions, 0.001)
+    with pytest.warns(RuntimeWarning):
+        balances = simulate_balances(daily_returns, 1000, 3, 100, paths=50, seed=0)
+    expected = compound_balance(1000, mean_annual_return(daily_returns), np.arange(4), 100)
+    assert balances.shape == (50, 4)
+    np.testing.assert_allclose(balances, np.tile(expected, (50, 1)))
+
+
+@pytest.mark.parametrize('method', investment_engine.SIMULATION_METHODS)
+def test_enough_history_is_sampled(method, recwarn):
+    daily_returns = np.random.default_rng(0).normal(0.0005, 0.01, 300)
+    balances = simulate_balances(daily_returns, 1000, 3, 100, paths=200, method=method, seed=0)
+    assert not [w for w in recwarn if issubclass(w.category, RuntimeWarning)]
+    assert balances[:, 0].tolist() == [1000] * 200
+    assert balances[:, -1].std() > 0
@@ -0,0 +1,73 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import model_registry
+from forecasting import LOOKBACK, create_model, load_price_frame, prepare_data, forecast_path
+from model_export import PARITY_TOLERANCE, LiteModel, export_model
+
+TICKER = 'AAA'
+START, END = '2020-01-01', '2022-01-01'
+
+
+@pytest.fixture(scope='module')
+def registered(tmp_path_factory):
+    # One briefly trained model shared by every test; parity does not depend on how good it is
+    patch = pytest.MonkeyPatch()
+    patch.setattr(model_registry, 'MODEL_DIR', str(tmp_path_factory.mktemp('models')))
+    yield patch
+    patch.undo()
+
+
+@pytest.fixture
+def model_metadata(registered, bars_db, fake_yfinance):
+    df = load_price_frame(TICKER, START, END)
+    x_train, y_train, x_test, y_test, scaler = prepare_data(df)
+    if not model_registry.list_versions(TICKER):
+        model = create_model((x_train.shape[1], 1))
+        model.fit(x_train, y_train, epochs=1, batch_size=64, verbose=0)
+        model_registry.register_model(TICKER, model, scaler, START, END, LOOKBACK, df['Close'], 1, {})
+    model, metadata = model_registry.load_model(TICKER, prefer_export=False)
+    return model, metadata, x_test
+
+
+@pytest.mark.parametrize('quantization', ['float32', 'float16', 'int8'])
+def test_export_matches_keras(model_metadata, quantization):
+    model, metadata, x_test = model_metadata
+    export = export_model(TICKER, metadata['version'], quantization)
+    assert export['passed'], export
+
+    lite = LiteModel(model_registry.export_path(TICKER, metadata['version'], quantization))
+    tolerance = PARITY_TOLERANCE[quantization]
+    expected = model.predict(x_test, verbose=0).ravel()
+    np.testing.assert_allclose(lite.predict(x_test).ravel(), expected, atol=tolerance)
+    # The TFLite ring-buffer loop follows the compiled Keras forecast step for step
+    np.testing.assert_allclose(lite.forecast(x_test[-1], 10), forecast_path(model, x_test[-1], 10),
+                               atol=2 * tolerance)
+    assert model_registry.load_model(TICKER)[0].__class__ is LiteModel
+
+
+# Loads an export and predicts in a fresh interpreter, then reports whether TensorFlow got imported
+NO_TENSORFLOW = """
+import sys
+import numpy as np
+from model_export import LiteModel
+model = LiteModel(sys.argv[1])
+model.predict(np.zeros((2, *model.input_shape[1:]), dtype=np.float32))
+print('tensorflow' in sys.modules)
+"""
+
+
+def test_lite_model_does_not_import_tensorflow(model_metadata):
+    pytest.importorskip('ai_edge_litert')
+    _, metadata, _ = model_metadata
+    export_model(TICKER, metadata['version'], 'float16')
+    path = model_registry.export_path(TICKER, metadata['version'], 'float16')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', NO_TENSORFLOW, os.path.abspath(path)], cwd=root,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False', result.stderr
@@ -0,0 +1,42 @@
+import price_store
+
+
+def test_one_grouped_download_per_date_range(bars_db, fake_yfinance):
+    price_store.ensure_bars(['AAA', 'BBB'], '2023-01-02', '2023-02-01', revalidate_tail=False)
+    assert fake_yfinance.calls == [(('AAA', 'BBB'), '2023-01-02', '2023-02-01')]
+
+    # AAA and BBB only miss the earlier range; CCC misses the whole window
+    fake_yfinance.calls.clear()
+    price_store.ensure_bars(['AAA', 'BBB', 'CCC'], '2022-12-01', '2023-02-01', revalidate_tail=False)
+    assert sorted(fake_yfinance.calls) == [(('AAA', 'BBB'), '2022-12-01', '2023-01-02'),
+                                           (('CCC',), '2022-12-01', '2023-02-01')]
+
+    closes = price_store.load_closes(['AAA', 'BBB', 'CCC'], '2022-12-01', '2023-02-01')
+    assert closes.notna().all().all()
+
+    # Fully covered tickers are served from the store
+    fake_yfinance.calls.clear()
+    price_store.ensure_bars(['AAA', 'BBB', 'CCC'], '2022-12-15', '2023-01-20', revalidate_tail=False)
+    assert fake_yfinance.calls == []
+
+
+def test_missing_tickers_are_skipped(bars_db, fake_yfinance):
+    fake_yfinance.unknown.add('GONE')
+    price_store.ensure_bars(['AAA', 'GONE'], '2023-01-02', '2023-02-01', revalidate_tail=False)
+    assert len(fake_yfinance.calls) == 1
+
+    closes = price_store.load_closes(['AAA', 'GONE'], '2023-01-02', '2023-02-01')
+    assert closes['AAA'].notna().all()
+    assert closes['GONE'].isna().all()
+    # An unknown ticker is not retried on every render
+    price_store.ensure_bars(['AAA', 'GONE'], '2023-01-02', '2023-02-01', revalidate_tail=False)
+    assert len(fake_yfinance.calls) == 1
+
+
+def test_single_ticker_download_without_ticker_level(fake_yfinance):
+    # yfinance may return flat columns for a single ticker
+    fake_yfinance.download = lambda tickers, start, end, **kwargs: price_store.synthetic_download_batch(
+        tickers, start, end)[tickers[0]]
+    bars = price_store.download_history_batch(['AAA'], '2023-01-02', '2023-01-10')
+    assert list(bars) == ['AAA']
+    assert list(bars['AAA'].columns) == price_store.BAR_COLUMNS
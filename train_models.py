@@ -0,0 +1,110 @@
+# Train, evaluate and register LSTM models for many tickers in parallel, e.g.
+#   python train_models.py --workers 4 --epochs 5            (SOXX, saved stock lists and portfolios)
+#   python train_models.py AAPL MSFT --years 10
+#   python train_models.py --fine-tune                        (daily: only the bars since each model's last_bar)
+# Tickers that already have a model for the window are skipped, so re-running resumes after failures.
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import as_completed
+import pandas as pd
+from db import run_migrations
+from forecasting import LOOKBACK, load_price_frame
+from model_registry import load_metadata, stale_reason, can_fine_tune
+from refresher import refresh_universe
+from training_queue import (TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS, FINE_TUNE_EPOCHS, create_job,
+                            create_training_pool, train_job)
+
+
+def pending_tickers(tickers, start_date, end_date, fine_tune=False):
+    """Map tickers without a registered model that fits the window (the page's check) to a job kind.
+
+    With fine_tune, every model with closed sessions after its last_bar is fine-tuned on them, even one the
+    page would still reuse; models that cannot be fine-tuned and no longer fit the window are retrained.
+    """
+    pending = {}
+    for ticker in tickers:
+        try:
+            closes = load_price_frame(ticker, start_date, end_date)['Close']
+        except Exception as e:
+            print(f"Error loading prices for {ticker}: {e}")
+            continue
+        metadata = load_metadata(ticker)
+        if fine_tune and can_fine_tune(metadata, start_date, end_date, LOOKBACK):
+            pending[ticker] = 'fine_tune'
+        elif stale_reason(metadata, start_date, end_date, LOOKBACK, closes) is not None:
+            pending[ticker] = 'train'
+    return pending
+
+
+def train_all(jobs, start_date, end_date, epochs, workers, intra_op_threads=TF_INTRA_OP_THREADS,
+              inter_op_threads=TF_INTER_OP_THREADS, fine_tune_epochs=FINE_TUNE_EPOCHS):
+    """Run {ticker: 'train' | 'fine_tune'} jobs in a process pool and return one result row per ticker."""
+    results = []
+    with create_training_pool(workers, intra_op_threads, inter_op_threads) as pool:
+        futures = {}
+        for ticker, kind in jobs.items():
+            job_epochs = fine_tune_epochs if kind == 'fine_tune' else epochs
+            job_id, inserted = create_job(ticker, start_date, end_date, job_epochs, kind)
+            if not inserted:
+                print(f"Skipping {ticker}: job {job_id} is already active")
+                continue
+            futures[pool.submit(train_job, job_id, ticker, start_date, end_date, job_epochs, kind)] = ticker
+        for done, future in enumerate(as_completed(futures), start=1):
+            ticker = futures[future]
+            try:
+                metadata = future.result()
+                results.append({'ticker': ticker, 'status': 'ok', 'kind': jobs[ticker], 'version': metadata['version'],
+                                'seconds': metadata.get('train_seconds'), **metadata['metrics']})
+            except Exception as e:
+                results.append({'ticker': ticker, 'status': 'failed', 'kind': jobs[ticker], 'error': str(e)})
+            print(f"[{done}/{len(futures)}] {ticker}: {results[-1]['status']}")
+    return pd.DataFrame(results, columns=['ticker', 'status', 'kind', 'version', 'seconds', 'mae', 'mape', 'error'])
+
+
+def summarize(results, elapsed):
+    trained = results[results['status'] == 'ok']
+    results = results.astype({'version': 'Int64'})
+    print(results.drop(columns='error').to_string(index=False, float_format='{:.2f}'.format))
+    print(f"\n{len(trained)} trained, {len(results) - len(trained)} failed in {elapsed / 60:.1f} min "
+          f"({len(trained) / (elapsed / 3600):.1f} tickers/hour)")
+    if not trained.empty:
+        print("\nAccuracy distribution:")
+        print(trained[['mae', 'mape']].describe(percentiles=[0.25, 0.5, 0.75]).to_string(float_format='{:.2f}'.format))
+    failed = results[results['status'] == 'failed']
+    for ticker, error in zip(failed['ticker'], failed['error']):
+        print(f"{ticker} failed: {error}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and register LSTM models for a list of tickers.')
+    parser.add_argument('tickers', nargs='*', help='tickers to train (default: SOXX, stock lists and portfolios)')
+    parser.add_argument('--years', type=int, default=5, help='years of history to train on, ending today')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // TF_INTRA_OP_THREADS),
+                        help='models trained at once')
+    parser.add_argument('--force', action='store_true', help='retrain tickers that already have a fitting model')
+    parser.add_argument('--fine-tune', action='store_true',
+                        help='fine-tune models that only lack the newest bars instead of retraining them')
+    args = parser.parse_args()
+
+    run_migrations()
+    # Same default window as the Stock Prediction page
+    end_date = datetime.now().date()
+    start_date = (datetime.now() - timedelta(days=args.years * 365)).date()
+    tickers = args.tickers or refresh_universe()
+    if args.force:
+        jobs = dict.fromkeys(tickers, 'train')
+    else:
+        jobs = pending_tickers(tickers, str(start_date), str(end_date), fine_tune=args.fine_tune)
+    fine_tunes = sum(kind == 'fine_tune' for kind in jobs.values())
+    print(f"Training {len(jobs) - fine_tunes} and fine-tuning {fine_tunes} tickers on {start_date} to {end_date} "
+          f"with {args.workers} workers")
+
+    started = time.perf_counter()
+    results = train_all(jobs, str(start_date), str(end_date), args.epochs, args.workers)
+    if results.empty:
+        print("Nothing to train.")
+    else:
+        summarize(results, time.perf_counter() - started)
@@ -0,0 +1,257 @@
+import os
+import time
+import socket
+from datetime import datetime, timedelta
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+from db import TRAINING_DB, get_connection, transaction
+from freshness import utc_now
+from model_export import export_model
+
+# Models trained at once, and the TensorFlow threads each training process may use
+TRAINING_WORKERS = int(os.environ.get('TRAINING_WORKERS', 2))
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 2))
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 1))
+# Epochs a fine-tuning job runs over the newly arrived bars
+FINE_TUNE_EPOCHS = 2
+# TFLite export made after every training job; empty to skip exporting
+EXPORT_QUANTIZATION = os.environ.get('EXPORT_QUANTIZATION', 'float16')
+
+
+def _init_worker(intra_op_threads, inter_op_threads):
+    # Must run before TensorFlow creates its thread pools in this process
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def _now():
+    return utc_now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _set_status(job_id, status, **fields):
+    assignments = ''.join(f', {column} = ?' for column in fields)
+    with transaction(TRAINING_DB) as conn:
+        conn.execute(f'UPDATE training_jobs SET status = ?{assignments} WHERE id = ?',
+                     (status, *fields.values(), job_id))
+
+
+def _train(ticker, start_date, end_date, epochs, callbacks):
+    from forecasting import LOOKBACK, load_price_frame, prepare_data, create_model, evaluate_model
+    from model_registry import register_model
+
+    started = time.perf_counter()
+    df = load_price_frame(ticker, start_date, end_date)
+    x_train, y_train, x_test, y_test, scaler = prepare_data(df)
+    model = create_model((x_train.shape[1], 1))
+    model.fit(x_train, y_train, epochs=epochs, batch_size=32, verbose=0, callbacks=callbacks)
+    _, _, metrics = evaluate_model(model, x_test, y_test, scaler)
+    # First and last bar the metrics were scored on; fine-tuned descendants are scored on the same bars
+    holdout = [df['Date'].iloc[-len(y_test)], df['Date'].iloc[-1]]
+    return register_model(ticker, model, scaler, start_date, end_date, LOOKBACK, df['Close'], epochs, metrics,
+                          first_bar=df['Date'].iloc[0], last_bar=df['Date'].iloc[-1], holdout=holdout,
+                          train_seconds=round(time.perf_counter() - started, 1))
+
+
+def _holdout(ticker, metadata):
+    # Models registered before holdouts were recorded were scored on the last 30% of their window
+    if 'holdout' in metadata:
+        return metadata['holdout']
+    from forecasting import TRAIN_FRACTION, load_price_frame
+    dates = load_price_frame(ticker, metadata['train_start'], metadata['train_end'])['Date']
+    return [dates.iloc[int(len(dates) * TRAIN_FRACTION)], dates.iloc[-1]]
+
+
+def _fine_tune(ticker, start_date, end_date, epochs, callbacks):
+    from keras import models
+    from forecasting import load_price_frame, make_windows, scaler_from_params, evaluate_model
+    from model_registry import load_metadata, artifact_path, register_model
+
+    started = time.perf_counter()
+    parent = load_metadata(ticker)
+    lookback = parent['lookback']
+    model = models.load_model(artifact_path(ticker, parent['version']), compile=False)
+    # A fresh optimizer: the one restored from the .h5 file is not bound to the loaded variables
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    # Keep the parent's scaler so the fine-tuned weights see inputs on the scale they were trained on
+    scaler = scaler_from_params(parent['scaler_min'], parent['scaler_scale'])
+    holdout = _holdout(ticker, parent)
+    # From a lookback's worth of sessions (with room for holidays) before the holdout, which a window
+    # that slid forward may no longer cover
+    history_start = min(str(start_date), str(datetime.fromisoformat(holdout[0]).date() - timedelta(days=2 * lookback)))
+    history = load_price_frame(ticker, history_start, end_date)
+    new_bars = int((history['Date'] > parent['last_bar']).sum())
+    if new_bars == 0:
+        return parent
+
+    scaled = scaler.transform(history['Close'].to_numpy(dtype=np.float64).reshape(-1, 1)).astype(np.float32).ravel()
+    # Only windows whose target is a bar after the watermark
+    x_new, y_new = make_windows(scaled[-(new_bars + lookback):], lookback)
+    model.fit(x_new, y_new, epochs=epochs, batch_size=32, verbose=0, callbacks=callbacks)
+    # Scored on the parent's holdout, which no ancestor was fitted on, rather than on the new bars just fitted
+    dates = history['Date'].to_numpy()
+    first, last = np.searchsorted(dates, holdout[0]), np.searchsorted(dates, holdout[1], side='right')
+    x_test, y_test = make_windows(scaled[first - lookback:last], lookback)
+    _, _, metrics = evaluate_model(model, x_test, y_test, scaler)
+
+    window = history[history['Date'] >= str(start_date)]
+    return register_model(ticker, model, scaler, start_date, end_date, lookback, window['Close'], epochs,
+                          metrics, first_bar=window['Date'].iloc[0], last_bar=window['Date'].iloc[-1],
+                          holdout=holdout, train_seconds=round(time.perf_counter() - started, 1),
+                          parent_version=parent['version'], fine_tuned_bars=new_bars)
+
+
+def train_job(job_id, ticker, start_date, end_date, epochs, kind='train'):
+    """Train (or fine-tune) and register one model, recording progress in training_jobs/training_epochs.
+
+    A 'fine_tune' job continues the latest registered model on the bars after its last_bar watermark only,
+    and registers it for the job's (possibly slid) window.
+    """
+    import keras
+
+    class EpochLogger(keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            with transaction(TRAINING_DB) as conn:
+                conn.execute('INSERT OR REPLACE INTO training_epochs (job_id, epoch, loss) VALUES (?, ?, ?)',
+                             (job_id, epoch + 1, float((logs or {}).get('loss', 'nan'))))
+
+    _set_status(job_id, 'running', started_at=_now())
+    try:
+        if kind == 'fine_tune':
+            metadata = _fine_tune(ticker, start_date, end_date, epochs, [EpochLogger()])
+        else:
+            metadata = _train(ticker, start_date, end_date, epochs, [EpochLogger()])
+    except Exception as e:
+        print(f"Training {ticker} failed: {e}")
+        _set_status(job_id, 'failed', error=str(e), finished_at=_now())
+        raise
+    if EXPORT_QUANTIZATION and 'exports' not in metadata:
+        # Pages serve the exported model when it matches Keras; a failed export only costs that speed-up
+        try:
+            export_model(ticker, metadata['version'], EXPORT_QUANTIZATION)
+        except Exception as e:
+            print(f"Exporting {ticker} v{metadata['version']} failed: {e}")
+    _set_status(job_id, 'done', version=metadata['version'], finished_at=_now())
+    return metadata
+
+
+def _owner():
+    return os.getpid(), socket.gethostname()
+
+
+def _owner_alive(pid, host):
+    # Jobs queued before owners were recorded have none
+    if pid is None:
+        return False
+    # Owners on another host cannot be checked from here and are assumed to be alive
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def create_job(ticker, start_date, end_date, epochs, kind='train'):
+    """Insert a queued job owned by this process and return (job_id, True), or (active job id, False) if the
+    ticker has one."""
+    while True:
+        with transaction(TRAINING_DB) as conn:
+            cur = conn.execute('''
+                INSERT INTO training_jobs (ticker, start_date, end_date, epochs, kind, status, owner_pid, owner_host)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)
+                ON CONFLICT DO NOTHING
+            ''', (ticker, str(start_date), str(end_date), epochs, kind, *_owner()))
+            if cur.rowcount == 1:
+                return cur.lastrowid, True
+        job = active_job(ticker)
+        if job is not None:
+            return job['id'], False
+        # The conflicting job finished between the insert and the lookup; the ticker is free again
+
+
+def fail_orphaned_jobs():
+    """Mark queued or running jobs whose owning process has exited as failed, and return their ids.
+
+    Jobs owned by another live process (e.g. train_models.py next to the app) are left alone.
+    """
+    with transaction(TRAINING_DB) as conn:
+        active = conn.execute('''
+            SELECT id, owner_pid, owner_host FROM training_jobs WHERE status IN ('queued', 'running')
+        ''').fetchall()
+        orphaned = [job_id for job_id, pid, host in active if not _owner_alive(pid, host)]
+        conn.executemany('''
+            UPDATE training_jobs SET status = 'failed', error = 'interrupted', finished_at = ?
+            WHERE id = ? AND status IN ('queued', 'running')
+        ''', [(_now(), job_id) for job_id in orphaned])
+    return orphaned
+
+
+def create_training_pool(workers=TRAINING_WORKERS, intra_op_threads=TF_INTRA_OP_THREADS,
+                         inter_op_threads=TF_INTER_OP_THREADS):
+    # spawn, not fork: forking a process that already runs TensorFlow threads can deadlock
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(intra_op_threads, inter_op_threads))
+
+
+class TrainingQueue:
+    """Runs training jobs in a process pool, at most one active job per ticker."""
+
+    def __init__(self, workers=TRAINING_WORKERS, intra_op_threads=TF_INTRA_OP_THREADS,
+                 inter_op_threads=TF_INTER_OP_THREADS):
+        # Jobs left active by a previous server process will never finish
+        fail_orphaned_jobs()
+        self.pool = create_training_pool(workers, intra_op_threads, inter_op_threads)
+
+    def submit(self, ticker, start_date, end_date, epochs, kind='train'):
+        """Queue a training job and return its id; an already active job for the ticker is reused."""
+        job_id, inserted = create_job(ticker, start_date, end_date, epochs, kind)
+        if inserted:
+            future = self.pool.submit(train_job, job_id, ticker, str(start_date), str(end_date), epochs, kind)
+            future.add_done_callback(lambda done: _on_done(job_id, done))
+        return job_id
+
+
+def _on_done(job_id, future):
+    # A worker that died (e.g. out of memory) never got to record the failure itself
+    error = future.exception()
+    if error is not None:
+        with transaction(TRAINING_DB) as conn:
+            conn.execute('''
+                UPDATE training_jobs SET status = 'failed', error = ?, finished_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (str(error), _now(), job_id))
+
+
+@st.cache_resource
+def get_training_queue():
+    return TrainingQueue()
+
+
+def active_job(ticker):
+    """The queued or running job for ticker as a dict, or None."""
+    cur = get_connection(TRAINING_DB).execute('''
+        SELECT * FROM training_jobs WHERE ticker = ? AND status IN ('queued', 'running')
+    ''', (ticker,))
+    row = cur.fetchone()
+    return dict(zip([column[0] for column in cur.description], row)) if row else None
+
+
+def latest_job(ticker):
+    cur = get_connection(TRAINING_DB).execute('''
+        SELECT * FROM training_jobs WHERE ticker = ? ORDER BY id DESC LIMIT 1
+    ''', (ticker,))
+    row = cur.fetchone()
+    return dict(zip([column[0] for column in cur.description], row)) if row else None
+
+
+def job_losses(job_id):
+    """Per-epoch training loss recorded so far, indexed by epoch."""
+    return pd.read_sql('SELECT epoch, loss FROM training_epochs WHERE job_id = ? ORDER BY epoch',
+                       get_connection(TRAINING_DB), params=(job_id,)).set_index('epoch')
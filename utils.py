@@ -1,15 +1,13 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import matplotlib.pyplot as plt
-import sqlite3
 from datetime import datetime, timedelta
-import google.generativeai as genai
-import os
-import time
-from supabase import create_client, Client
-from tessa import Symbol
 from streamlit_cookies_controller import CookieController
+from price_store import ensure_bars, period_returns
+from fetcher import get_fetch_executor
+from db import ALL_STOCK_DB, get_connection, transaction
+from freshness import period_is_closed
+from refresher import SOXX_STOCKS
+from instrumentation import timed, span_summary, slowest_labels, cache_summary, export_jsonl, export_prometheus
 cookie_name = st.secrets['COOKIE_NAME']
 controller = CookieController(key='cookies')
 supabase_client = st.session_state.supabase_client
@@ -25,48 +23,48 @@ def sign_out():
         # If the cookie doesn't exist, we don't need to do anything
         pass
 
+@timed('get_stock_data')
 def get_stock_data(tickers, start_date, end_date, source="yfinance"):
     data = {}
     if source == "yfinance":
-        for ticker in tickers:
-            stock = yf.Ticker(ticker)
-            hist = stock.history(start=start_date, end=end_date)
-            if not hist.empty:
-                start_price = hist['Close'][0]
-                end_price = hist['Close'][-1]
-                percent_change = ((end_price - start_price) / start_price) * 100
-                data[ticker] = percent_change
+        # Returns are computed from the local bar store; only uncovered date ranges hit the network
+        ensure_bars(tickers, start_date, end_date)
+        data = period_returns(tickers, start_date, end_date)
     elif source == "tessa":
-        for ticker in tickers:
-            try:
-                stock = Symbol(ticker)
-                start_price = stock.price_point(start_date).price
-                end_price = stock.price_point(end_date).price
-                if start_price and end_price:
-                    percent_change = ((end_price - start_price) / start_price) * 100
-                    data[ticker] = percent_change
-            except Exception as e:
-                print(f"Error fetching data for {ticker}: {e}")
+        # tessa pulls in several market-data SDKs; only this branch needs it
+        from tessa import Symbol
+
+        def tessa_percent_change(ticker):
+            stock = Symbol(ticker)
+            start_price = stock.price_point(start_date).price
+            end_price = stock.price_point(end_date).price
+            if start_price and end_price:
+                return ((end_price - start_price) / start_price) * 100
+            return None
+
+        # Tickers are fetched concurrently through the shared, rate-limited executor
+        for ticker, percent_change in get_fetch_executor().map("tessa", tessa_percent_change, tickers).items():
+            if percent_change is not None:
+                data[ticker] = percent_change
     return data
 
 
 def store_stock_data(data, start_date, end_date):
-    # Database connection and initialization
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
-    for company, percent_change in data.items():
-        if percent_change != 0:
-            c.execute('''
-                INSERT INTO stocks (company, start_date, end_date, percent_change) VALUES (?, ?, ?, ?)
-            ''', (company, start_date, end_date, percent_change))
-    conn.commit()
-    conn.close()
-
-
+    # Only closed periods are cached; the open period's return is recomputed from the bars
+    if not period_is_closed(end_date):
+        return
+    rows = [(company, start_date, end_date, percent_change)
+            for company, percent_change in data.items() if percent_change != 0]
+    with transaction(ALL_STOCK_DB) as conn:
+        conn.executemany('''
+            INSERT INTO stocks (company, start_date, end_date, percent_change) VALUES (?, ?, ?, ?)
+            ON CONFLICT (start_date, end_date, company) DO UPDATE SET percent_change = excluded.percent_change
+        ''', rows)
+
+
+@timed('db.fetch_stock_data')
 def fetch_stock_data(tickers, start_date, end_date):
-    # Database connection and initialization
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
+    c = get_connection(ALL_STOCK_DB).cursor()
     placeholders = ','.join(['?'] * len(tickers))
     query = f'''
         SELECT company, percent_change FROM stocks 
@@ -75,7 +73,6 @@ def fetch_stock_data(tickers, start_date, end_date):
     params = [start_date, end_date] + tickers
     c.execute(query, params)
     rows = c.fetchall()
-    conn.close()
     return {row[0]: row[1] for row in rows}
 
 
@@ -107,47 +104,68 @@ def get_last_n_years(n):
 
 
 def save_stock_list(name, tickers):
-    # Database connection and initialization
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
     tickers_str = ",".join(tickers)
-    c.execute('''
-        INSERT INTO stock_lists (list_name, tickers) VALUES (?, ?)
-    ''', (name, tickers_str))
-    conn.commit()
-    conn.close()
+    with transaction(ALL_STOCK_DB) as conn:
+        conn.execute('''
+            INSERT INTO stock_lists (list_name, tickers) VALUES (?, ?)
+            ON CONFLICT (list_name) DO UPDATE SET tickers = excluded.tickers
+        ''', (name, tickers_str))
 
 
 def delete_stock_list(name):
-    # Database connection and initialization
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
-    c.execute('''
-        DELETE FROM stock_lists WHERE list_name = ?
-    ''', (name,))
-    conn.commit()
-    conn.close()
+    with transaction(ALL_STOCK_DB) as conn:
+        conn.execute('''
+            DELETE FROM stock_lists WHERE list_name = ?
+        ''', (name,))
 
 
 def load_stock_lists():
-    # Database connection and initialization
-    conn = sqlite3.connect('all_stock_data.db')
-    c = conn.cursor()
+    c = get_connection(ALL_STOCK_DB).cursor()
     c.execute('''
         SELECT list_name, tickers FROM stock_lists
     ''')
     rows = c.fetchall()
-    conn.close()
     return {row[0]: row[1].split(",") for row in rows}
 
 
 def query_llm(prompt):
+    import google.generativeai as genai
     model = genai.GenerativeModel('gemini-1.5-flash')
     response = model.generate_content(prompt)
     return response.text
 
 
 
+def admin_emails():
+    # ADMIN_EMAILS may be a TOML list or one comma-separated string; a string must not be substring-matched
+    emails = st.secrets.get("ADMIN_EMAILS", [])
+    if isinstance(emails, str):
+        emails = emails.split(',')
+    return {email.strip().lower() for email in emails if email.strip()}
+
+
+def is_admin():
+    user = st.session_state.get("user")
+    return user is not None and bool(user.email) and user.email.strip().lower() in admin_emails()
+
+
+def instrumentation_panel():
+    # Rolling timings of this server process, across all sessions
+    with st.expander("Instrumentation", expanded=False):
+        st.markdown("#### Spans")
+        st.dataframe(span_summary().style.format({'p50 ms': '{:.1f}', 'p95 ms': '{:.1f}', 'max ms': '{:.1f}'}),
+                     hide_index=True, use_container_width=True)
+        st.markdown("#### Slowest tickers")
+        st.dataframe(slowest_labels('ticker').style.format({'p95 ms': '{:.1f}'}), hide_index=True,
+                     use_container_width=True)
+        st.markdown("#### Caches")
+        st.dataframe(cache_summary().style.format({'hit rate': '{:.0%}'}), hide_index=True,
+                     use_container_width=True)
+        col1, col2 = st.columns(2)
+        col1.download_button("JSONL", export_jsonl(), file_name="spans.jsonl", use_container_width=True)
+        col2.download_button("Prometheus", export_prometheus(), file_name="metrics.prom", use_container_width=True)
+
+
 def global_sidebar():
     # if not st.session_state.get("authenticated"):
     if not st.session_state.get("user"):
@@ -204,6 +222,9 @@ def global_sidebar():
                 # st.markdown("### Alerts")
                 # st.page_link("pages/Alerts.py", label="Alerts", icon="🚨")
 
+            if is_admin():
+                instrumentation_panel()
+
 
 def stock_selector():
     with st.sidebar:
@@ -218,11 +239,7 @@ def stock_selector():
                                             key="stock_way")
 
             if stock_entry_mode == "Select SOXX Stocks":
-                soxx_stocks = ['AVGO', 'NVDA', 'AMD', 'AMAT', 'QCOM', 'LRCX', 'TSM', 'KLAC', 'INTC', 'MRVL', 'MU', 'MPWR',
-                               'TXN', 'ASML', 'NXPI', 'ADI', 'MCHP', 'ON', 'TER', 'ENTG', 'SWKS', 'QRVO', 'STM', 'MKSI',
-                               'ASX',
-                               'LSCC', 'RMBS', 'UMC', 'ACLS', 'WOLF', '8035.T']
-                st.session_state.selected_tickers = st.multiselect("Select SOXX component stocks:", options=soxx_stocks,
+                st.session_state.selected_tickers = st.multiselect("Select SOXX component stocks:", options=SOXX_STOCKS,
                                                                    default=['AMAT', 'ASML', 'KLAC', '8035.T', 'LRCX'])
 
             elif stock_entry_mode == "Manage Stock Lists":